@@ -0,0 +1,10 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    """Fill the monthly usage facts from the existing usage reports"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    reports = env["contract.mobile.usage.report"].search([("state", "=", "done")])
+    env["contract.mobile.usage.fact"]._update_from_reports(reports)
@@ -11,6 +11,7 @@ from . import contract
 from . import contract_template_line
 from . import contract_line
 from . import contract_modification
+from . import contract_invoicing_partition
 from . import account_move
 from . import account_customer_settlement
 from . import account_bank_statement_line
@@ -28,6 +29,7 @@ from . import project_project
 from . import nameday
 from . import sale_order
 from . import contract_mobile_invoice
+from . import contract_mobile_usage_fact
 from . import mobile_invoice_settings
 from . import contract_supplier_installment
 from . import product_template
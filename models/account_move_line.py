@@ -2,22 +2,20 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 import base64
-import io
 import json
 import logging
 import re
 from collections import Counter
 
 from dateutil.relativedelta import relativedelta
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font, PatternFill
-from openpyxl.utils import get_column_letter
 import pytz
 
 from odoo import _, api, fields, models
 from odoo.tools import html_escape
 from odoo.tools.float_utils import float_compare
 
+from .xlsx_report_writer import XlsxReportWriter
+
 _logger = logging.getLogger(__name__)
 
 
@@ -594,54 +592,41 @@ class AccountMoveLine(models.Model):
 
     @api.model
     def _generate_customer_overpayment_report_xlsx(self, report_data, report_date):
-        workbook = Workbook()
         currency = self.env.company.currency_id
-        header_fill = PatternFill("solid", fgColor="D9EAF7")
-        alternate_fill = PatternFill("solid", fgColor="F5F5F5")
-        negative_font = Font(color="B42318", bold=True)
-        header_font = Font(bold=True)
+        writer = XlsxReportWriter(currency_symbol=currency.symbol)
         date_value = (
             fields.Date.from_string(report_date)
             if isinstance(report_date, str)
             else report_date
         )
 
-        summary_sheet = workbook.active
-        summary_sheet.title = "Súhrn"
-        summary_rows = [
-            ["Prehľad preplatkov zákazníkov"],
-            ["Dátum kontroly", date_value],
-            ["Počet zákazníkov", len(report_data)],
-            [
-                "Preplatky spolu",
-                sum(data["overpaid_amount"] for data in report_data),
-            ],
-            [],
+        summary_sheet = writer.add_sheet("Súhrn", widths={1: 28, 2: 28, 3: 28})
+        summary_sheet.append(["Prehľad preplatkov zákazníkov"], "heading")
+        summary_sheet.append(["Dátum kontroly", date_value], [None, "date"])
+        summary_sheet.append(["Počet zákazníkov", len(report_data)])
+        summary_sheet.append([
+            "Preplatky spolu",
+            sum(data["overpaid_amount"] for data in report_data),
+        ])
+        summary_sheet.append([])
+        summary_sheet.append(
             ["Zákazník", "Preplatok spolu", "Celkový otvorený zostatok"],
-        ]
-        for row in summary_rows:
-            summary_sheet.append(row)
-        summary_sheet["A1"].font = Font(bold=True, size=14)
-        summary_sheet["B2"].number_format = "DD.MM.YYYY"
-        for cell in summary_sheet[6]:
-            cell.font = header_font
-            cell.fill = header_fill
+            "bold+header",
+        )
         for index, data in enumerate(report_data, start=7):
-            summary_sheet.append([
-                data["partner"].display_name,
-                data["overpaid_amount"],
-                data["total_balance"],
-            ])
-            if index % 2 == 0:
-                for cell in summary_sheet[index]:
-                    cell.fill = alternate_fill
-            summary_sheet.cell(index, 2).font = negative_font
-        for column in range(1, 4):
-            summary_sheet.column_dimensions[get_column_letter(column)].width = 28
-        for row in summary_sheet.iter_rows(min_row=7, min_col=2, max_col=3):
-            for cell in row:
-                cell.number_format = '#,##0.00 "%s"' % currency.symbol
-                cell.alignment = Alignment(horizontal="right")
+            fill = "+alternate" if index % 2 == 0 else ""
+            summary_sheet.append(
+                [
+                    data["partner"].display_name,
+                    data["overpaid_amount"],
+                    data["total_balance"],
+                ],
+                [
+                    fill[1:] or None,
+                    "amount+right+negative" + fill,
+                    "amount+right" + fill,
+                ],
+            )
 
         used_names = {"Súhrn"}
         detail_headers = [
@@ -658,25 +643,44 @@ class AccountMoveLine(models.Model):
             "Poznámka",
             "VS",
         ]
+        detail_widths = {
+            "A": 24,
+            "B": 14,
+            "C": 14,
+            "D": 22,
+            "E": 22,
+            "F": 60,
+            "G": 18,
+            "H": 24,
+            "I": 36,
+            "J": 28,
+            "K": 42,
+            "L": 14,
+        }
+        amount_styles = [None, "amount+right"]
         for data in report_data:
-            sheet = workbook.create_sheet(
+            sheet = writer.add_sheet(
                 self._get_customer_overpayment_sheet_name(
                     data["partner"],
                     used_names,
-                )
+                ),
+                widths=detail_widths,
+                freeze_panes="A9",
+            )
+            sheet.append([data["partner"].display_name], "heading")
+            sheet.append(["Preplatok spolu", data["overpaid_amount"]], amount_styles)
+            sheet.append(["Celkový otvorený zostatok", data["total_balance"]], amount_styles)
+            sheet.append(
+                ["Preplatky v saldokonte", data["receivable_overpaid_amount"]],
+                amount_styles,
+            )
+            sheet.append(
+                ["Nespárované bankové platby", data["bank_overpaid_amount"]],
+                amount_styles,
             )
-            sheet.append([data["partner"].display_name])
-            sheet.append(["Preplatok spolu", data["overpaid_amount"]])
-            sheet.append(["Celkový otvorený zostatok", data["total_balance"]])
-            sheet.append(["Preplatky v saldokonte", data["receivable_overpaid_amount"]])
-            sheet.append(["Nespárované bankové platby", data["bank_overpaid_amount"]])
             sheet.append(["Najčastejšie používaný IBAN", data["most_used_iban"]])
             sheet.append([])
-            sheet.append(detail_headers)
-            sheet["A1"].font = Font(bold=True, size=14)
-            for cell in sheet[8]:
-                cell.font = header_font
-                cell.fill = header_fill
+            sheet.append(detail_headers, "bold+header")
             detail_rows = []
             for line in data["lines"]:
                 label = line.name or line.ref or line.move_id.ref or ""
@@ -731,42 +735,17 @@ class AccountMoveLine(models.Model):
                     row["id"],
                 ),
             )
-            row_index = 9
-            for detail_row in detail_rows:
-                sheet.append(detail_row["values"])
-                if row_index % 2 == 0:
-                    for cell in sheet[row_index]:
-                        cell.fill = alternate_fill
-                for date_cell in (sheet.cell(row_index, 2), sheet.cell(row_index, 3)):
-                    date_cell.number_format = "DD.MM.YYYY"
-                amount_cell = sheet.cell(row_index, 7)
-                amount_cell.number_format = '#,##0.00 "%s"' % currency.symbol
-                amount_cell.alignment = Alignment(horizontal="right")
+            for row_index, detail_row in enumerate(detail_rows, start=9):
+                fill = "+alternate" if row_index % 2 == 0 else ""
+                amount_style = "amount+right"
                 if detail_row["amount"] < 0:
-                    amount_cell.font = negative_font
-                row_index += 1
-
-            sheet.column_dimensions["A"].width = 24
-            sheet.column_dimensions["B"].width = 14
-            sheet.column_dimensions["C"].width = 14
-            sheet.column_dimensions["D"].width = 22
-            sheet.column_dimensions["E"].width = 22
-            sheet.column_dimensions["F"].width = 60
-            sheet.column_dimensions["G"].width = 18
-            sheet.column_dimensions["H"].width = 24
-            sheet.column_dimensions["I"].width = 36
-            sheet.column_dimensions["J"].width = 28
-            sheet.column_dimensions["K"].width = 42
-            sheet.column_dimensions["L"].width = 14
-            for row in sheet.iter_rows(min_row=2, max_row=5, min_col=2, max_col=2):
-                for cell in row:
-                    cell.number_format = '#,##0.00 "%s"' % currency.symbol
-                    cell.alignment = Alignment(horizontal="right")
-            sheet.freeze_panes = "A9"
-
-        output = io.BytesIO()
-        workbook.save(output)
-        return output.getvalue()
+                    amount_style += "+negative"
+                styles = [fill[1:] or None] * len(detail_headers)
+                styles[1] = styles[2] = "date" + fill
+                styles[6] = amount_style + fill
+                sheet.append(detail_row["values"], styles)
+
+        return writer.save()
 
     @api.model
     def _render_customer_overpayment_report_email(self, report_data, report_date):
@@ -9,10 +9,12 @@
 import base64
 import logging
 import re
+import time
+from collections import defaultdict
 
 from markupsafe import Markup
 
-from odoo import Command, api, fields, models
+from odoo import Command, api, fields, models, modules
 from odoo.exceptions import UserError, ValidationError
 from odoo.osv import expression
 from odoo.tools.translate import _
@@ -33,6 +35,11 @@ class ContractContract(models.Model):
         "portal.mixin",
     ]
 
+    _RECURRING_CREATE_BATCH_SIZE_PARAM = "contract.recurring_create_batch_size"
+    _RECURRING_CREATE_CHECKPOINT_PARAM = "contract.recurring_create_checkpoint"
+    _RECURRING_CREATE_PARTITION_SIZE_PARAM = "contract.recurring_create_partition_size"
+    _DEFAULT_RECURRING_CREATE_PARTITION_SIZE = 100
+
     active = fields.Boolean(
         default=True,
     )
@@ -183,12 +190,19 @@ class ContractContract(models.Model):
             rec.nadspotreba = rec.x_contract_type == 'Mobilky'
 
     def _compute_show_nadspotreba(self):
+        # Mobile contracts of all the partners counted in one query
+        count_by_partner = dict(
+            self.env['contract.contract']._read_group(
+                [
+                    ('partner_id', 'in', self.partner_id.ids),
+                    ('x_contract_type', '=', 'Mobilky'),
+                ],
+                ['partner_id'],
+                ['__count'],
+            )
+        )
         for rec in self:
-            contract_count = self.env['contract.contract'].search_count([
-                ('partner_id', '=', rec.partner_id.id),
-                ('x_contract_type', '=', 'Mobilky')
-            ])
-            rec.show_nadspotreba = contract_count == 1
+            rec.show_nadspotreba = count_by_partner.get(rec.partner_id, 0) == 1
 
     x_contract_type = fields.Selection(
         selection=[
@@ -234,8 +248,23 @@ class ContractContract(models.Model):
     
     @api.depends('contract_line_ids.in_inventory', 'contract_line_ids')
     def _compute_has_inventory_products(self):
-        for contract in self:
+        new_contracts = self.filtered(lambda contract: not contract.id)
+        for contract in new_contracts:
             contract.has_inventory_products = any(contract.contract_line_ids.mapped('in_inventory'))
+        contracts = self - new_contracts
+        if not contracts:
+            return
+        inventory_contracts = {
+            contract
+            for [contract] in self.env['contract.line'].with_context(
+                active_test=False
+            )._read_group(
+                [('contract_id', 'in', contracts.ids), ('in_inventory', '=', True)],
+                ['contract_id'],
+            )
+        }
+        for contract in contracts:
+            contract.has_inventory_products = contract in inventory_contracts
 
     def get_formview_id(self, access_uid=None):
         if self.contract_type == "sale":
@@ -444,6 +473,23 @@ class ContractContract(models.Model):
         invoices |= self.env["account.move"].search([("old_contract_id", "=", self.id)])
         return invoices
 
+    @api.model
+    def _get_moves_by_contract(self, moves):
+        """Map the contracts to the given moves, from their invoice lines.
+
+        Batched counterpart of ``_get_related_invoices`` restricted to
+        ``moves``: the contract of all the move lines is read at once instead
+        of searching the related invoices of each contract.
+
+        :return: dict {contract id: account.move recordset}
+        """
+        moves_by_contract = defaultdict(lambda: self.env["account.move"])
+        for line in moves.line_ids.filtered("contract_line_id"):
+            moves_by_contract[line.contract_line_id.contract_id.id] |= line.move_id
+        for move in moves.filtered("old_contract_id"):
+            moves_by_contract[move.old_contract_id.id] |= move
+        return moves_by_contract
+
     def _get_computed_currency(self):
         """Helper method for returning the theoretical computed currency."""
         self.ensure_one()
@@ -764,38 +810,123 @@ class ContractContract(models.Model):
         :return: contract lines (contract.line recordset)
         """
         self.ensure_one()
+        return self._get_lines_to_invoice_batch(date_ref)[self.id]
 
-        def can_be_invoiced(contract_line):
-            return (
-                not contract_line.is_canceled
-                and contract_line.recurring_next_date
-                and contract_line.recurring_next_date <= date_ref
-                and contract_line.next_period_date_start
-            )
+    @api.model
+    def _is_get_lines_to_invoice_overridden(self):
+        return (
+            type(self)._get_lines_to_invoice
+            is not ContractContract._get_lines_to_invoice
+        )
 
-        lines2invoice = previous = self.env["contract.line"]
-        current_section = current_note = False
-        for line in self.contract_line_ids:
-            if line.display_type == "line_section":
-                current_section = line
-            elif line.display_type == "line_note" and not line.is_recurring_note:
-                if line.note_invoicing_mode == "with_previous_line":
-                    if previous in lines2invoice:
-                        lines2invoice |= line
-                    current_note = False
-                elif line.note_invoicing_mode == "with_next_line":
-                    current_note = line
-            elif line.is_recurring_note or not line.display_type:
-                if can_be_invoiced(line):
-                    if current_section:
-                        lines2invoice |= current_section
-                        current_section = False
-                    if current_note:
-                        lines2invoice |= current_note
-                    lines2invoice |= line
-                    current_note = False
-            previous = line
-        return lines2invoice.sorted()
+    def _get_lines_to_invoice_batch(self, date_ref):
+        """
+        Batch version of :meth:`_get_lines_to_invoice` for all the contracts
+        in self.
+
+        One SQL query returns the invoiceable lines of the contracts (not
+        canceled, next invoice date reached and a next period to invoice)
+        together with their sections and notes, so the historical lines are
+        neither loaded nor walked in Python.
+        :param date_ref: date used as reference date to find lines to invoice
+        :return: dict mapping each contract id to its lines to invoice
+        """
+        ContractLine = self.env["contract.line"]
+        lines_by_contract = {contract.id: ContractLine for contract in self}
+        contract_ids = tuple(cid for cid in lines_by_contract if isinstance(cid, int))
+        if not contract_ids:
+            return lines_by_contract
+        ContractLine.flush_model(
+            [
+                "contract_id",
+                "sequence",
+                "display_type",
+                "note_invoicing_mode",
+                "is_canceled",
+                "recurring_next_date",
+                "last_date_invoiced",
+                "date_start",
+                "date_end",
+            ]
+        )
+        self.env.cr.execute(
+            """
+            WITH due AS (
+                SELECT id, contract_id
+                  FROM contract_line
+                 WHERE contract_id IN %(contract_ids)s
+                   AND recurring_next_date <= %(date_ref)s
+                   AND is_canceled IS NOT TRUE
+            ), ordered AS (
+                SELECT line.id,
+                       line.contract_id,
+                       line.sequence,
+                       line.display_type,
+                       line.note_invoicing_mode,
+                       line.id IN (SELECT id FROM due)
+                       AND (
+                            line.display_type IS NULL
+                            OR (
+                                line.display_type = 'line_note'
+                                AND line.note_invoicing_mode = 'custom'
+                            )
+                       )
+                       AND COALESCE(
+                            line.last_date_invoiced + 1, line.date_start
+                       ) IS NOT NULL
+                       AND (
+                            line.date_end IS NULL
+                            OR COALESCE(
+                                line.last_date_invoiced + 1, line.date_start
+                            ) <= line.date_end
+                       ) AS invoiceable,
+                       LAG(line.id) OVER (
+                            PARTITION BY line.contract_id
+                            ORDER BY line.sequence, line.id
+                       ) AS previous_id
+                  FROM contract_line line
+                 WHERE line.contract_id IN (SELECT contract_id FROM due)
+            )
+            SELECT id, contract_id, display_type, note_invoicing_mode,
+                   invoiceable, previous_id
+              FROM ordered
+             WHERE invoiceable OR display_type IS NOT NULL
+             ORDER BY contract_id, sequence, id
+            """,
+            {"contract_ids": contract_ids, "date_ref": date_ref},
+        )
+        line_ids_by_contract = {}
+        walk = {}
+        for (
+            line_id,
+            contract_id,
+            display_type,
+            note_invoicing_mode,
+            invoiceable,
+            previous_id,
+        ) in self.env.cr.fetchall():
+            line_ids = line_ids_by_contract.setdefault(contract_id, [])
+            current = walk.setdefault(contract_id, {"section": False, "note": False})
+            if display_type == "line_section":
+                current["section"] = line_id
+            elif display_type == "line_note" and note_invoicing_mode != "custom":
+                if note_invoicing_mode == "with_previous_line":
+                    if previous_id in line_ids:
+                        line_ids.append(line_id)
+                    current["note"] = False
+                elif note_invoicing_mode == "with_next_line":
+                    current["note"] = line_id
+            elif invoiceable:
+                if current["section"]:
+                    line_ids.append(current["section"])
+                    current["section"] = False
+                if current["note"]:
+                    line_ids.append(current["note"])
+                line_ids.append(line_id)
+                current["note"] = False
+        for contract_id, line_ids in line_ids_by_contract.items():
+            lines_by_contract[contract_id] = ContractLine.browse(line_ids)
+        return lines_by_contract
 
     def _round_price_to_two_places(self, price):
         """Round price to two decimal places, preserving 4-decimal format with zeros"""
@@ -804,6 +935,24 @@ class ContractContract(models.Model):
             return round(float(price), 2)
         return price
 
+    def _get_zlava_100_tax_map(self):
+        """Map the products of the 100% discounted contracts in self to their
+        sale taxes per company: ``{product_id: {company_id: (tax_id, ...)}}``.
+
+        The products and their taxes are read in one go for all the contracts,
+        so the discount grouping doesn't read them line by line.
+        """
+        products = self.filtered("zlava_100").contract_line_ids.product_id
+        tax_map = {}
+        for product in products:
+            company_taxes = tax_map.setdefault(product.id, {})
+            for tax in product.taxes_id:
+                company_taxes.setdefault(tax.company_id.id, []).append(tax.id)
+        for company_taxes in tax_map.values():
+            for company_id, tax_ids in company_taxes.items():
+                company_taxes[company_id] = tuple(sorted(tax_ids))
+        return tax_map
+
     def _prepare_recurring_invoices_values(self, date_ref=False):
         """
         This method builds the list of invoices values to create, based on
@@ -811,7 +960,17 @@ class ContractContract(models.Model):
         !!! The date of next invoice (recurring_next_date) is updated here !!!
         :return: list of dictionaries (invoices values)
         """
+        # Markers rendering data shared by the lines of the run
+        self = self.with_context(contract_marker_cache={})
         invoices_values = []
+        zlava_100_tax_map = self._get_zlava_100_tax_map()
+        # The batch query stands for _get_lines_to_invoice, unless a module
+        # overrides it: its lines are then fetched contract by contract
+        lines_by_contract = (
+            self._get_lines_to_invoice_batch(date_ref)
+            if date_ref and not self._is_get_lines_to_invoice_overridden()
+            else {}
+        )
         for contract in self:
             if not date_ref:
                 date_ref = contract.recurring_next_date
@@ -819,26 +978,24 @@ class ContractContract(models.Model):
                 # this use case is possible when recurring_create_invoice is
                 # called for a finished contract
                 continue
-            contract_lines = contract._get_lines_to_invoice(date_ref)
+            if contract.id in lines_by_contract:
+                contract_lines = lines_by_contract[contract.id]
+            else:
+                contract_lines = contract._get_lines_to_invoice(date_ref)
             if not contract_lines:
                 continue
             invoice_vals = contract._prepare_invoice(date_ref)
             invoice_vals["invoice_line_ids"] = []
             for line in contract_lines:
                 invoice_line_vals = line._prepare_invoice_line()
-                # Apply discounted price (x_zlavnena_cena) if commitment date is in the future
-                from datetime import date as _date
-                today = _date.today()
-                if (
-                    invoice_line_vals
-                    and line.x_zlavnena_cena is not False
-                    and line.x_datum_viazanosti_produktu
-                    and line.x_datum_viazanosti_produktu >= today
-                ):
-                    invoice_line_vals['price_unit'] = self._round_price_to_two_places(line.x_zlavnena_cena)
-                elif invoice_line_vals and 'price_unit' in invoice_line_vals:
-                    invoice_line_vals['price_unit'] = self._round_price_to_two_places(invoice_line_vals['price_unit'])
-                    
+                if invoice_line_vals:
+                    # Apply discounted price (x_zlavnena_cena) if commitment date is in the future
+                    price_unit = line._get_invoice_price_unit(
+                        invoice_line_vals.get('price_unit')
+                    )
+                    if price_unit is not None:
+                        invoice_line_vals['price_unit'] = price_unit
+
                 if invoice_line_vals:
                     # Allow extension modules to return an empty dictionary for
                     # nullifying line. We should then cleanup certain values.
@@ -854,31 +1011,18 @@ class ContractContract(models.Model):
             if contract.zlava_100 and invoice_vals["invoice_line_ids"]:
                 # Group positive amounts by their tax_ids to create matching discount lines
                 # This ensures VAT is properly offset for each tax rate
-                # We need to get taxes from the contract lines/products directly
+                # The product taxes come from the map prefetched for the whole batch
                 tax_groups = {}  # key: tuple of tax_ids (sorted), value: total amount
                 
-                # Build a map of line names to their contract lines for tax lookup
-                line_to_contract_line = {}
-                for cline in contract_lines:
-                    if cline.name:
-                        line_to_contract_line[cline.name] = cline
-                
                 for line in invoice_vals["invoice_line_ids"]:
                     if line[0] == 0:  # Command.create = 0
                         line_vals = line[2]
                         line_amount = line_vals.get('price_unit', 0) * line_vals.get('quantity', 1)
                         if line_amount > 0:
-                            # Get tax_ids from the product on the contract line
-                            tax_id_tuple = ()
-                            product_id = line_vals.get('product_id')
-                            if product_id:
-                                product = self.env['product.product'].browse(product_id)
-                                if product.exists():
-                                    # Filter taxes for this company
-                                    taxes = product.taxes_id.filtered(
-                                        lambda t: t.company_id.id == contract.company_id.id
-                                    )
-                                    tax_id_tuple = tuple(sorted(taxes.ids))
+                            # Get tax_ids of the product for this company
+                            tax_id_tuple = zlava_100_tax_map.get(
+                                line_vals.get('product_id'), {}
+                            ).get(contract.company_id.id, ())
                             
                             if tax_id_tuple not in tax_groups:
                                 tax_groups[tax_id_tuple] = 0
@@ -898,6 +1042,8 @@ class ContractContract(models.Model):
                         )
             
             invoices_values.append(invoice_vals)
+            if self.env.context.get("contract_invoice_simulation"):
+                continue
             # Force the recomputation of journal items
             contract_lines._update_recurring_next_date()
         return invoices_values
@@ -916,7 +1062,9 @@ class ContractContract(models.Model):
         return invoices
 
     @api.model
-    def _invoice_followers(self, invoices):
+    def _invoice_followers(self, invoices, moves_by_contract=None):
+        if moves_by_contract is None:
+            moves_by_contract = self._get_moves_by_contract(invoices)
         invoice_create_subtype = self.env.ref(
             "contract.mail_message_subtype_invoice_created"
         )
@@ -924,15 +1072,16 @@ class ContractContract(models.Model):
             partner_ids = item.message_follower_ids.filtered(
                 lambda x: invoice_create_subtype in x.subtype_ids
             ).mapped("partner_id")
-            if partner_ids:
-                (invoices & item._get_related_invoices()).message_subscribe(
-                    partner_ids=partner_ids.ids
-                )
+            contract_moves = moves_by_contract.get(item.id)
+            if partner_ids and contract_moves:
+                contract_moves.message_subscribe(partner_ids=partner_ids.ids)
 
     @api.model
-    def _add_contract_origin(self, invoices):
+    def _add_contract_origin(self, invoices, moves_by_contract=None):
+        if moves_by_contract is None:
+            moves_by_contract = self._get_moves_by_contract(invoices)
         for item in self:
-            for move in invoices & item._get_related_invoices():
+            for move in moves_by_contract.get(item.id, []):
                 translation = _("by contract")
                 move.message_post(
                     body=Markup(
@@ -944,13 +1093,13 @@ class ContractContract(models.Model):
     def _recurring_create_invoice(self, date_ref=False):
         invoices_values = self._prepare_recurring_invoices_values(date_ref)
         moves = self.env["account.move"].create(invoices_values)
-        self._add_contract_origin(moves)
-        self._invoice_followers(moves)
+        moves_by_contract = self._get_moves_by_contract(moves)
+        self._add_contract_origin(moves, moves_by_contract)
+        self._invoice_followers(moves, moves_by_contract)
         
         # For each contract, copy its mobile usage reports to its corresponding invoice
         for contract in self:
-            contract_moves = moves & contract._get_related_invoices()
-            for move in contract_moves:
+            for move in moves_by_contract.get(contract.id, []):
                 contract._copy_mobile_usage_reports_to_invoice(move)
         
         self._compute_recurring_next_date()
@@ -958,6 +1107,94 @@ class ContractContract(models.Model):
         moves.action_post()
         return moves
 
+    def _simulate_recurring_invoice(self, date_ref):
+        """Prepare the invoices of the contract at ``date_ref`` without
+        creating them nor moving the next invoice dates.
+
+        :return: dict with the invoice totals, the time spent and the number
+            of SQL queries run for the contract
+        """
+        self.ensure_one()
+        contract = self.with_company(self.company_id).with_context(
+            contract_invoice_simulation=True
+        )
+        cr = self.env.cr
+        query_count = cr.sql_log_count
+        started = time.perf_counter()
+        lines = contract._get_lines_to_invoice(date_ref)
+        invoices_values = contract._prepare_recurring_invoices_values(date_ref)
+        duration = time.perf_counter() - started
+        amount_untaxed = 0.0
+        invoice_line_count = 0
+        for invoice_vals in invoices_values:
+            for command in invoice_vals["invoice_line_ids"]:
+                line_vals = command[2]
+                if line_vals.get("display_type", "product") != "product":
+                    continue
+                invoice_line_count += 1
+                amount_untaxed += (
+                    line_vals.get("price_unit", 0.0)
+                    * line_vals.get("quantity", 1.0)
+                    * (1 - (line_vals.get("discount") or 0.0) / 100.0)
+                )
+        return {
+            "contract_id": self.id,
+            "contract": self.display_name,
+            "partner": self.partner_id.display_name,
+            "company_id": self.company_id.id,
+            "currency": self.currency_id.name,
+            "date_ref": date_ref,
+            "contract_line_count": len(lines),
+            "invoice_count": len(invoices_values),
+            "invoice_line_count": invoice_line_count,
+            "amount_untaxed": self.currency_id.round(amount_untaxed)
+            if self.currency_id
+            else amount_untaxed,
+            "duration": duration,
+            "query_count": cr.sql_log_count - query_count,
+        }
+
+    @api.model
+    def simulate_recurring_create_invoice(self, date_ref=None, contracts=None):
+        """Dry run of the recurring invoicing cron.
+
+        Nothing is written: no invoice is created and the next invoice dates
+        are not moved, so it can be used to forecast a run or to profile the
+        slow contracts.
+
+        :param date_ref: reference date, today by default
+        :param contracts: contracts to simulate, the ones the cron would
+            invoice at ``date_ref`` by default
+        :return: list of dicts (see :meth:`_simulate_recurring_invoice`),
+            slowest contracts first
+        """
+        if not date_ref:
+            date_ref = fields.Date.context_today(self)
+        date_ref = fields.Date.to_date(date_ref)
+        if contracts is None:
+            contracts = self.search(
+                self._get_contracts_to_recurring_create_domain(date_ref, "invoice")
+            )
+        contracts = contracts.filtered(
+            lambda contract: not contract.date_end
+            or contract.recurring_next_date <= contract.date_end
+        )
+        results = [
+            contract._simulate_recurring_invoice(date_ref) for contract in contracts
+        ]
+        results.sort(key=lambda result: result["duration"], reverse=True)
+        _logger.info(
+            "Recurring invoicing simulation for %s: %s contracts, %s invoices, "
+            "%.2f untaxed, %.2fs, %s queries",
+            date_ref,
+            len(results),
+            sum(result["invoice_count"] for result in results),
+            sum(result["amount_untaxed"] for result in results),
+            sum(result["duration"] for result in results),
+            sum(result["query_count"] for result in results),
+        )
+        return results
+
     @api.model
     def _get_recurring_create_func(self, create_type="invoice"):
         """
@@ -968,39 +1205,64 @@ class ContractContract(models.Model):
             return self.__class__._recurring_create_invoice
 
     @api.model
-    def _cron_recurring_create(self, date_ref=False, create_type="invoice"):
-        """
-        The cron function in order to create recurrent documents
-        from contracts.
-        """
+    def _recurring_create_can_commit(self):
+        return not modules.module.current_test
+
+    @api.model
+    def _get_recurring_create_batch_size(self, batch_size=None):
+        """Return the chunk size for the recurring cron, 0 meaning that all
+        the contracts are processed in a single transaction."""
+        if batch_size is None:
+            batch_size = (
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param(self._RECURRING_CREATE_BATCH_SIZE_PARAM)
+            )
+        try:
+            return max(int(batch_size or 0), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    @api.model
+    def _get_recurring_create_checkpoint(self, date_ref, create_type):
+        """Return the last contract id processed by an unfinished chunked run
+        for the same reference date and create type, 0 otherwise."""
+        value = (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(self._RECURRING_CREATE_CHECKPOINT_PARAM)
+            or ""
+        )
+        parts = value.split("|")
+        if (
+            len(parts) != 3
+            or parts[0] != fields.Date.to_string(date_ref)
+            or parts[1] != create_type
+            or not parts[2].isdigit()
+        ):
+            return 0
+        return int(parts[2])
+
+    @api.model
+    def _set_recurring_create_checkpoint(self, date_ref, create_type, last_id):
+        value = False
+        if last_id:
+            value = "%s|%s|%s" % (
+                fields.Date.to_string(date_ref),
+                create_type,
+                last_id,
+            )
+        self.env["ir.config_parameter"].sudo().set_param(
+            self._RECURRING_CREATE_CHECKPOINT_PARAM, value
+        )
+
+    @api.model
+    def _recurring_create_by_company(self, contracts, date_ref, create_type):
         _recurring_create_func = self._get_recurring_create_func(
             create_type=create_type
         )
-        if not date_ref:
-            date_ref = fields.Date.context_today(self)
-            
-        # First check and update commitments for product lines with expired commitment dates
-        all_lines = self.env['contract.line'].search([
-            ('x_datum_viazanosti_produktu', '<', date_ref),
-            ('x_datum_viazanosti_produktu', '!=', False)
-        ])
-        if all_lines:
-            all_lines._compute_commitment_discount()
-            all_lines._compute_price_subtotal()
-        
-        # Continue with regular invoice creation
-        domain = self._get_contracts_to_invoice_domain(date_ref)
-        domain = expression.AND(
-            [
-                domain,
-                [("generation_type", "=", create_type)],
-            ]
-        )
-        contracts = self.search(domain)
-        companies = set(contracts.mapped("company_id"))
-        
         # Invoice by companies, so assignation emails get correct context
-        for company in companies:
+        for company in contracts.company_id:
             contracts_to_invoice = contracts.filtered(
                 lambda contract, comp=company: contract.company_id == comp
                 and (
@@ -1009,11 +1271,179 @@ class ContractContract(models.Model):
                 )
             ).with_company(company)
             _recurring_create_func(contracts_to_invoice, date_ref)
+
+    @api.model
+    def _cron_recurring_create_chunked(
+        self, contracts, date_ref, create_type, batch_size
+    ):
+        """Create the recurring documents of ``contracts`` in chunks of
+        ``batch_size`` contracts, committing after each chunk.
+
+        The id of the last processed contract is stored as a checkpoint, so a
+        run for the same reference date that crashed or timed out resumes
+        after it instead of invoicing the same contracts twice.
+        """
+        can_commit = self._recurring_create_can_commit()
+        checkpoint = self._get_recurring_create_checkpoint(date_ref, create_type)
+        contracts = contracts.filtered(lambda c: c.id > checkpoint).sorted("id")
+        if checkpoint:
+            _logger.info(
+                "Resuming recurring %s creation for %s after contract %s",
+                create_type,
+                date_ref,
+                checkpoint,
+            )
+        if can_commit:
+            self.env.cr.commit()
+        for start in range(0, len(contracts), batch_size):
+            batch = contracts[start : start + batch_size]
+            self._recurring_create_by_company(batch, date_ref, create_type)
+            self._set_recurring_create_checkpoint(date_ref, create_type, batch[-1].id)
+            if can_commit:
+                self.env.cr.commit()
+            _logger.info(
+                "Recurring %s creation for %s: %s/%s contracts processed",
+                create_type,
+                date_ref,
+                min(start + batch_size, len(contracts)),
+                len(contracts),
+            )
+        self._set_recurring_create_checkpoint(date_ref, create_type, False)
         return True
 
     @api.model
-    def cron_recurring_create_invoice(self, date_ref=None):
-        return self._cron_recurring_create(date_ref, create_type="invoice")
+    def _get_contracts_to_recurring_create(self, date_ref, create_type):
+        """Refresh the expired commitments and return the contracts due for
+        the recurring creation at ``date_ref``."""
+        # First check and update commitments for product lines whose
+        # commitment date expired since the previous run
+        self.env["contract.line"]._process_expired_commitments(date_ref)
+        
+        # Continue with regular invoice creation
+        return self.search(
+            self._get_contracts_to_recurring_create_domain(date_ref, create_type)
+        )
+
+    @api.model
+    def _get_contracts_to_recurring_create_domain(self, date_ref, create_type):
+        domain = self._get_contracts_to_invoice_domain(date_ref)
+        return expression.AND(
+            [
+                domain,
+                [("generation_type", "=", create_type)],
+            ]
+        )
+
+    @api.model
+    def _cron_recurring_create(
+        self, date_ref=False, create_type="invoice", batch_size=None
+    ):
+        """
+        The cron function in order to create recurrent documents
+        from contracts.
+
+        When a batch size is given (or configured through the
+        ``contract.recurring_create_batch_size`` system parameter), the
+        contracts are processed in chunks committed one by one, see
+        :meth:`_cron_recurring_create_chunked`.
+        """
+        if not date_ref:
+            date_ref = fields.Date.context_today(self)
+        contracts = self._get_contracts_to_recurring_create(date_ref, create_type)
+        batch_size = self._get_recurring_create_batch_size(batch_size)
+        if batch_size:
+            return self._cron_recurring_create_chunked(
+                contracts, date_ref, create_type, batch_size
+            )
+        self._recurring_create_by_company(contracts, date_ref, create_type)
+        return True
+
+    @api.model
+    def _get_recurring_create_partition_size(self, partition_size=None):
+        if partition_size is None:
+            partition_size = (
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param(self._RECURRING_CREATE_PARTITION_SIZE_PARAM)
+            )
+        try:
+            partition_size = int(partition_size or 0)
+        except (TypeError, ValueError):
+            partition_size = 0
+        return (
+            partition_size
+            if partition_size > 0
+            else self._DEFAULT_RECURRING_CREATE_PARTITION_SIZE
+        )
+
+    @api.model
+    def _cron_recurring_create_partitioned(
+        self, date_ref=False, create_type="invoice", partition_size=None
+    ):
+        """Worker entry point of a parallel recurring creation run.
+
+        The first worker splits the due contracts into partitions by company
+        and contract id range (``contract.invoicing.partition``). Then every
+        worker claims pending partitions with ``FOR UPDATE SKIP LOCKED`` and
+        processes them one by one, committing after each of them, until none
+        is left. Several cron jobs running this method at the same time share
+        the run between them.
+
+        :return: number of partitions processed by this worker
+        """
+        if not date_ref:
+            date_ref = fields.Date.context_today(self)
+        Partition = self.env["contract.invoicing.partition"].sudo()
+        can_commit = self._recurring_create_can_commit()
+        if not Partition.search_count(
+            [("date_ref", "=", date_ref), ("create_type", "=", create_type)]
+        ):
+            contracts = self._get_contracts_to_recurring_create(date_ref, create_type)
+            Partition._plan(
+                contracts,
+                date_ref,
+                create_type,
+                self._get_recurring_create_partition_size(partition_size),
+            )
+            if can_commit:
+                self.env.cr.commit()
+        processed = 0
+        while True:
+            partition = Partition._claim(date_ref, create_type)
+            if not partition:
+                break
+            if can_commit:
+                self.env.cr.commit()
+            try:
+                partition._process()
+            except Exception as err:
+                if not can_commit:
+                    raise
+                self.env.cr.rollback()
+                _logger.exception(
+                    "Recurring %s creation failed for partition %s",
+                    create_type,
+                    partition.id,
+                )
+                partition.write({"state": "failed", "failure_reason": str(err)})
+            if can_commit:
+                self.env.cr.commit()
+            processed += 1
+        return processed
+
+    @api.model
+    def cron_recurring_create_invoice(self, date_ref=None, batch_size=None):
+        return self._cron_recurring_create(
+            date_ref, create_type="invoice", batch_size=batch_size
+        )
+
+    @api.model
+    def cron_recurring_create_invoice_partitioned(
+        self, date_ref=None, partition_size=None
+    ):
+        return self._cron_recurring_create_partitioned(
+            date_ref, create_type="invoice", partition_size=partition_size
+        )
         
     def _send_commitment_expiration_notification(self, notification_type='2month'):
         """Send notification email about commitment expiration"""
@@ -1115,6 +1545,9 @@ class ContractContract(models.Model):
 
     @api.depends('contract_line_ids.price_subtotal')
     def _compute_total_subtotal(self):
+        # price_subtotal is not stored: it is computed for the lines of all
+        # the contracts in one batch, then summed per contract
+        self.contract_line_ids.mapped('price_subtotal')
         for contract in self:
             contract.total_subtotal = sum(contract.contract_line_ids.mapped('price_subtotal'))
             
@@ -1149,13 +1582,11 @@ class ContractContract(models.Model):
             # Create the attachment on the invoice
             if not latest_report.name.lower().endswith('.xlsx'):
                 latest_report.name += '.xlsx'
-            new_attachment = self.env['ir.attachment'].create({
-                'name': latest_report.name,
-                'type': 'binary',
-                'datas': latest_report.datas,
+            # The report file is shared with the contract attachment, no
+            # content is read nor written
+            new_attachment = latest_report._copy_shared({
                 'res_model': 'account.move',
                 'res_id': invoice.id,
-                'mimetype': latest_report.mimetype,
                 'description': f"Mobile Usage Report copied from contract {self.name}"
             })
             # Set it as the main attachment so it's included in mail notifications
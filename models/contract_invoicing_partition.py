@@ -0,0 +1,230 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+
+from odoo import api, fields, models
+from odoo.osv import expression
+
+_logger = logging.getLogger(__name__)
+
+
+class ContractInvoicingPartition(models.Model):
+    """Slice of a recurring invoicing run (one company, one contract id range)
+    that a single cron worker claims and processes on its own."""
+
+    _name = "contract.invoicing.partition"
+    _description = "Contract Invoicing Partition"
+    _order = "date_ref desc, company_id, contract_id_from"
+
+    _MAX_ATTEMPTS_PARAM = "contract.invoicing_partition_max_attempts"
+    _DEFAULT_MAX_ATTEMPTS = 3
+
+    date_ref = fields.Date(string="Reference Date", required=True, index=True)
+    create_type = fields.Char(required=True, default="invoice")
+    company_id = fields.Many2one(
+        comodel_name="res.company",
+        required=True,
+        ondelete="cascade",
+    )
+    contract_id_from = fields.Integer(required=True)
+    contract_id_to = fields.Integer(required=True)
+    contract_count = fields.Integer()
+    state = fields.Selection(
+        selection=[
+            ("pending", "Pending"),
+            ("processing", "Processing"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        index=True,
+    )
+    claimed_at = fields.Datetime()
+    attempt_count = fields.Integer(default=0, copy=False)
+    done_at = fields.Datetime()
+    failure_reason = fields.Text()
+
+    _sql_constraints = [
+        (
+            "partition_range_uniq",
+            "unique(date_ref, create_type, company_id, contract_id_from)",
+            "This invoicing partition already exists.",
+        )
+    ]
+
+    @api.model
+    def _plan(self, contracts, date_ref, create_type, partition_size):
+        """Split ``contracts`` into partitions of at most ``partition_size``
+        contracts of the same company, unless the run is already planned.
+
+        A transaction-level advisory lock makes sure that only one of the
+        workers starting at the same time plans the run.
+        """
+        self.env.cr.execute(
+            "SELECT pg_advisory_xact_lock(hashtext(%s))",
+            ["%s|%s|%s" % (self._table, date_ref, create_type)],
+        )
+        partitions = self.search(
+            [("date_ref", "=", date_ref), ("create_type", "=", create_type)]
+        )
+        if partitions:
+            return partitions
+        vals_list = []
+        for company in contracts.company_id:
+            company_contracts = contracts.filtered(
+                lambda c, comp=company: c.company_id == comp
+            ).sorted("id")
+            for start in range(0, len(company_contracts), partition_size):
+                chunk = company_contracts[start : start + partition_size]
+                vals_list.append(
+                    {
+                        "date_ref": date_ref,
+                        "create_type": create_type,
+                        "company_id": company.id,
+                        "contract_id_from": chunk[0].id,
+                        "contract_id_to": chunk[-1].id,
+                        "contract_count": len(chunk),
+                    }
+                )
+        return self.create(vals_list)
+
+    @api.model
+    def _get_max_attempts(self):
+        max_attempts = (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(self._MAX_ATTEMPTS_PARAM, self._DEFAULT_MAX_ATTEMPTS)
+        )
+        try:
+            max_attempts = int(max_attempts or 0)
+        except (TypeError, ValueError):
+            max_attempts = 0
+        return max_attempts if max_attempts > 0 else self._DEFAULT_MAX_ATTEMPTS
+
+    @api.model
+    def _claim(self, date_ref, create_type):
+        """Claim the next pending partition of the run, skipping the ones
+        locked by other workers.
+
+        A partition being processed stays locked until its transaction ends
+        (see ``_process``), so it is never claimed twice. Partitions left in
+        processing by a worker that died are claimed again after an hour, and
+        failed partitions are retried up to the number of attempts of the
+        ``contract.invoicing_partition_max_attempts`` system parameter. The
+        stale partitions without attempt left are marked as failed.
+        """
+        stale_processing_cutoff = fields.Datetime.subtract(
+            fields.Datetime.now(), hours=1
+        )
+        max_attempts = self._get_max_attempts()
+        self.env.cr.execute(
+            """
+            SELECT id
+              FROM contract_invoicing_partition
+             WHERE date_ref = %s
+               AND create_type = %s
+               AND state = 'processing'
+               AND (claimed_at IS NULL OR claimed_at < %s)
+               AND COALESCE(attempt_count, 0) >= %s
+               FOR UPDATE SKIP LOCKED
+            """,
+            [date_ref, create_type, stale_processing_cutoff, max_attempts],
+        )
+        exhausted = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if exhausted:
+            exhausted.write(
+                {
+                    "state": "failed",
+                    "failure_reason": "The partition was not processed after %s "
+                    "attempts" % max_attempts,
+                }
+            )
+        self.env.cr.execute(
+            """
+            SELECT id
+              FROM contract_invoicing_partition
+             WHERE date_ref = %s
+               AND create_type = %s
+               AND (
+                    state = 'pending'
+                    OR (
+                        state = 'processing'
+                        AND (claimed_at IS NULL OR claimed_at < %s)
+                        AND COALESCE(attempt_count, 0) < %s
+                    )
+                    OR (
+                        state = 'failed'
+                        AND COALESCE(attempt_count, 0) < %s
+                    )
+               )
+             ORDER BY id
+             FOR UPDATE SKIP LOCKED
+             LIMIT 1
+            """,
+            [
+                date_ref,
+                create_type,
+                stale_processing_cutoff,
+                max_attempts,
+                max_attempts,
+            ],
+        )
+        row = self.env.cr.fetchone()
+        partition = self.browse(row[0] if row else [])
+        if partition:
+            partition.write(
+                {
+                    "state": "processing",
+                    "claimed_at": fields.Datetime.now(),
+                    "attempt_count": partition.attempt_count + 1,
+                    "failure_reason": False,
+                }
+            )
+        return partition
+
+    def _get_contracts_domain(self):
+        self.ensure_one()
+        return expression.AND(
+            [
+                self.env[
+                    "contract.contract"
+                ]._get_contracts_to_recurring_create_domain(
+                    self.date_ref, self.create_type
+                ),
+                [
+                    ("company_id", "=", self.company_id.id),
+                    ("id", ">=", self.contract_id_from),
+                    ("id", "<=", self.contract_id_to),
+                ],
+            ]
+        )
+
+    def _process(self):
+        """Create the recurring documents of the partition contracts.
+
+        Contracts are searched again, so the ones already invoiced by a
+        previous attempt (their next date moved forward) are skipped. The
+        partition row stays locked until the end of the transaction, so no
+        other worker claims it while its contracts are being invoiced.
+        """
+        self.ensure_one()
+        self.env.cr.execute(
+            "SELECT id FROM contract_invoicing_partition WHERE id = %s FOR UPDATE",
+            [self.id],
+        )
+        Contract = self.env["contract.contract"]
+        contracts = Contract.search(self._get_contracts_domain())
+        Contract._recurring_create_by_company(
+            contracts, self.date_ref, self.create_type
+        )
+        self.write({"state": "done", "done_at": fields.Datetime.now()})
+
+    @api.autovacuum
+    def _gc_done_partitions(self):
+        """Remove the done and failed partitions of the runs older than 30
+        days"""
+        limit_date = fields.Date.subtract(fields.Date.today(), days=30)
+        self.search(
+            [("state", "in", ("done", "failed")), ("date_ref", "<", limit_date)]
+        ).unlink()
@@ -3,14 +3,18 @@
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+from collections import defaultdict
 from datetime import timedelta
 
 from dateutil.relativedelta import relativedelta
 
 from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
+from odoo.osv import expression
+from odoo.tools.sql import create_index
 
-from .contract_line_constraints import get_allowed
+from . import contract_recurrency_engine as engine
+from .contract_line_constraints import get_allowed_batch
 
 
 class ContractLine(models.Model):
@@ -23,6 +27,9 @@ class ContractLine(models.Model):
     ]
     _order = "sequence,id"
 
+    _STATE_LAST_RUN_PARAM = "contract.line_state_last_run"
+    _COMMITMENT_EXPIRY_LAST_RUN_PARAM = "contract.commitment_expiry_last_run"
+
     sequence = fields.Integer()
     contract_id = fields.Many2one(
         comodel_name="contract.contract",
@@ -136,7 +143,8 @@ class ContractLine(models.Model):
             ("canceled", "Canceled"),
         ],
         compute="_compute_state",
-        search="_search_state",
+        store=True,
+        index=True,
     )
     active = fields.Boolean(
         string="Active",
@@ -145,11 +153,62 @@ class ContractLine(models.Model):
         readonly=True,
     )
 
+    def init(self):
+        # Back the SQL prefilter of the lines to invoice
+        # (contract.contract._get_lines_to_invoice_batch)
+        create_index(
+            self.env.cr,
+            "contract_line_contract_next_date_canceled_index",
+            self._table,
+            ["contract_id", "recurring_next_date", "is_canceled"],
+        )
+        create_index(
+            self.env.cr,
+            "contract_line_contract_sequence_index",
+            self._table,
+            ["contract_id", "sequence", "id"],
+        )
+
+    @api.model
+    def _process_expired_commitments(self, date_ref=None):
+        """Recompute the commitment discount and subtotal of the lines whose
+        commitment date expired since the previous call.
+
+        The reference date of the previous call is kept as a watermark in
+        the ``contract.commitment_expiry_last_run`` system parameter, so the
+        lines expired for a long time are not processed again on each run.
+        The first call processes all the expired commitments. The discount
+        is computed against today, so a later ``date_ref`` is capped to
+        today: the commitments still running are processed once they expire.
+        :return: processed contract lines
+        """
+        IrConfig = self.env["ir.config_parameter"].sudo()
+        today = fields.Date.context_today(self)
+        date_ref = min(fields.Date.to_date(date_ref or today), today)
+        domain = [
+            ("x_datum_viazanosti_produktu", "<", date_ref),
+            ("x_datum_viazanosti_produktu", "!=", False),
+        ]
+        last_run = IrConfig.get_param(self._COMMITMENT_EXPIRY_LAST_RUN_PARAM)
+        if last_run:
+            last_run = fields.Date.to_date(last_run)
+            if last_run >= date_ref:
+                return self.browse()
+            domain.append(("x_datum_viazanosti_produktu", ">=", last_run))
+        lines = self.search(domain)
+        if lines:
+            lines._compute_commitment_discount()
+            lines._compute_price_subtotal()
+        IrConfig.set_param(
+            self._COMMITMENT_EXPIRY_LAST_RUN_PARAM, fields.Date.to_string(date_ref)
+        )
+        return lines
+
     @api.model
     def recompute_commitment_discounts(self):
-        """Refresh stored commitment discount values after dependency fixes."""
-        lines = self.search([])
-        lines._compute_commitment_discount()
+        """Refresh stored commitment discount values of the commitments
+        expired since the last refresh."""
+        self._process_expired_commitments()
         return True
 
     @api.depends(
@@ -164,18 +223,9 @@ class ContractLine(models.Model):
             # Skip if we're in a no_recompute context
             if self.env.context.get('no_next_period_recompute'):
                 continue
-                
-            if rec.last_date_invoiced:
-                next_period_date_start = rec.last_date_invoiced + relativedelta(days=1)
-            else:
-                next_period_date_start = rec.date_start
-            if (
-                rec.date_end
-                and next_period_date_start
-                and next_period_date_start > rec.date_end
-            ):
-                next_period_date_start = False
-            rec.next_period_date_start = next_period_date_start
+            rec.next_period_date_start = engine.get_next_period_date_start(
+                rec.last_date_invoiced, rec.date_start, rec.date_end
+            )
 
     @api.depends(
         "next_period_date_start",
@@ -304,110 +354,45 @@ class ContractLine(models.Model):
                     rec.state = "closed"
 
     @api.model
-    def _get_state_domain(self, state):
-        today = fields.Date.context_today(self)
-        if state == "upcoming":
-            return [
-                "&",
-                ("date_start", ">", today),
-                ("is_canceled", "=", False),
-            ]
-        if state == "in-progress":
-            return [
-                "&",
-                "&",
-                "&",
-                ("date_start", "<=", today),
-                ("is_canceled", "=", False),
-                "|",
-                ("date_end", ">=", today),
-                ("date_end", "=", False),
-                "|",
-                ("is_auto_renew", "=", True),
-                "&",
-                ("is_auto_renew", "=", False),
-                ("termination_notice_date", ">", today),
-            ]
-        if state == "to-renew":
-            return [
-                "&",
-                "&",
-                ("is_canceled", "=", False),
-                ("date_end", "<", today),
-                "|",
-                "&",
-                ("manual_renew_needed", "=", True),
-                ("successor_contract_line_id", "=", False),
-                ("is_auto_renew", "=", True),
-            ]
-        if state == "upcoming-close":
-            return [
-                "&",
-                "&",
-                "&",
-                "&",
-                "&",
-                ("date_start", "<=", today),
-                ("is_auto_renew", "=", False),
-                ("manual_renew_needed", "=", False),
-                ("is_canceled", "=", False),
-                ("termination_notice_date", "<", today),
-                ("date_end", ">=", today),
-            ]
-        if state == "closed":
-            return [
-                "&",
-                "&",
-                "&",
-                ("is_canceled", "=", False),
-                ("date_end", "<", today),
-                ("is_auto_renew", "=", False),
-                "|",
-                "&",
-                ("manual_renew_needed", "=", True),
-                ("successor_contract_line_id", "!=", False),
-                ("manual_renew_needed", "=", False),
-            ]
-        if state == "canceled":
-            return [("is_canceled", "=", True)]
-        if not state:
-            return [("display_type", "!=", False)]
+    def _get_state_transition_domain(self, last_run, today):
+        """Lines whose state depends on the current date and may have changed
+        between ``last_run`` and ``today``: they started, ended or entered
+        their termination notice period in between."""
+        return [
+            ("display_type", "=", False),
+            "|",
+            "|",
+            "&",
+            ("date_start", ">", last_run),
+            ("date_start", "<=", today),
+            "&",
+            ("date_end", ">=", last_run),
+            ("date_end", "<", today),
+            "&",
+            ("termination_notice_date", ">=", last_run),
+            ("termination_notice_date", "<", today),
+        ]
 
     @api.model
-    def _search_state(self, operator, value):
-        states = [
-            "upcoming",
-            "in-progress",
-            "to-renew",
-            "upcoming-close",
-            "closed",
-            "canceled",
-            False,
-        ]
-        if operator == "=":
-            return self._get_state_domain(value)
-        if operator == "!=":
-            domain = []
-            for state in states:
-                if state != value:
-                    if domain:
-                        domain.insert(0, "|")
-                    domain.extend(self._get_state_domain(state))
-            return domain
-        if operator == "in":
-            domain = []
-            for state in value:
-                if domain:
-                    domain.insert(0, "|")
-                domain.extend(self._get_state_domain(state))
-            return domain
-
-        if operator == "not in":
-            if set(value) == set(states):
-                return [("id", "=", False)]
-            return self._search_state(
-                "in", [state for state in states if state not in value]
+    def cron_update_state(self):
+        """Refresh the stored state of the lines that crossed a date boundary
+        since the last run. The first run refreshes all the lines."""
+        IrConfig = self.env["ir.config_parameter"].sudo()
+        today = fields.Date.context_today(self)
+        last_run = IrConfig.get_param(self._STATE_LAST_RUN_PARAM)
+        if last_run:
+            domain = self._get_state_transition_domain(
+                fields.Date.to_date(last_run), today
             )
+        else:
+            domain = [("display_type", "=", False)]
+        lines = self.with_context(active_test=False).search(domain)
+        if lines:
+            # Recompute the stored field without going through write()
+            self.env.add_to_compute(self._fields["state"], lines)
+            lines.flush_recordset(["state"])
+        IrConfig.set_param(self._STATE_LAST_RUN_PARAM, fields.Date.to_string(today))
+        return True
 
     @api.depends(
         "date_start",
@@ -420,40 +405,53 @@ class ContractLine(models.Model):
         "contract_id.is_terminated",
     )
     def _compute_allowed(self):
-        for rec in self:
-            rec.update(
-                {
-                    "is_plan_successor_allowed": False,
-                    "is_stop_plan_successor_allowed": False,
-                    "is_stop_allowed": False,
-                    "is_cancel_allowed": False,
-                    "is_un_cancel_allowed": False,
-                }
+        self.update(
+            {
+                "is_plan_successor_allowed": False,
+                "is_stop_plan_successor_allowed": False,
+                "is_stop_allowed": False,
+                "is_cancel_allowed": False,
+                "is_un_cancel_allowed": False,
+            }
+        )
+        lines = self.filtered(
+            lambda rec: rec.date_start and not rec.contract_id.is_terminated
+        )
+        if not lines:
+            return
+        # Resolve all the predecessor -> successor links in a single read
+        predecessors = lines.predecessor_contract_line_id
+        predecessor_has_successor = {
+            predecessor.id: bool(predecessor.successor_contract_line_id)
+            for predecessor in predecessors
+        }
+        allowed_list = get_allowed_batch(
+            (
+                rec.date_start,
+                rec.date_end,
+                rec.last_date_invoiced,
+                rec.is_auto_renew,
+                rec.successor_contract_line_id,
+                predecessor_has_successor.get(
+                    rec.predecessor_contract_line_id.id, False
+                ),
+                rec.is_canceled,
             )
-            if rec.contract_id.is_terminated:
-                continue
-            if rec.date_start:
-                allowed = get_allowed(
-                    rec.date_start,
-                    rec.date_end,
-                    rec.last_date_invoiced,
-                    rec.is_auto_renew,
-                    rec.successor_contract_line_id,
-                    rec.predecessor_contract_line_id,
-                    rec.is_canceled,
+            for rec in lines
+        )
+        for rec, allowed in zip(lines, allowed_list):
+            if allowed:
+                rec.update(
+                    {
+                        "is_plan_successor_allowed": allowed.plan_successor,
+                        "is_stop_plan_successor_allowed": (
+                            allowed.stop_plan_successor
+                        ),
+                        "is_stop_allowed": allowed.stop,
+                        "is_cancel_allowed": allowed.cancel,
+                        "is_un_cancel_allowed": allowed.uncancel,
+                    }
                 )
-                if allowed:
-                    rec.update(
-                        {
-                            "is_plan_successor_allowed": allowed.plan_successor,
-                            "is_stop_plan_successor_allowed": (
-                                allowed.stop_plan_successor
-                            ),
-                            "is_stop_allowed": allowed.stop,
-                            "is_cancel_allowed": allowed.cancel,
-                            "is_un_cancel_allowed": allowed.uncancel,
-                        }
-                    )
 
     @api.constrains("is_auto_renew", "successor_contract_line_id", "date_end")
     def _check_allowed(self):
@@ -698,6 +696,23 @@ class ContractLine(models.Model):
             "product_id": self.product_id.id,
         }
 
+    def _get_invoice_price_unit(self, price_unit, date=None):
+        """Unit price invoiced for the line on ``date`` (today by default).
+
+        The discounted price (x_zlavnena_cena) replaces ``price_unit``, the
+        price of ``_prepare_invoice_line``, until the commitment date of the
+        product. The price is rounded to two decimals.
+        """
+        self.ensure_one()
+        date = date or fields.Date.today()
+        if (
+            self.x_zlavnena_cena is not False
+            and self.x_datum_viazanosti_produktu
+            and self.x_datum_viazanosti_produktu >= date
+        ):
+            price_unit = self.x_zlavnena_cena
+        return self.contract_id._round_price_to_two_places(price_unit)
+
     def _get_period_to_invoice(
         self, last_date_invoiced, recurring_next_date, stop_at_date_end=True
     ):
@@ -775,47 +790,196 @@ class ContractLine(models.Model):
             
         return " ".join(result)
             
+    def _get_marker_cache(self, key, compute):
+        """Value of ``key`` in the marker cache of the current invoicing run.
+
+        ``_prepare_recurring_invoices_values`` puts a ``contract_marker_cache``
+        dict in the context, so the lines of a run don't look up the same
+        language and translations again and again. Without it, the value is
+        computed on each call.
+        """
+        cache = self.env.context.get("contract_marker_cache")
+        if cache is None:
+            return compute()
+        if key not in cache:
+            cache[key] = compute()
+        return cache[key]
+
+    @api.model
+    def _get_marker_lang_data(self, lang_code):
+        """Return the date format and the translated month names (keyed by
+        "MM") used to render the markers for ``lang_code``.
+        """
+
+        def compute():
+            lang = self.env["res.lang"].search([("code", "=", lang_code)], limit=1)
+            translator = self.with_context(lang=lang.code)
+            month_names = {
+                month: translator._translate_marker_month_name(month)
+                for month in (f"{number:02d}" for number in range(1, 13))
+            }
+            return lang.date_format or "%m/%d/%Y", month_names
+
+        return self._get_marker_cache(("lang", lang_code), compute)
+
+    @api.model
+    def _get_marker_months_str(self, first_date_invoiced, last_date_invoiced):
+        """Month list of a period, as displayed on SETEM invoices."""
+
+        def compute():
+            months_list = self._get_months_list(
+                first_date_invoiced, last_date_invoiced
+            )
+            return self._format_months_for_invoice(months_list)
+
+        return self._get_marker_cache(
+            ("months", first_date_invoiced, last_date_invoiced), compute
+        )
+
     def _insert_markers(self, first_date_invoiced, last_date_invoiced):
         self.ensure_one()
-        lang_obj = self.env["res.lang"]
-        lang = lang_obj.search([("code", "=", self.contract_id.partner_id.lang)])
-        date_format = lang.date_format or "%m/%d/%Y"
+        date_format, month_names = self._get_marker_lang_data(
+            self.contract_id.partner_id.lang
+        )
         name = self.name
         name = name.replace("#START#", first_date_invoiced.strftime(date_format))
         name = name.replace("#END#", last_date_invoiced.strftime(date_format))
         name = name.replace(
             "#INVOICEMONTHNAME#",
-            self.with_context(lang=lang.code)._translate_marker_month_name(
-                first_date_invoiced.strftime("%m")
-            ),
+            month_names[first_date_invoiced.strftime("%m")],
         )
         
         # Add month information for SETEM s.r.o. contracts
         if self.contract_id.company_id and self.contract_id.company_id.id == 3:  # SETEM s.r.o.
-            months_list = self._get_months_list(first_date_invoiced, last_date_invoiced)
-            months_str = self._format_months_for_invoice(months_list)
+            months_str = self._get_marker_months_str(
+                first_date_invoiced, last_date_invoiced
+            )
             if months_str:
                 name += _(" za mesiace %s") % months_str
                 
         return name
 
-    def _update_recurring_next_date(self):
-        for rec in self:
-            # 1. Compute the period just invoiced
-            if rec.last_date_invoiced:
-                period_start = rec.last_date_invoiced + relativedelta(days=1)
-            else:
-                period_start = rec.date_start
+    @api.model
+    def _get_forecast_domain(self):
+        return [
+            ("display_type", "=", False),
+            ("is_canceled", "=", False),
+            ("recurring_next_date", "!=", False),
+            ("contract_id.active", "=", True),
+            ("contract_id.is_terminated", "=", False),
+        ]
 
-            period_end = rec.get_next_period_date_end(
-                period_start,
-                rec.recurring_rule_type,
-                rec.recurring_interval,
-                max_date_end=rec.date_end,
-                next_invoice_date=rec.recurring_next_date,
-                recurring_invoicing_type=rec.recurring_invoicing_type,
-                recurring_invoicing_offset=rec.recurring_invoicing_offset,
+    def _get_forecast_quantity(self):
+        self.ensure_one()
+        if self.is_mobile_service and self.mobile_service_ids:
+            return len(self.mobile_service_ids.filtered("is_active"))
+        return self.quantity
+
+    def _get_forecast_schedule(self, date_to):
+        """Project the invoices of the lines up to ``date_to``.
+
+        Auto-renewed lines are considered as renewed for ever.
+
+        :return: dict mapping each line id to a list of tuples
+            ``(invoice_date, period_start, period_end, amount)``
+        """
+        schedules = engine.get_invoice_schedule(
+            (
+                (
+                    line.last_date_invoiced,
+                    line.date_start,
+                    False if line.is_auto_renew else line.date_end,
+                    line.recurring_next_date,
+                    line.recurring_rule_type,
+                    line.recurring_interval,
+                    line.recurring_invoicing_type,
+                    line.recurring_invoicing_offset,
+                )
+                for line in self
+            ),
+            date_to,
+            self._get_recurrency_calc(),
+        )
+        result = {}
+        for line, schedule in zip(self, schedules):
+            quantity = line._get_forecast_quantity()
+            discount = 1 - line.discount / 100
+            result[line.id] = [
+                (
+                    period.next_invoice_date,
+                    period.date_start,
+                    period.date_end,
+                    quantity
+                    * line._get_invoice_price_unit(line.price_unit, period.next_invoice_date)
+                    * discount,
+                )
+                for period in schedule
+            ]
+        return result
+
+    @api.model
+    def get_revenue_forecast(
+        self,
+        months=12,
+        date_from=None,
+        groupby=("partner_id", "company_id", "x_contract_type"),
+        domain=None,
+    ):
+        """Forecast the invoiced amounts of the active contract lines.
+
+        :param months: number of months to project, starting with the month
+            of ``date_from`` (today by default)
+        :param groupby: contract fields to group the amounts by, the
+            contract currency is always part of the grouping
+        :param domain: optional domain restricting the contract lines
+        :return: list of dicts with the ``groupby`` values (ids for
+            relational fields), ``currency_id``, ``month`` (first day of the
+            month), ``amount`` (untaxed) and ``invoice_count``, ordered by
+            month
+        """
+        date_from = fields.Date.to_date(
+            date_from or fields.Date.context_today(self)
+        ).replace(day=1)
+        date_to = date_from + relativedelta(months=months, days=-1)
+        lines = self.search(
+            expression.AND([self._get_forecast_domain(), domain or []])
+        )
+        schedules = lines._get_forecast_schedule(date_to)
+        totals = defaultdict(lambda: [0.0, 0])
+        for line in lines:
+            contract = line.contract_id
+            key = tuple(
+                contract[fname].id
+                if contract._fields[fname].relational
+                else contract[fname]
+                for fname in groupby
+            ) + (contract.currency_id.id,)
+            for invoice_date, _start, _end, amount in schedules[line.id]:
+                if invoice_date < date_from:
+                    # Late invoices are forecast in the first month
+                    invoice_date = date_from
+                total = totals[key + (invoice_date.replace(day=1),)]
+                total[0] += amount
+                total[1] += 1
+        result = []
+        for key, (amount, invoice_count) in totals.items():
+            values = dict(zip(groupby, key))
+            values.update(
+                currency_id=key[-2],
+                month=key[-1],
+                amount=amount,
+                invoice_count=invoice_count,
             )
+            result.append(values)
+        result.sort(key=lambda values: values["month"])
+        return result
+
+    def _update_recurring_next_date(self):
+        # 1. Compute the periods just invoiced, for all the lines at once
+        periods = self._get_next_periods()
+        calc = self._get_recurrency_calc()
+        for rec in self:
+            period_end = periods[rec.id].date_end
 
             # 2. Set last_date_invoiced to the end of the period just invoiced
             rec.last_date_invoiced = period_end
@@ -825,13 +989,13 @@ class ContractLine(models.Model):
 
             # 4. Compute the next recurring date from the next period start
             if next_period_start:
-                next_recurring_date = rec.get_next_invoice_date(
+                next_recurring_date = calc.get_next_invoice_date(
                     next_period_start,
                     rec.recurring_invoicing_type,
                     rec.recurring_invoicing_offset,
                     rec.recurring_rule_type,
                     rec.recurring_interval,
-                    max_date_end=rec.date_end,
+                    rec.date_end,
                 )
             else:
                 next_recurring_date = False
@@ -1338,38 +1502,55 @@ class ContractLine(models.Model):
             
     def update_inventory(self):
         """Create or update inventory lines based on contract lines"""
-        for line in self.filtered('in_inventory'):
-            if not line.contract_id.inventory_id:
-                continue
-                
-            # Check if an inventory line already exists
-            existing_line = self.env['contract.inventory.line'].search([
-                ('contract_line_id', '=', line.id),
-                ('product_id', '=', line.product_id.id),
-            ], limit=1)
-            
+        lines = self.filtered(
+            lambda line: line.in_inventory and line.contract_id.inventory_id
+        )
+        if not lines:
+            return
+        InventoryLine = self.env['contract.inventory.line']
+        # Existing inventory lines of all the contract lines, in one query.
+        # The first one of each contract line and product is kept in sync.
+        existing_by_key = {}
+        for inventory_line in InventoryLine.search([
+            ('contract_line_id', 'in', lines.ids),
+        ]):
+            existing_by_key.setdefault(
+                (inventory_line.contract_line_id.id, inventory_line.product_id.id),
+                inventory_line,
+            )
+
+        to_update = defaultdict(lambda: InventoryLine)
+        vals_list = []
+        for line in lines:
+            existing_line = existing_by_key.get((line.id, line.product_id.id))
             if existing_line:
                 # If quantity has changed, update the inventory line
                 if existing_line.quantity != line.quantity:
-                    existing_line.write({'quantity': line.quantity})
+                    to_update[line.quantity] |= existing_line
             else:
                 # Create a new inventory line
-                self.env['contract.inventory.line'].create({
+                vals_list.append({
                     'inventory_id': line.contract_id.inventory_id.id,
                     'product_id': line.product_id.id,
                     'contract_line_id': line.id,
                     'quantity': line.quantity,
                     'state': 'assigned',
                 })
+        # One write per distinct quantity
+        for quantity, inventory_lines in to_update.items():
+            inventory_lines.write({'quantity': quantity})
+        if vals_list:
+            InventoryLine.create(vals_list)
                 
     def remove_from_inventory(self):
         """Remove products from inventory when contract line is removed or marked as not in inventory"""
-        for line in self:
-            inventory_lines = self.env['contract.inventory.line'].search([
-                ('contract_line_id', '=', line.id),
-            ])
-            if inventory_lines:
-                inventory_lines.write({'state': 'returned'})
+        if not self:
+            return
+        inventory_lines = self.env['contract.inventory.line'].search([
+            ('contract_line_id', 'in', self.ids),
+        ])
+        if inventory_lines:
+            inventory_lines.write({'state': 'returned'})
                 
     def write(self, vals):
         # Prevent propagation of recurring_next_date changes if they come from a single line edit
@@ -1403,11 +1584,10 @@ class ContractLine(models.Model):
         
         # Handle inventory changes
         if 'in_inventory' in vals:
-            for line in self:
-                if vals['in_inventory']:
-                    line.update_inventory()
-                else:
-                    line.remove_from_inventory()
+            if vals['in_inventory']:
+                self.update_inventory()
+            else:
+                self.remove_from_inventory()
         elif 'product_id' in vals or 'quantity' in vals:
             self.filtered('in_inventory').update_inventory()
         
@@ -1421,11 +1601,11 @@ class ContractLine(models.Model):
         
         # Update mobile service names when product_id changes on mobile service lines
         if 'product_id' in vals:
-            for line in self.filtered('is_mobile_service'):
-                if line.mobile_service_ids:
-                    new_product = self.env['product.product'].browse(vals['product_id'])
-                    product_name = new_product.name or "Mobile Service"
-                    line.mobile_service_ids.write({'name': product_name})
+            mobile_services = self.filtered('is_mobile_service').mobile_service_ids
+            if mobile_services:
+                new_product = self.env['product.product'].browse(vals['product_id'])
+                product_name = new_product.name or "Mobile Service"
+                mobile_services.write({'name': product_name})
         
         # Skip name update if we're already doing it from mobile service update
         # or if 'name' was explicitly passed in vals (direct user update)
@@ -1443,13 +1623,14 @@ class ContractLine(models.Model):
             
     def update_mobile_services_inventory(self):
         """Create or update mobile services in inventory based on contract lines"""
+        vals_list = []
         for line in self.filtered('is_mobile_service'):
             if not line.contract_id.inventory_id:
                 continue
                 
             # If there are no mobile services yet, create a default one
             if not line.mobile_service_ids:
-                mobile_service = self.env['contract.mobile.service'].create({
+                vals_list.append({
                     'name': line.product_id.name or "Mobile Service",
                     'phone_number': _('New Phone Number'),
                     'operator': 'telekom',  # Default operator
@@ -1457,12 +1638,13 @@ class ContractLine(models.Model):
                     'inventory_id': line.contract_id.inventory_id.id,
                     'contract_line_id': line.id,
                 })
+        if vals_list:
+            self.env['contract.mobile.service'].create(vals_list)
     
     def remove_mobile_services_from_inventory(self):
         """Mark mobile services as inactive when contract line is removed or not tracked"""
-        for line in self:
-            if line.mobile_service_ids:
-                line.mobile_service_ids.write({'is_active': False})
+        if self.mobile_service_ids:
+            self.mobile_service_ids.write({'is_active': False})
     
     def action_view_mobile_services(self):
         """Open the mobile services related to this contract line"""
@@ -375,8 +375,8 @@ for c in CRITERIA_ALLOWED_DICT:
     _add(criteria_allowed_dict, c, CRITERIA_ALLOWED_DICT[c])
 
 
-def compute_when(date_start, date_end):
-    today = Date.today()
+def compute_when(date_start, date_end, today=None):
+    today = today or Date.today()
     if today < date_start:
         return "BEFORE"
     if date_end and today > date_end:
@@ -427,3 +427,43 @@ def get_allowed(
     if criteria in criteria_allowed_dict:
         return criteria_allowed_dict[criteria]
     return False
+
+
+def get_allowed_batch(lines_values, today=None):
+    """Vectorized version of get_allowed.
+
+    :param lines_values: iterable of tuples (date_start, date_end,
+        has_last_date_invoiced, is_auto_renew, has_successor,
+        predecessor_has_successor, is_canceled), the links being already
+        resolved to booleans
+    :param today: reference date, computed once for all the lines
+    :return: list of Allowed (or False), in the same order
+    """
+    today = today or Date.today()
+    # Keys of criteria_allowed_dict are plain tuples in Criteria field order
+    get = criteria_allowed_dict.get
+    allowed_list = []
+    for (
+        date_start,
+        date_end,
+        has_last_date_invoiced,
+        is_auto_renew,
+        has_successor,
+        predecessor_has_successor,
+        is_canceled,
+    ) in lines_values:
+        allowed_list.append(
+            get(
+                (
+                    compute_when(date_start, date_end, today),
+                    bool(date_end),
+                    bool(has_last_date_invoiced),
+                    bool(is_auto_renew),
+                    bool(has_successor),
+                    bool(predecessor_has_successor),
+                    bool(is_canceled),
+                ),
+                False,
+            )
+        )
+    return allowed_list
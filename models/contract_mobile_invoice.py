@@ -1,15 +1,16 @@
 # Copyright 2025
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+import odoo.addons
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
+import multiprocessing
 import os
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-from openpyxl.drawing.image import Image
+import numpy as np
 import pandas as pd
 import re
 import io
@@ -17,44 +18,12 @@ import csv
 import base64
 import logging
 
+from .xlsx_report_writer import LOGO_PATH, XlsxReportWriter
+
 _logger = logging.getLogger(__name__)
 
-def insert_image(sheet, image_path, cell):
-    """Insert an image into the specified cell of the sheet."""
-    try:
-        # Load the image
-        img = Image(image_path)
-        
-        # Adjust the size of the image if needed
-        img.width, img.height = 200, 100
-        
-        # Extract column letter and row number from cell reference
-        col_letter = ''.join(filter(str.isalpha, cell))
-        row_num = int(''.join(filter(str.isdigit, cell)))
-        
-        # Get column width in pixels (1 unit = 7 pixels)
-        col_width = sheet.column_dimensions[col_letter].width
-        col_width_px = col_width * 7
-        
-        # Calculate offsets to center the image
-        x_offset = (col_width_px - img.width) / 2
-        
-        # Adjust row height to fit the image
-        row_height = img.height * 0.75  # Convert to points (Excel units)
-        sheet.row_dimensions[row_num].height = row_height
-        
-        # Calculate y_offset to center vertically
-        y_offset = (row_height - img.height * 0.75) / 2
-        
-        # Add the image with calculated offsets
-        img.anchor = cell
-        img.left = x_offset
-        img.top = y_offset
-        
-        sheet.add_image(img)
-        
-    except Exception as e:
-        _logger.error(f"Error inserting image: {e}")
+HLAS_PRODUCT_23_NAME = 'Vyúčtovanie paušálnych služieb a spotreby HLAS 23%'
+HLAS_PRODUCT_0_NAME = 'Vyúčtovanie paušálnych služieb a spotreby HLAS 0%'
 
 def format_duration(seconds):
     """Format seconds into HH:MM:SS format."""
@@ -103,12 +72,110 @@ def get_output_folder(customer_info: tuple, base_dir: str = "output") -> str:
         return individuals_dir
 
 
+def render_usage_report(report_data):
+    """Render the usage report workbook of a partner.
+
+    Only plain values are used, so the rendering can run in a separate
+    process, see ``ContractMobileUsageReport._render_excel_reports``.
+
+    :param report_data: dict built by
+        ``ContractMobileUsageReport._prepare_excel_report_data``
+    :return: the XLSX file content (bytes)
+    """
+    writer = XlsxReportWriter()
+    ws = writer.add_sheet()
+    
+    # Add NOVEM logo if exists
+    if report_data['logo_path']:
+        ws.add_logo(report_data['logo_path'], "A1")
+
+    for _i in range(4):
+        ws.append()
+    ws.append(["Fakturačné obdobie:", report_data['billing_period']], ["title", None])
+    ws.append()  # Start after logo and billing period
+
+    for data in report_data['phones']:
+        # Header section
+        ws.append(["Rozpis spotreby pre telefónne číslo:", data['formatted_phone']], ["title", None])
+
+        # Basic plan section
+        ws.append([data['formatted_plan']])
+        ws.append()
+        
+        # Rozpis účtovaných poplatkov
+        if data['excess_lines']:
+            ws.append(["Rozpis účtovaných poplatkov:", "DPH", "Suma v EUR bez DPH"], "bold+border")
+
+            # List each excessive usage line separately
+            for line in data['excess_lines']:
+                ws.append(
+                    [
+                        line['service_name'],
+                        line['vat'] if line['vat'] else "0%",
+                        f"{float(line['total']):.4f}".replace('.', ','),
+                    ],
+                    ["border", "border", "border+decimal4"],
+                )
+            ws.append()
+
+        # Rozpis SMS / MMS, volaní a dát
+        for lines, title, column_title, format_quantity in (
+            (data['sms_lines'], "Rozpis SMS / MMS:", "Počet kusov", lambda quantity: f"{int(quantity)} ks"),
+            (data['voice_lines'], "Rozpis volaní:", "Trvanie hovorov", format_duration),
+            (data['data_lines'], "Rozpis dát:", "Spotreba dát", format_data_usage),
+        ):
+            if not lines:
+                continue
+            ws.append([title, column_title], "bold+border")
+            for line in lines:
+                ws.append([line['service_name'], format_quantity(line['quantity'])], "border")
+            ws.append()
+
+        # Total section - only excess charges, not basic plan
+        ws.append(
+            [
+                "Faktúrovaná suma nad paušál bez DPH:",
+                f"{float(data['excess_total']):.4f}".replace('.', ','),
+            ],
+            ["bold+border", "border+decimal4"],
+        )
+        # Extra space between phone numbers
+        ws.append()
+        ws.append()
+
+    return writer.save()
+
+
+def _render_usage_report_safe(report_data):
+    """Process pool entry point: an error is returned, not raised, so that it
+    only fails the report of its partner"""
+    try:
+        return render_usage_report(report_data), None
+    except Exception as e:
+        return None, str(e)
+
+
+# Run first in each rendering process. Started from a fresh interpreter, it
+# only finds this module with the addons paths of the server.
+_RENDER_WORKER_BOOTSTRAP = """
+import odoo.addons
+for path in addons_path:
+    if path not in odoo.addons.__path__:
+        odoo.addons.__path__.append(path)
+"""
+
+
 class ContractMobileInvoice(models.Model):
     _name = "contract.mobile.invoice"
     _description = "Mobile Service Invoice"
     _inherit = ['mail.thread', 'mail.activity.mixin']
     _order = "date desc"
 
+    _STREAMING_IMPORT_THRESHOLD_PARAM = "contract.mobile_invoice_streaming_threshold"
+    _DEFAULT_STREAMING_IMPORT_THRESHOLD = 20 * 1024 * 1024
+    _STREAMING_IMPORT_CHUNK_SIZE = 20000
+    _HLAS_PRODUCT_PARAM = "contract.mobile_invoice_hlas_product_%s_id"
+
     name = fields.Char(string="Reference", required=True, tracking=True)
     date = fields.Date(string="Invoice Date", required=True, tracking=True)
     operator = fields.Selection(
@@ -161,6 +228,15 @@ class ContractMobileInvoice(models.Model):
         if self.csv_file and self.operator:
             # Delete existing invoice lines
             self.invoice_line_ids.sudo().unlink()
+
+            attachment = self._get_csv_attachment()
+            if self._use_streaming_import(attachment):
+                try:
+                    self._process_csv_streaming(attachment)
+                except Exception as e:
+                    raise UserError(_("Error processing CSV file: %s") % str(e))
+                self.write({'state': 'processed'})
+                return True
             
             try:
                 # Decode the CSV file
@@ -190,331 +266,418 @@ class ContractMobileInvoice(models.Model):
         
         return False
         
+    @api.model
+    def _get_hlas_products(self):
+        """Return the excess usage products (HLAS 23% and 0% VAT).
+
+        They are referenced by id in the
+        ``contract.mobile_invoice_hlas_product_23_id`` and
+        ``contract.mobile_invoice_hlas_product_0_id`` system parameters. A
+        missing or stale parameter is filled by looking the product up by name.
+        """
+        IrConfig = self.env['ir.config_parameter'].sudo()
+        Product = self.env['product.product']
+        products = []
+        for vat, name in (('23', HLAS_PRODUCT_23_NAME), ('0', HLAS_PRODUCT_0_NAME)):
+            param = self._HLAS_PRODUCT_PARAM % vat
+            product_id = IrConfig.get_param(param)
+            try:
+                product = Product.browse(int(product_id)).exists() if product_id else Product
+            except (TypeError, ValueError):
+                product = Product
+            if not product:
+                product = Product.search([('name', '=', name)], limit=1)
+                if product:
+                    IrConfig.set_param(param, product.id)
+            products.append(product)
+        return tuple(products)
+
+    def _get_csv_attachment(self):
+        self.ensure_one()
+        return self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'csv_file'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+
+    def _use_streaming_import(self, attachment):
+        """Large files are streamed, see ``_process_csv_streaming``. The size
+        threshold (in bytes) is set with the
+        ``contract.mobile_invoice_streaming_threshold`` system parameter, 0
+        disabling the streaming."""
+        threshold = (
+            self.env['ir.config_parameter']
+            .sudo()
+            .get_param(self._STREAMING_IMPORT_THRESHOLD_PARAM)
+        )
+        try:
+            threshold = int(threshold) if threshold else self._DEFAULT_STREAMING_IMPORT_THRESHOLD
+        except (TypeError, ValueError):
+            threshold = self._DEFAULT_STREAMING_IMPORT_THRESHOLD
+        return bool(attachment) and threshold > 0 and attachment.file_size > threshold
+
+    def _open_csv_attachment(self, attachment):
+        """Open the CSV file in binary mode, from the filestore when possible
+        so it isn't loaded in memory"""
+        if attachment.store_fname:
+            return open(attachment._full_path(attachment.store_fname), 'rb')
+        return io.BytesIO(attachment.raw)
+
+    def _process_csv_streaming(self, attachment):
+        """Import the CSV file by chunks of rows with a bounded memory use.
+
+        Each chunk is parsed on its own, with the state needed across chunk
+        boundaries (the current phone number of O2 files, the basic plan
+        amounts), and its invoice lines are created in one call. The cache
+        is cleared after each chunk.
+        """
+        self.ensure_one()
+        parsers = {
+            'telekom': self._parse_telekom_frame,
+            'o2': self._parse_o2_frame,
+        }
+        if self.operator not in parsers:
+            raise UserError(_("Unsupported operator: %s") % self.operator)
+        parse = parsers[self.operator]
+        InvoiceLine = self.env['contract.mobile.invoice.line']
+        state = {}
+        with self._open_csv_attachment(attachment) as csv_file:
+            # Phone columns are read as text, the type inferred for each
+            # chunk could differ (a chunk with empty phones would be float)
+            columns = pd.read_csv(csv_file, encoding='utf-8', nrows=0).columns
+            csv_file.seek(0)
+            reader = pd.read_csv(
+                csv_file,
+                encoding='utf-8',
+                low_memory=False,
+                chunksize=self._STREAMING_IMPORT_CHUNK_SIZE,
+                dtype={col: str for col in columns if col.endswith(('@Label', 'MSISDN'))},
+            )
+            for chunk in reader:
+                vals_list = parse(chunk, state)
+                for vals in vals_list:
+                    vals['invoice_id'] = self.id
+                InvoiceLine.create(vals_list)
+                self.env.flush_all()
+                self.env.invalidate_all()
+
     def _process_telekom_csv(self, csv_content):
         """Process Telekom CSV file"""
-        result = []
-        
         try:
             # Read the CSV file into a pandas DataFrame
             df_raw = pd.read_csv(io.BytesIO(csv_content), encoding='utf-8', low_memory=False)
-            
-            # Group by phone number (Label column)
-            grouped = df_raw.groupby("Charges__BudgetCentre__ProductFamily__Charge__@Label")
-            
-            for phone_number, data in grouped:
-                if pd.isna(phone_number):
-                    continue
-                # Clean phone number to keep only numeric characters
-                phone_number = self._clean_phone_number(phone_number)
-                # Skip non-Slovak numbers
-                if not phone_number.startswith('421'):
-                    continue
-                
-                # Process T-Biznis services (basic plans)
-                tbiznis_services = data[data['Charges__BudgetCentre__ProductFamily__Charge__@Desc'].str.contains('T-Biznis', na=False)]
-                
-                for _, row in tbiznis_services.iterrows():
-                    service_name = row['Charges__BudgetCentre__ProductFamily__Charge__@Desc']
-                    price = self._safe_convert_to_float(row['Charges__BudgetCentre__ProductFamily__Charge__@Price'])
-                    vat_rate = str(row['Charges__BudgetCentre__ProductFamily__Charge__@VatRate']) + "%"
-                    
-                    if pd.notna(service_name):
-                        # Map T-Biznis service names to NOVEM names
-                        service_name = format_plan_name(service_name)
-                        
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'basic',
-                            'amount': price,
-                            'total': price,
-                            'is_excess_usage': False,
-                            'vat': vat_rate,
-                        })
-                
-                # Process paid services (excluding T-Biznis)
-                paid_services = data[
-                    (data['Charges__BudgetCentre__ProductFamily__Charge__@Price'] > 0) &
-                    (~data['Charges__BudgetCentre__ProductFamily__Charge__@Desc'].str.contains('T-Biznis', na=False))
-                ]
-                
-                for _, row in paid_services.iterrows():
-                    service_name = row['Charges__BudgetCentre__ProductFamily__Charge__@Desc']
-                    price = self._safe_convert_to_float(row['Charges__BudgetCentre__ProductFamily__Charge__@Price'])
-                    vat_rate = str(row['Charges__BudgetCentre__ProductFamily__Charge__@VatRate']) + "%"
-
-                    if pd.notna(service_name):
-                        service_type = 'other'
-                        if 'data' in service_name.lower():
-                            service_type = 'data'
-                        elif 'voice' in service_name.lower() or 'call' in service_name.lower():
-                            service_type = 'voice'
-                        elif 'sms' in service_name.lower():
-                            service_type = 'sms'
-                        elif 'mms' in service_name.lower():
-                            service_type = 'mms'
-                        elif 'roaming' in service_name.lower():
-                            service_type = 'roaming'
-                        
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': service_type,
-                            'amount': price,
-                            'total': price,
-                            'is_excess_usage': True,
-                            'vat': vat_rate,
-                        })
-                
-                # Process SMS usage
-                sms_usage = data[
-                    (data['Charges__BudgetCentre__ProductFamily__Charge__@UnitType'] == 'Ks') &
-                    (data['Charges__BudgetCentre__ProductFamily__Charge__@Desc'].str.contains('SMS', na=False))
-                ]
-                
-                for _, row in sms_usage.iterrows():
-                    service_name = row['Charges__BudgetCentre__ProductFamily__Charge__@Desc']
-                    count = int(float(row['Charges__BudgetCentre__ProductFamily__Charge__@Units']))
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'sms',
-                            'amount': 0.0,
-                            'quantity': count,
-                            'unit': 'SMS',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-                
-                # Process MMS usage
-                mms_usage = data[
-                    (data['Charges__BudgetCentre__ProductFamily__Charge__@UnitType'] == 'Ks') &
-                    (data['Charges__BudgetCentre__ProductFamily__Charge__@Desc'].str.contains('MMS', na=False))
-                ]
-                
-                for _, row in mms_usage.iterrows():
-                    service_name = row['Charges__BudgetCentre__ProductFamily__Charge__@Desc']
-                    count = int(float(row['Charges__BudgetCentre__ProductFamily__Charge__@Units']))
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'mms',
-                            'amount': 0.0,
-                            'quantity': count,
-                            'unit': 'MMS',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-                
-                # Process call usage
-                call_usage = data[data['Charges__BudgetCentre__ProductFamily__Charge__@UnitType'] == 'sekundy']
-                for _, row in call_usage.iterrows():
-                    service_name = row['Charges__BudgetCentre__ProductFamily__Charge__@Desc']
-                    duration = float(row['Charges__BudgetCentre__ProductFamily__Charge__@Units'])
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'voice',
-                            'amount': 0.0,
-                            'quantity': duration,
-                            'unit': 'Second',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-                
-                # Process data usage
-                data_usage = data[data['Charges__BudgetCentre__ProductFamily__Charge__@UnitType'] == 'MB']
-                for _, row in data_usage.iterrows():
-                    service_name = row['Charges__BudgetCentre__ProductFamily__Charge__@Desc']
-                    volume = float(row['Charges__BudgetCentre__ProductFamily__Charge__@Units'])
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'data',
-                            'amount': 0.0,
-                            'quantity': volume,
-                            'unit': 'MB',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-            
+            return self._parse_telekom_frame(df_raw)
         except Exception as e:
             _logger.error(f"Error processing Telekom CSV file: {str(e)}")
             raise
-            
-        return result
+
+    @api.model
+    def _parse_telekom_frame(self, df_raw, state=None):
+        """Build the invoice line values of Telekom CSV rows
+
+        All the rows are classified in one columnar pass: T-Biznis plans,
+        paid extra services, SMS, MMS, calls (seconds) and data (MB). A row
+        can produce a line in several categories. Lines are returned grouped
+        by phone label, then by category, then in file order.
+
+        :param state: unused, Telekom rows don't depend on the previous ones
+        """
+        df_raw = df_raw.reset_index(drop=True)
+
+        label_col = 'Charges__BudgetCentre__ProductFamily__Charge__@Label'
+        desc_col = 'Charges__BudgetCentre__ProductFamily__Charge__@Desc'
+        price_col = 'Charges__BudgetCentre__ProductFamily__Charge__@Price'
+        vat_col = 'Charges__BudgetCentre__ProductFamily__Charge__@VatRate'
+        unit_type_col = 'Charges__BudgetCentre__ProductFamily__Charge__@UnitType'
+        units_col = 'Charges__BudgetCentre__ProductFamily__Charge__@Units'
+
+        # Phone numbers are cleaned once per distinct label; non-Slovak
+        # numbers are skipped
+        phone_rank, phone_numbers = self._get_csv_phone_columns(df_raw[label_col])
+        valid = (phone_rank >= 0) & phone_numbers.str.startswith('421')
+
+        # Text columns are read as float when a streamed chunk has no value
+        desc = df_raw[desc_col].astype(object)
+        unit_type = df_raw[unit_type_col]
+        has_desc = desc.notna()
+        is_tbiznis = desc.str.contains('T-Biznis', na=False, regex=False)
+        is_piece = unit_type == 'Ks'
+        price = self._safe_convert_column_to_float(df_raw[price_col])
+        vat = df_raw[vat_col].astype(str) + "%"
+
+        # The unit counts are only converted on the usage rows, so that
+        # badly formatted counts of other rows don't fail the import
+        def units(mask):
+            return df_raw.loc[mask, units_col].astype(float)
+
+        charge_keys = ('service_type', 'amount', 'total', 'is_excess_usage', 'vat')
+        usage_keys = ('service_type', 'amount', 'quantity', 'unit', 'total', 'is_excess_usage')
+        categories = []
+
+        # T-Biznis services (basic plans)
+        mask = valid & is_tbiznis
+        categories.append((mask, charge_keys, {
+            'service_name': desc[mask].map(self._map_unique(desc[mask], format_plan_name)),
+            'service_type': 'basic',
+            'amount': price[mask],
+            'total': price[mask],
+            'is_excess_usage': False,
+            'vat': vat[mask],
+        }))
+        # Paid services (excluding T-Biznis)
+        mask = valid & has_desc & (df_raw[price_col] > 0) & ~is_tbiznis
+        categories.append((mask, charge_keys, {
+            'service_name': desc[mask],
+            'service_type': classify_service_type(desc[mask]),
+            'amount': price[mask],
+            'total': price[mask],
+            'is_excess_usage': True,
+            'vat': vat[mask],
+        }))
+        # SMS and MMS usage
+        for keyword, service_type in (('SMS', 'sms'), ('MMS', 'mms')):
+            mask = valid & is_piece & desc.str.contains(keyword, na=False, regex=False)
+            categories.append((mask, usage_keys, {
+                'service_name': desc[mask],
+                'service_type': service_type,
+                'amount': 0.0,
+                'quantity': units(mask).astype(int),
+                'unit': keyword,
+                'total': 0.0,
+                'is_excess_usage': False,
+            }))
+        # Call usage
+        mask = valid & has_desc & (unit_type == 'sekundy')
+        categories.append((mask, usage_keys, {
+            'service_name': desc[mask],
+            'service_type': 'voice',
+            'amount': 0.0,
+            'quantity': units(mask),
+            'unit': 'Second',
+            'total': 0.0,
+            'is_excess_usage': False,
+        }))
+        # Data usage
+        mask = valid & has_desc & (unit_type == 'MB')
+        categories.append((mask, usage_keys, {
+            'service_name': desc[mask],
+            'service_type': 'data',
+            'amount': 0.0,
+            'quantity': units(mask),
+            'unit': 'MB',
+            'total': 0.0,
+            'is_excess_usage': False,
+        }))
+
+        return self._build_csv_lines(phone_rank, phone_numbers, categories)
+
+
+    @api.model
+    def _get_csv_phone_columns(self, labels):
+        """Rank and clean the phone label column of an operator CSV.
+
+        :return: tuple of Series (rank of the label among the sorted
+            distinct labels, -1 for empty labels; cleaned phone number)
+        """
+        codes, uniques = pd.factorize(labels, sort=True)
+        # The code of empty labels is -1, it picks the trailing ''
+        cleaned = np.array(
+            [self._clean_phone_number(label) for label in uniques] + [''],
+            dtype=object,
+        )
+        phone_numbers = pd.Series(cleaned[codes], index=labels.index)
+        return pd.Series(codes, index=labels.index), phone_numbers
+
+    @api.model
+    def _map_unique(self, column, function):
+        """Mapping of the distinct values of ``column`` through ``function``,
+        to convert a column calling ``function`` once per distinct value."""
+        return {value: function(value) for value in column.unique()}
+
+    @api.model
+    def _build_csv_lines(self, phone_rank, phone_numbers, categories):
+        """Build the invoice line values from classified CSV rows.
+
+        :param categories: list of tuples ``(mask, keys, columns)`` where
+            ``columns`` maps the line fields to Series aligned on the rows
+            selected by ``mask`` (or to constants), and ``keys`` lists the
+            fields set on the lines of the category besides the phone number
+            and the service name
+        :return: list of dicts ordered by phone label, category and row
+        """
+        frames = []
+        keys_by_category = []
+        for order, (mask, keys, columns) in enumerate(categories):
+            keys_by_category.append(('phone_number', 'service_name') + keys)
+            if not mask.any():
+                continue
+            frame = pd.DataFrame(
+                {'_rank': phone_rank[mask], 'phone_number': phone_numbers[mask]}
+            )
+            for key, value in columns.items():
+                # Object columns keep the python type of the values (int
+                # counts are not upcast to float by the concatenation)
+                frame[key] = value.astype(object) if isinstance(value, pd.Series) else value
+            frame['_order'] = order
+            frame['_row'] = frame.index
+            frames.append(frame)
+        if not frames:
+            return []
+        lines = pd.concat(frames).sort_values(['_rank', '_order', '_row'], kind='stable')
+        records = lines.drop(columns=['_rank', '_order', '_row']).to_dict('records')
+        return [
+            {key: record[key] for key in keys_by_category[order]}
+            for order, record in zip(lines['_order'].tolist(), records)
+        ]
         
     def _process_o2_csv(self, csv_content):
         """Process O2 CSV file"""
-        result = []
-        
         try:
-            # First, preprocess to fill in missing phone numbers
             # Read the CSV file into a pandas DataFrame
             df_raw = pd.read_csv(io.BytesIO(csv_content), encoding='utf-8', low_memory=False)
-            
-            # Find the MSISDN column
-            msisdn_col = None
-            for col in df_raw.columns:
-                if 'MSISDN' in col:
-                    msisdn_col = col
-                    break
-            if not msisdn_col:
-                raise UserError(_("Could not find MSISDN column in O2 CSV file"))
-            # Forward fill the phone numbers (fill missing values with the last valid value)
-            df_raw[msisdn_col] = df_raw[msisdn_col].fillna(method='ffill')
-            # Group by phone number
-            grouped = df_raw.groupby(msisdn_col)
-            for phone_number, data in grouped:
-                if pd.isna(phone_number):
-                    continue
-                # Clean phone number to keep only numeric characters
-                phone_number = self._clean_phone_number(phone_number)
-                # Skip non-Slovak numbers
-                if not phone_number.startswith('421'):
-                    continue
-                # Get the basic plan amount from SubscriberTotalNETAmount
-                basic_plan_amount = self._safe_convert_to_float(data['Subscribers__Subscriber__SubscriberTotalNETAmount'].iloc[0])
-                
-                # Process recurring fees
-                recurring_fees = data[
-                    (data['Subscribers__Subscriber__InvoiceLines__FeeLines__Fee__FeeType'] == 'recurring_arrears') &
-                    (~data['Subscribers__Subscriber__InvoiceLines__FeeLines__Fee__FeeName'].str.contains('VPN', na=False))
-                ]
-                
-                for _, row in recurring_fees.iterrows():
-                    service_name = row['Subscribers__Subscriber__InvoiceLines__FeeLines__Fee__FeeName']
-                    service_name = handle_o2_service_name(service_name)
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'basic',
-                            'amount': basic_plan_amount,  # Use the basic plan amount from SubscriberTotalNETAmount
-                            'total': basic_plan_amount,
-                            'is_excess_usage': False,
-                        })
-                
-                # Process charged fees (one-time payments and extra charges)
-                charged_fees = data[
-                    (data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemNetAmount'] > 0) |
-                    (data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageUOM'] == 'Money')
-                ]
-                
-                for _, row in charged_fees.iterrows():
-                    service_name = row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName']
-                    amount = self._safe_convert_to_float(row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemNetAmount'])
-                    vat = row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__VAT']
-                    
-                    if pd.notna(service_name):
-                        service_type = 'other'
-                        if 'data' in service_name.lower():
-                            service_type = 'data'
-                        elif 'voice' in service_name.lower() or 'call' in service_name.lower():
-                            service_type = 'voice'
-                        elif 'sms' in service_name.lower():
-                            service_type = 'sms'
-                        elif 'mms' in service_name.lower():
-                            service_type = 'mms'
-                        elif 'roaming' in service_name.lower():
-                            service_type = 'roaming'
-                        
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': service_type,
-                            'amount': amount,
-                            'total': amount,
-                            'vat': vat,
-                            'is_excess_usage': True,
-                        })
-                
-                # Process SMS/MMS usage
-                sms_usage = data[
-                    (data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageUOM'] == 'occurrence') &
-                    (data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName'].str.contains('SMS', na=False))
-                ]
-                
-                mms_usage = data[
-                    (data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageUOM'] == 'occurrence') &
-                    (data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName'].str.contains('MMS', na=False))
-                ]
-                
-                for _, row in sms_usage.iterrows():
-                    service_name = row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName']
-                    count = int(float(row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__Amount']))
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'sms',
-                            'amount': 0.0,
-                            'quantity': count,
-                            'unit': 'SMS',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-                
-                for _, row in mms_usage.iterrows():
-                    service_name = row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName']
-                    count = int(float(row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__Amount']))
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'mms',
-                            'amount': 0.0,
-                            'quantity': count,
-                            'unit': 'MMS',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-                
-                # Process call usage
-                call_usage = data[data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageUOM'] == 'Second']
-                for _, row in call_usage.iterrows():
-                    service_name = row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName']
-                    duration = float(row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__Volume'])
-                    if pd.notna(service_name):
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'voice',
-                            'amount': 0.0,
-                            'quantity': duration,
-                            'unit': 'Second',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-                
-                # Process data usage
-                data_usage = data[data['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageUOM'] == 'Byte']
-                for _, row in data_usage.iterrows():
-                    service_name = row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName']
-                    volume = float(row['Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__Volume'])
-                    if pd.notna(service_name):
-                        # Convert Bytes to MB for consistency with Telekom reports
-                        volume_mb = volume / (1024 * 1024)
-                        result.append({
-                            'phone_number': phone_number,
-                            'service_name': service_name,
-                            'service_type': 'data',
-                            'amount': 0.0,
-                            'quantity': volume_mb,
-                            'unit': 'MB',
-                            'total': 0.0,
-                            'is_excess_usage': False,
-                        })
-            
+            return self._parse_o2_frame(df_raw)
         except Exception as e:
             _logger.error(f"Error processing O2 CSV file: {str(e)}")
             raise
-            
-        return result
+
+    @api.model
+    def _parse_o2_frame(self, df_raw, state=None):
+        """Build the invoice line values of O2 CSV rows
+
+        Phone numbers are forward filled, then all the rows are classified
+        in one columnar pass: recurring fees, charged fees, SMS, MMS, calls
+        (seconds) and data (bytes, converted to MB). Lines are returned
+        grouped by phone number, then by category, then in file order.
+
+        :param state: dict kept between the chunks of a streamed file, with
+            the last phone number and the basic plan amount of the phones
+        """
+        df_raw = df_raw.reset_index(drop=True)
+
+        # Find the MSISDN column
+        msisdn_col = next((col for col in df_raw.columns if 'MSISDN' in col), None)
+        if not msisdn_col:
+            raise UserError(_("Could not find MSISDN column in O2 CSV file"))
+
+        total_col = 'Subscribers__Subscriber__SubscriberTotalNETAmount'
+        fee_type_col = 'Subscribers__Subscriber__InvoiceLines__FeeLines__Fee__FeeType'
+        fee_name_col = 'Subscribers__Subscriber__InvoiceLines__FeeLines__Fee__FeeName'
+        net_amount_col = 'Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemNetAmount'
+        uom_col = 'Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageUOM'
+        item_name_col = 'Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__UsageItemName'
+        vat_col = 'Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__VAT'
+        amount_col = 'Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__Amount'
+        volume_col = 'Subscribers__Subscriber__InvoiceLines__UsageLines__Usage__Volume'
+
+        # Forward fill the phone numbers (fill missing values with the last valid value)
+        msisdn = df_raw[msisdn_col].ffill()
+        if state is not None:
+            # Rows continuing the phone of the previous chunk
+            if state.get('msisdn') is not None:
+                msisdn = msisdn.fillna(state['msisdn'])
+            if msisdn.notna().any():
+                state['msisdn'] = msisdn[msisdn.notna()].iloc[-1]
+        phone_rank, phone_numbers = self._get_csv_phone_columns(msisdn)
+        valid = (phone_rank >= 0) & phone_numbers.str.startswith('421')
+
+        # The basic plan amount of a phone is the SubscriberTotalNETAmount
+        # of its first row
+        first_row = pd.Series(df_raw.index).groupby(phone_rank.values).transform('min')
+        basic_plan_amount = pd.Series(
+            self._safe_convert_column_to_float(df_raw[total_col]).to_numpy()[first_row],
+            index=df_raw.index,
+        )
+        if state is not None:
+            # The first row of a phone may be in a previous chunk
+            known_amounts = state.setdefault('basic_plan_amounts', {})
+            is_first_row = valid & (df_raw.index == first_row)
+            for phone_number, amount in zip(
+                phone_numbers[is_first_row], basic_plan_amount[is_first_row]
+            ):
+                known_amounts.setdefault(phone_number, amount)
+            basic_plan_amount = phone_numbers.map(known_amounts)
+
+        # Text columns are read as float when a streamed chunk has no value
+        fee_name = df_raw[fee_name_col].astype(object)
+        item_name = df_raw[item_name_col].astype(object)
+        uom = df_raw[uom_col]
+        has_item_name = item_name.notna()
+        is_occurrence = uom == 'occurrence'
+
+        def usage(mask, column):
+            return df_raw.loc[mask, column].astype(float)
+
+        charge_keys = ('service_type', 'amount', 'total', 'vat', 'is_excess_usage')
+        usage_keys = ('service_type', 'amount', 'quantity', 'unit', 'total', 'is_excess_usage')
+        categories = []
+
+        # Recurring fees
+        recurring = (
+            valid
+            & (df_raw[fee_type_col] == 'recurring_arrears')
+            & ~fee_name.str.contains('VPN', na=False, regex=False)
+        )
+        service_name = fee_name[recurring].map(
+            self._map_unique(fee_name[recurring], handle_o2_service_name)
+        )
+        service_name = service_name[service_name.notna()]
+        mask = pd.Series(df_raw.index.isin(service_name.index), index=df_raw.index)
+        categories.append((mask, ('service_type', 'amount', 'total', 'is_excess_usage'), {
+            'service_name': service_name,
+            'service_type': 'basic',
+            # Use the basic plan amount from SubscriberTotalNETAmount
+            'amount': basic_plan_amount[mask],
+            'total': basic_plan_amount[mask],
+            'is_excess_usage': False,
+        }))
+        # Charged fees (one-time payments and extra charges)
+        mask = valid & has_item_name & ((df_raw[net_amount_col] > 0) | (uom == 'Money'))
+        amount = self._safe_convert_column_to_float(df_raw.loc[mask, net_amount_col])
+        categories.append((mask, charge_keys, {
+            'service_name': item_name[mask],
+            'service_type': classify_service_type(item_name[mask]),
+            'amount': amount,
+            'total': amount,
+            'vat': df_raw.loc[mask, vat_col],
+            'is_excess_usage': True,
+        }))
+        # SMS/MMS usage
+        for keyword, service_type in (('SMS', 'sms'), ('MMS', 'mms')):
+            mask = valid & is_occurrence & item_name.str.contains(keyword, na=False, regex=False)
+            categories.append((mask, usage_keys, {
+                'service_name': item_name[mask],
+                'service_type': service_type,
+                'amount': 0.0,
+                'quantity': usage(mask, amount_col).astype(int),
+                'unit': keyword,
+                'total': 0.0,
+                'is_excess_usage': False,
+            }))
+        # Call usage
+        mask = valid & has_item_name & (uom == 'Second')
+        categories.append((mask, usage_keys, {
+            'service_name': item_name[mask],
+            'service_type': 'voice',
+            'amount': 0.0,
+            'quantity': usage(mask, volume_col),
+            'unit': 'Second',
+            'total': 0.0,
+            'is_excess_usage': False,
+        }))
+        # Data usage, converted from bytes to MB for consistency with Telekom reports
+        mask = valid & has_item_name & (uom == 'Byte')
+        categories.append((mask, usage_keys, {
+            'service_name': item_name[mask],
+            'service_type': 'data',
+            'amount': 0.0,
+            'quantity': usage(mask, volume_col) / (1024 * 1024),
+            'unit': 'MB',
+            'total': 0.0,
+            'is_excess_usage': False,
+        }))
+
+        return self._build_csv_lines(phone_rank, phone_numbers, categories)
+
     
     # Legacy methods removed - only using implementations with parameters
     
@@ -812,109 +975,109 @@ class ContractMobileInvoice(models.Model):
                 excess_usage_by_partner[line.partner_id.id]['total_0'] += line.total
 
         _logger.info("Processing excess usage for all partners")
-        
-        # Process each partner's excess usage
-        for partner_data in excess_usage_by_partner.values():
-            # Skip if no excess usage in either VAT rate
-            if partner_data['total_23'] <= 0 and partner_data['total_0'] <= 0:
-                continue
-                
-            _logger.info(f"Found excess usage totals - 23% VAT: {partner_data['total_23']}, 0% VAT: {partner_data['total_0']} for partner {partner_data['partner'].name}")
-            
-            # Find the mobilky contract for this partner
-            contract = self.env['contract.contract'].search([
-                ('partner_id', '=', partner_data['partner'].id),
-                ('x_contract_type', '=', 'Mobilky')
-            ])
+
+        # Skip partners without excess usage in either VAT rate
+        excess_usage_by_partner = {
+            partner_id: partner_data
+            for partner_id, partner_data in excess_usage_by_partner.items()
+            if partner_data['total_23'] > 0 or partner_data['total_0'] > 0
+        }
+        if not excess_usage_by_partner:
+            return True
+
+        # Get products for both VAT rates
+        product_23, product_0 = self._get_hlas_products()
+        if not (product_23 and product_0):
+            _logger.error("Could not find both Vyúčtovanie products (23% and 0%)")
+            return True
+
+        # Find the mobilky contracts of all the partners in one query
+        Contract = self.env['contract.contract']
+        partner_contracts = defaultdict(lambda: Contract)
+        for contract in Contract.search([
+            ('partner_id', 'in', list(excess_usage_by_partner)),
+            ('x_contract_type', '=', 'Mobilky'),
+        ]):
+            partner_contracts[contract.partner_id.id] |= contract
+
+        contract_by_partner = {}
+        for partner_id, partner_data in excess_usage_by_partner.items():
+            contract = partner_contracts[partner_id]
             if len(contract) > 1:
                 for c in contract:
                     if c.nadspotreba:
                         contract = c
                         break
             if len(contract) > 1:
-                raise UserError(_("Found multiple Mobilky contracts for partner {partner_data['partner'].name}"))
+                raise UserError(
+                    _("Found multiple Mobilky contracts for partner %s")
+                    % partner_data['partner'].name
+                )
             if not contract:
                 _logger.info(f"No active Mobilky contract found for partner {partner_data['partner'].name}")
                 continue
-                
-            _logger.info(f"Found contract: {contract.name}")
-            
-            # Get products for both VAT rates
-            product_23 = self.env['product.product'].search([
-                ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 23%')
-            ], limit=1)
-            
-            product_0 = self.env['product.product'].search([
-                ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 0%')
-            ], limit=1)
-            
-            if not (product_23 and product_0):
-                _logger.error("Could not find both Vyúčtovanie products (23% and 0%)")
-                continue
-            
-            # Handle 23% VAT line
-            if partner_data['total_23'] > 0:
-                existing_line_23 = contract.contract_line_ids.filtered(
-                    lambda l: l.product_id == product_23
-                )
-                
-                if existing_line_23:
-                    new_total = existing_line_23.price_unit + partner_data['total_23']
-                    _logger.info(f"Updating existing 23% VAT line - current: {existing_line_23.price_unit}, adding: {partner_data['total_23']}, new total: {new_total}")
-                    
-                    existing_line_23.with_context(skip_date_check=True).write({
-                        'price_unit': new_total,  # Adjust for 23% VAT
-                        'x_zlavnena_cena': new_total,  # Adjust for 23% VAT
-                        'recurring_next_date': contract.recurring_next_date
-                    })
-                else:
-                    _logger.info(f"Creating new 23% VAT line with amount: {partner_data['total_23']}")
-                    self.env['contract.line'].with_context(skip_date_check=True).create({
-                        'contract_id': contract.id,
-                        'product_id': product_23.id,
-                        'name': 'Vyúčtovanie paušálnych služieb a spotreby HLAS 23%',
-                        'quantity': 1,
-                        'price_unit': partner_data['total_23'],  # Adjust for 23% VAT
-                        'recurring_rule_type': 'monthly',
-                        'recurring_interval': 1,
-                        "uom_id": 1,
-                        "x_zlavnena_cena": partner_data['total_23'],  # Adjust for 23% VAT
-                        'date_start': contract.recurring_next_date,
-                        'recurring_next_date': contract.recurring_next_date,
-                        'is_auto_renew': False,
-                    })
-            
-            # Handle 0% VAT line
-            if partner_data['total_0'] > 0:
-                existing_line_0 = contract.contract_line_ids.filtered(
-                    lambda l: l.product_id == product_0
-                )
-                
-                if existing_line_0:
-                    new_total = existing_line_0.price_unit + partner_data['total_0']
-                    _logger.info(f"Updating existing 0% VAT line - current: {existing_line_0.price_unit}, adding: {partner_data['total_0']}, new total: {new_total}")
-                    
-                    existing_line_0.with_context(skip_date_check=True).write({
-                        'price_unit': new_total,
-                        'x_zlavnena_cena': new_total,
-                        'recurring_next_date': contract.recurring_next_date
-                    })
+            _logger.info(
+                f"Found excess usage totals - 23% VAT: {partner_data['total_23']}, 0% VAT: {partner_data['total_0']} "
+                f"for partner {partner_data['partner'].name}, contract: {contract.name}"
+            )
+            contract_by_partner[partner_id] = contract
+
+        # Existing HLAS lines of these contracts, the first one of each
+        # contract and product is updated
+        ContractLine = self.env['contract.line'].with_context(skip_date_check=True)
+        contracts = Contract.union(*contract_by_partner.values())
+        existing_lines = {}
+        for contract_line in ContractLine.search([
+            ('contract_id', 'in', contracts.ids),
+            ('product_id', 'in', (product_23 | product_0).ids),
+        ]):
+            existing_lines.setdefault(
+                (contract_line.contract_id.id, contract_line.product_id.id),
+                contract_line,
+            )
+
+        lines_to_update = defaultdict(lambda: ContractLine)
+        vals_list = []
+        for partner_id, contract in contract_by_partner.items():
+            partner_data = excess_usage_by_partner[partner_id]
+            for product, total, vat, name in (
+                (product_23, partner_data['total_23'], '23%', HLAS_PRODUCT_23_NAME),
+                (product_0, partner_data['total_0'], '0%', HLAS_PRODUCT_0_NAME),
+            ):
+                if total <= 0:
+                    continue
+                existing_line = existing_lines.get((contract.id, product.id))
+                if existing_line:
+                    new_total = existing_line.price_unit + total
+                    _logger.info(f"Updating existing {vat} VAT line - current: {existing_line.price_unit}, adding: {total}, new total: {new_total}")
+                    lines_to_update[(new_total, contract.recurring_next_date)] |= existing_line
                 else:
-                    _logger.info(f"Creating new 0% VAT line with amount: {partner_data['total_0']}")
-                    self.env['contract.line'].with_context(skip_date_check=True).create({
+                    _logger.info(f"Creating new {vat} VAT line with amount: {total}")
+                    vals_list.append({
                         'contract_id': contract.id,
-                        'product_id': product_0.id,
-                        'name': 'Vyúčtovanie paušálnych služieb a spotreby HLAS 0%',
+                        'product_id': product.id,
+                        'name': name,
                         'quantity': 1,
-                        'price_unit': partner_data['total_0'],
+                        'price_unit': total,
                         'recurring_rule_type': 'monthly',
                         'recurring_interval': 1,
                         "uom_id": 1,
-                        "x_zlavnena_cena": partner_data['total_0'],
+                        "x_zlavnena_cena": total,
                         'date_start': contract.recurring_next_date,
                         'recurring_next_date': contract.recurring_next_date,
                         'is_auto_renew': False,
                     })
+
+        # One write per distinct amount and date, the contracts already have
+        # this next date so it isn't propagated back to them
+        for (new_total, recurring_next_date), contract_lines in lines_to_update.items():
+            contract_lines.with_context(no_contract_next_date_update=True).write({
+                'price_unit': new_total,
+                'x_zlavnena_cena': new_total,
+                'recurring_next_date': recurring_next_date,
+            })
+        if vals_list:
+            ContractLine.create(vals_list)
                 
         return True
 
@@ -959,6 +1122,18 @@ class ContractMobileInvoice(models.Model):
                     _logger.error(f"Failed to convert value '{value_str}' to float: {str(e)}")
                     return 0.0
 
+    @api.model
+    def _safe_convert_column_to_float(self, column):
+        """Column version of _safe_convert_to_float: the values pandas can't
+        convert are converted one by one."""
+        if pd.api.types.is_numeric_dtype(column):
+            return column.astype(float).fillna(0.0)
+        converted = pd.to_numeric(column, errors='coerce')
+        failed = converted.isna() & column.notna()
+        if failed.any():
+            converted[failed] = column[failed].map(self._safe_convert_to_float)
+        return converted.where(column.notna(), 0.0)
+
     @api.model
     def _clean_phone_number(self, phone_number):
         """Remove all non-numeric characters from a phone number and strip leading '00'"""
@@ -974,18 +1149,13 @@ class ContractMobileInvoice(models.Model):
         _logger.info("Starting monthly reset of excess usage contract lines")
         
         # Find the product for excess usage
-        product_0 = self.env['product.product'].search([
-            ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 0%')
-        ], limit=1)
-        product_23 = self.env['product.product'].search([
-            ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 23%')
-        ], limit=1)
+        product_23, product_0 = self._get_hlas_products()
 
         if not product_0:
-            _logger.error("Could not find product 'Vyúčtovanie paušálnych služieb a spotreby HLAS 0%'")
+            _logger.error(f"Could not find product '{HLAS_PRODUCT_0_NAME}'")
             return
         if not product_23:
-            _logger.error("Could not find product 'Vyúčtovanie paušálnych služieb a spotreby HLAS 23%'")
+            _logger.error(f"Could not find product '{HLAS_PRODUCT_23_NAME}'")
             return            
         # Find all contract lines with this product
         contract_lines_0 = self.env['contract.line'].search([
@@ -1057,16 +1227,19 @@ class ContractMobileInvoiceLine(models.Model):
     
     @api.depends('phone_number')
     def _compute_mobile_service(self):
-        """Find the related mobile service based on phone number"""
+        """Find the related mobile service based on phone number
+
+        Numbers are matched exactly on the normalized number of the active
+        services, resolved for all the lines at once.
+        """
+        cleaned_numbers = {
+            record.id: self._clean_phone_number(record.phone_number) for record in self
+        }
+        services_by_number = self.env['contract.mobile.service']._get_active_services_by_number(
+            cleaned_numbers.values()
+        )
         for record in self:
-            # Clean phone number to ensure consistent format
-            cleaned_number = self._clean_phone_number(record.phone_number)
-            # Search for mobile service with matching number
-            mobile_service = self.env['contract.mobile.service'].search([
-                ('phone_number', 'like', cleaned_number),
-                ('is_active', '=', True),
-            ], limit=1)
-            record.mobile_service_id = mobile_service.id if mobile_service else False
+            record.mobile_service_id = services_by_number.get(cleaned_numbers[record.id], False)
     
     @api.model
     def _clean_phone_number(self, phone_number):
@@ -1085,6 +1258,13 @@ class ContractMobileUsageReport(models.Model):
     _inherit = ['mail.thread', 'mail.activity.mixin']
     _order = "date desc"
 
+    # Processes rendering the Excel reports. They are started from a fork
+    # server, not forked from the (multi-threaded) Odoo process: a forked
+    # child could wait forever on a lock held by another thread (e.g. the
+    # logging one) and would inherit the database connections.
+    _EXCEL_REPORT_WORKERS_PARAM = "contract.mobile_usage_report_workers"
+    _DEFAULT_EXCEL_REPORT_WORKERS = 4
+
     name = fields.Char(string="Name", required=True, tracking=True)
     date = fields.Date(string="Date", required=True, tracking=True)
     partner_id = fields.Many2one(
@@ -1138,148 +1318,130 @@ class ContractMobileUsageReport(models.Model):
             raise UserError(_("No invoices selected for report generation"))
             
         try:
-            # Get all partners with invoice lines across all invoices
-            partner_ids = self.env['res.partner']
-            for invoice in self.invoice_ids:
-                partner_ids |= invoice.invoice_line_ids.mapped('partner_id')
-            _logger.info(f"Found {len(partner_ids)} unique partners with mobile services")
-            
-            for partner in partner_ids:
-                try:
-                    # Find the mobilky contract for this partner
-                    contract = self.env['contract.contract'].search([
-                        ('partner_id', '=', partner.id),
-                        ('x_contract_type', '=', 'Mobilky')
-                    ], limit=1)
-                    
-                    if not contract:
-                        _logger.warning(f"No Mobilky contract found for partner {partner.name}")
-                        continue
+            # Group the lines of all the invoices by partner and phone number
+            lines_by_partner = self._group_invoice_lines()
+            _logger.info(f"Found {len(lines_by_partner)} unique partners with mobile services")
+
+            # Find the mobilky contract of each partner
+            contract_by_partner = {}
+            for contract in self.env['contract.contract'].search([
+                ('partner_id', 'in', [partner.id for partner in lines_by_partner]),
+                ('x_contract_type', '=', 'Mobilky'),
+            ]):
+                contract_by_partner.setdefault(contract.partner_id, contract)
+            for partner in lines_by_partner:
+                if partner not in contract_by_partner:
+                    _logger.warning(f"No Mobilky contract found for partner {partner.name}")
+            if not contract_by_partner:
+                return True
+            partners = [partner for partner in lines_by_partner if partner in contract_by_partner]
 
-                    _logger.info(f"Processing report for partner: {partner.name}")
-                    
-                    # Delete existing reports for this contract
-                    existing_reports = self.env['ir.attachment'].search([
-                        ('res_model', '=', 'contract.contract'),
-                        ('res_id', '=', contract.id),
-                        ('mimetype', '=', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                    ])
-                    if existing_reports:
-                        _logger.info(f"Deleting {len(existing_reports)} existing reports for contract {contract.name}")
-                        existing_reports.sudo().unlink()
-                    
-                    # Create report record for this partner
-                    report = self.create({
-                        'name': f"{self.name}_{partner.name}",
-                        'date': self.date,
-                        'partner_id': partner.id,
-                        'invoice_ids': [(6, 0, self.invoice_ids.ids)],
-                        'company_id': self.company_id.id,
+            # Delete existing reports of these contracts
+            existing_reports = self.env['ir.attachment'].search([
+                ('res_model', '=', 'contract.contract'),
+                ('res_id', 'in', [contract.id for contract in contract_by_partner.values()]),
+                ('mimetype', '=', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            ])
+            if existing_reports:
+                _logger.info(f"Deleting {len(existing_reports)} existing reports for {len(contract_by_partner)} contracts")
+                existing_reports.sudo().unlink()
+
+            # Create report records for the partners
+            report_date = fields.Date.to_date(self.date)
+            reports = self.create([{
+                'name': f"{self.name}_{partner.name}",
+                'date': self.date,
+                'report_filename': (
+                    f"Výpis_spotreby_{partner.name}_"
+                    f"{report_date.strftime('%m')}_{report_date.strftime('%Y')}.xlsx"
+                ),
+                'partner_id': partner.id,
+                'invoice_ids': [(6, 0, self.invoice_ids.ids)],
+                'company_id': self.company_id.id,
+            } for partner in partners])
+
+            # Report lines of all the partners, in one batch
+            phone_groups_by_partner = {}
+            report_line_vals = []
+            for partner, report in zip(partners, reports):
+                phone_groups = self._get_phone_groups(partner, lines_by_partner[partner])
+                phone_groups_by_partner[partner] = phone_groups
+                for phone_number, data in phone_groups.items():
+                    report_line_vals.append({
+                        'report_id': report.id,
+                        'phone_number': phone_number,
+                        'mobile_service_id': data['mobile_service_id'],
+                        'partner_name': data['partner_name'],
+                        'basic_plan': data['basic_plan'],
+                        'basic_plan_cost': data['basic_plan_cost'],
+                        'excess_usage_cost': data['excess_usage_cost'],
+                        'total_cost': data['total_cost'],
+                        'total_data_usage': data['total_data_usage'],  # Add total data usage
+                        'total_sms_mms_usage': data['total_sms_mms_usage'],  # Add total SMS/MMS usage
+                        'total_call_usage': data['total_call_usage'],  # Add total call usage
+                        'excess_data_usage': data['excess_data_usage'],
+                        'excess_voice_usage': data['excess_voice_usage'],
+                        'excess_sms_usage': data['excess_sms_usage'],
                     })
-                    
-                    # Get invoice lines for this partner across all invoices
-                    invoice_lines = self.env['contract.mobile.invoice.line']
-                    for invoice in self.invoice_ids:
-                        invoice_lines |= invoice.invoice_line_ids.filtered(
-                            lambda l: l.partner_id == partner
-                        )
-                    
-                    # Group lines by phone number
-                    phone_groups = {}
-                    for line in invoice_lines:
-                        phone_key = line.phone_number
-                        if phone_key not in phone_groups:
-                            phone_groups[phone_key] = {
-                                'mobile_service_id': line.mobile_service_id.id if line.mobile_service_id else False,
-                                'partner_name': partner.name,
-                                'phone_number': line.phone_number,
-                                'basic_plan': '',
-                                'basic_plan_cost': 0.0,
-                                'excess_usage_cost': 0.0,
-                                'total_cost': 0.0,
-                                'total_data_usage': 0.0,  # Track total data usage
-                                'total_sms_mms_usage': 0.0,  # Track total SMS/MMS count
-                                'total_call_usage': 0.0,  # Track total call duration
-                                'excess_data_usage': 0.0,
-                                'excess_voice_usage': 0.0,
-                                'excess_sms_usage': 0.0,
-                                'is_company': partner.is_company,
-                            }
-                        
-                        # Update group data based on line type
-                        data = phone_groups[line.phone_number]
-                        if line.service_type == 'basic':
-                            data['basic_plan'] = line.service_name
-                            data['basic_plan_cost'] = line.total
-                        elif line.service_type == 'data':
-                            data['total_data_usage'] += line.quantity  # Track ALL data usage
-                            if line.is_excess_usage:
-                                data['excess_data_usage'] += line.quantity
-                        elif line.service_type == 'voice':
-                            data['total_call_usage'] += line.quantity  # Track ALL call duration
-                            if line.is_excess_usage:
-                                data['excess_voice_usage'] += line.quantity
-                        elif line.service_type in ['sms', 'mms']:
-                            data['total_sms_mms_usage'] += line.quantity  # Track ALL SMS/MMS
-                            if line.is_excess_usage:
-                                data['excess_sms_usage'] += line.quantity
-                        
-                        if line.is_excess_usage:
-                            data['excess_usage_cost'] += line.total
-                        data['total_cost'] += line.total
-                    
-                    # Process each phone number
-                    for phone_number, data in phone_groups.items():
-                        # Create report line
-                        self.env['contract.mobile.usage.report.line'].create({
-                            'report_id': report.id,
-                            'phone_number': phone_number,
-                            'mobile_service_id': data['mobile_service_id'],
-                            'partner_name': data['partner_name'],
-                            'basic_plan': data['basic_plan'],
-                            'basic_plan_cost': data['basic_plan_cost'],
-                            'excess_usage_cost': data['excess_usage_cost'],
-                            'total_cost': data['total_cost'],
-                            'total_data_usage': data['total_data_usage'],  # Add total data usage
-                            'total_sms_mms_usage': data['total_sms_mms_usage'],  # Add total SMS/MMS usage
-                            'total_call_usage': data['total_call_usage'],  # Add total call usage
-                            'excess_data_usage': data['excess_data_usage'],
-                            'excess_voice_usage': data['excess_voice_usage'],
-                            'excess_sms_usage': data['excess_sms_usage'],
-                        })
-                    
-                    # Generate Excel report
-                    report_content = report._generate_excel_report(phone_groups)
-                    if report_content:
-                        report_date = fields.Date.to_date(report.date)
-                        report_filename = (
-                            f"Výpis_spotreby_{partner.name}_"
-                            f"{report_date.strftime('%m')}_{report_date.strftime('%Y')}.xlsx"
-                        )
-                        # Update report record with file
-                        report.write({
-                            'report_file': report_content,
-                            'report_filename': report_filename,
-                            'state': 'done'
-                        })
-                        
-                        # Create new attachment for the contract
-                        attachment = self.env['ir.attachment'].create({
-                            'name': report_filename,
-                            'type': 'binary',
-                            'datas': report_content,
-                            'res_model': 'contract.contract',
-                            'res_id': contract.id,
-                            'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                            'description': f"Report generovaný dňa {fields.Datetime.now() + timedelta(hours=2)}"
-                        })
-                        
-                        _logger.info(f"Successfully generated and attached new report for partner {partner.name}")
-                    
+            self.env['contract.mobile.usage.report.line'].create(report_line_vals)
+
+            # Plain values of the Excel reports, rendered across processes
+            rendered_reports = []
+            reports_data = []
+            for partner, report in zip(partners, reports):
+                _logger.info(f"Processing report for partner: {partner.name}")
+                try:
+                    report_data = report._prepare_excel_report_data(
+                        phone_groups_by_partner[partner], lines_by_partner[partner]
+                    )
                 except Exception as e:
                     _logger.error(f"Error processing partner {partner.name}: {str(e)}")
                     continue
+                if report_data:
+                    rendered_reports.append((partner, report))
+                    reports_data.append(report_data)
+            contents = self._render_excel_reports(reports_data)
+
+            # Store the files: the report files and the contract attachments
+            # are created in one batch
+            attachment_vals = []
+            done_report_ids = []
+            for (partner, report), (content, error) in zip(rendered_reports, contents):
+                if error:
+                    _logger.error(f"Error generating Excel report for partner {partner.name}: {error}")
+                    continue
+                done_report_ids.append(report.id)
+                # File of the report record (report_file)
+                attachment_vals.append({
+                    'name': 'report_file',
+                    'type': 'binary',
+                    'raw': content,
+                    'res_model': report._name,
+                    'res_field': 'report_file',
+                    'res_id': report.id,
+                })
+                # New attachment for the contract
+                attachment_vals.append({
+                    'name': report.report_filename,
+                    'type': 'binary',
+                    'raw': content,
+                    'res_model': 'contract.contract',
+                    'res_id': contract_by_partner[partner].id,
+                    'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    'description': f"Report generovaný dňa {fields.Datetime.now() + timedelta(hours=2)}"
+                })
+            done_reports = self.browse(done_report_ids)
+            if done_reports:
+                self.env['ir.attachment'].sudo().create(attachment_vals)
+                done_reports.invalidate_recordset(['report_file'])
+                done_reports.write({'state': 'done'})
+                _logger.info(f"Successfully generated and attached new reports for {len(done_reports)} partners")
             
+            # Monthly usage history of the pattern check
+            self.env['contract.mobile.usage.fact']._update_from_reports(
+                done_reports
+            )
+
             return True
             
         except Exception as e:
@@ -1288,197 +1450,175 @@ class ContractMobileUsageReport(models.Model):
             
         return False
 
-    def _generate_excel_report(self, phone_groups):
-        """Generate an Excel report file for each partner, containing all their phone numbers.
-        Uses the same formatting and sections as nadspotreba.py."""
-        # Get all invoice lines for the partner across all invoices
-        invoice_lines = self.env['contract.mobile.invoice.line']
-        for invoice in self.invoice_ids:
-            invoice_lines |= invoice.invoice_line_ids.filtered(
-                lambda l: l.partner_id == self.partner_id
-            )
-        try:
-            base_path = os.path.dirname(os.path.abspath(__file__))
-            novem_logo = os.path.join(base_path, '..', 'novem.png')
-            
-            # Group phone numbers by partner
-            partner_groups = {}
-            for phone_number, data in phone_groups.items():
-                # Format phone number consistently
-                formatted_phone = format_phone_number(phone_number)
-                partner_name = data.get('partner_name', 'Unknown')
-                partner_type = 'company' if data.get('is_company') else 'individual'
-                
-                key = (partner_type, partner_name)
-                if key not in partner_groups:
-                    partner_groups[key] = []
-                # Store the formatted phone number
-                data['formatted_phone'] = formatted_phone
-                _logger.info(f"Processing phone number: {formatted_phone} for partner: {partner_name} ({partner_type})")
-                # Format basic plan name
-                data['formatted_plan'] = format_plan_name(data.get('basic_plan', ''))
-                partner_groups[key].append((formatted_phone, data))
-
-            # Continue with workbook creation...
-            wb = Workbook()
-            ws = wb.active
-            
-            # Add NOVEM logo if exists
-            if os.path.exists(novem_logo):
-                insert_image(ws, novem_logo, "A1")
+    def _group_invoice_lines(self, partner=None):
+        """Group the lines of the report invoices in a single pass.
 
-            billing_period = self._get_billing_period_display()
-            ws.cell(row=5, column=1, value="Fakturačné obdobie:").font = Font(bold=True, color="438EAC")
-            ws.cell(row=5, column=2, value=billing_period)
+        :param partner: only keep the lines of this partner
+        :return: ``{partner: {phone_number: [invoice lines]}}``, partners and
+            phone numbers in order of first appearance
+        """
+        lines_by_partner = defaultdict(lambda: defaultdict(list))
+        for line in self.invoice_ids.invoice_line_ids:
+            if not line.partner_id or (partner and line.partner_id != partner):
+                continue
+            lines_by_partner[line.partner_id][line.phone_number].append(line)
+        return lines_by_partner
+
+    def _get_phone_groups(self, partner, lines_by_phone):
+        """Sum the usage of each phone number of the partner, the values of
+        the report lines"""
+        phone_groups = {}
+        for phone_number, lines in lines_by_phone.items():
+            data = phone_groups[phone_number] = {
+                'mobile_service_id': lines[0].mobile_service_id.id if lines[0].mobile_service_id else False,
+                'partner_name': partner.name,
+                'phone_number': phone_number,
+                'basic_plan': '',
+                'basic_plan_cost': 0.0,
+                'excess_usage_cost': 0.0,
+                'total_cost': 0.0,
+                'total_data_usage': 0.0,  # Track total data usage
+                'total_sms_mms_usage': 0.0,  # Track total SMS/MMS count
+                'total_call_usage': 0.0,  # Track total call duration
+                'excess_data_usage': 0.0,
+                'excess_voice_usage': 0.0,
+                'excess_sms_usage': 0.0,
+                'is_company': partner.is_company,
+            }
+            for line in lines:
+                # Update group data based on line type
+                if line.service_type == 'basic':
+                    data['basic_plan'] = line.service_name
+                    data['basic_plan_cost'] = line.total
+                elif line.service_type == 'data':
+                    data['total_data_usage'] += line.quantity  # Track ALL data usage
+                    if line.is_excess_usage:
+                        data['excess_data_usage'] += line.quantity
+                elif line.service_type == 'voice':
+                    data['total_call_usage'] += line.quantity  # Track ALL call duration
+                    if line.is_excess_usage:
+                        data['excess_voice_usage'] += line.quantity
+                elif line.service_type in ['sms', 'mms']:
+                    data['total_sms_mms_usage'] += line.quantity  # Track ALL SMS/MMS
+                    if line.is_excess_usage:
+                        data['excess_sms_usage'] += line.quantity
+
+                if line.is_excess_usage:
+                    data['excess_usage_cost'] += line.total
+                data['total_cost'] += line.total
+        return phone_groups
+
+    def _prepare_excel_report_data(self, phone_groups, lines_by_phone):
+        """Plain values of the Excel report, see ``render_usage_report``.
+
+        :param lines_by_phone: invoice lines of the partner by phone number
+        :return: dict, or False when the partner has no phone number
+        """
+        self.ensure_one()
+        if not phone_groups:
+            return False
+        phones = []
+        for phone_number, data in phone_groups.items():
+            # Format phone number consistently
+            formatted_phone = format_phone_number(phone_number)
+            _logger.info(f"Processing phone number: {formatted_phone} for partner: {data.get('partner_name', 'Unknown')}")
+            phone_lines = lines_by_phone.get(formatted_phone, [])
+            phones.append({
+                'formatted_phone': formatted_phone,
+                'formatted_plan': format_plan_name(data.get('basic_plan', '')),
+                # Rozpis účtovaných poplatkov
+                'excess_lines': [
+                    {'service_name': line.service_name, 'vat': line.vat, 'total': line.total}
+                    for line in phone_lines
+                    if line.is_excess_usage and line.total > 0
+                ],
+                'sms_lines': [
+                    {'service_name': line.service_name, 'quantity': line.quantity}
+                    for line in phone_lines
+                    if line.service_type in ['sms', 'mms']
+                ],
+                'voice_lines': [
+                    {'service_name': line.service_name, 'quantity': line.quantity}
+                    for line in phone_lines
+                    if line.service_type == 'voice'
+                ],
+                'data_lines': [
+                    {'service_name': line.service_name, 'quantity': line.quantity}
+                    for line in phone_lines
+                    if line.service_type == 'data'
+                ],
+                # Only excess charges, not basic plan
+                'excess_total': sum(
+                    line.total for line in phone_lines
+                    if line.is_excess_usage and line.service_type != 'basic'
+                ),
+            })
+        return {
+            'logo_path': LOGO_PATH,
+            'billing_period': self._get_billing_period_display(),
+            # Sort by phone number
+            'phones': sorted(phones, key=lambda phone: phone['formatted_phone']),
+        }
+
+    def _get_excel_report_workers(self):
+        """Number of processes rendering the Excel reports, set with the
+        ``contract.mobile_usage_report_workers`` system parameter, 1 rendering
+        them in the current process"""
+        workers = (
+            self.env['ir.config_parameter']
+            .sudo()
+            .get_param(self._EXCEL_REPORT_WORKERS_PARAM)
+        )
+        try:
+            return int(workers) if workers else min(os.cpu_count() or 1, self._DEFAULT_EXCEL_REPORT_WORKERS)
+        except (TypeError, ValueError):
+            return 1
 
-            current_row = 7  # Start after logo and billing period
+    @api.model
+    def _render_excel_reports(self, reports_data):
+        """Render the workbooks of ``reports_data`` across a process pool.
 
-            thin_border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
+        :return: list of ``(content, error)``, in the same order
+        """
+        workers = min(self._get_excel_report_workers(), len(reports_data))
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=exec,
+                    initargs=(
+                        _RENDER_WORKER_BOOTSTRAP,
+                        {'addons_path': list(odoo.addons.__path__)},
+                    ),
+                ) as executor:
+                    return list(executor.map(
+                        _render_usage_report_safe,
+                        reports_data,
+                        chunksize=max(1, len(reports_data) // (workers * 4)),
+                    ))
+            except Exception as e:
+                _logger.warning(f"Rendering the usage reports in {workers} processes failed, rendering them serially: {str(e)}")
+        return [_render_usage_report_safe(report_data) for report_data in reports_data]
 
-            # Process each partner's data
-            for partner_info, partner_data in partner_groups.items():
-                for phone_number, data in sorted(partner_data):  # Sort by phone number
-                    # Header section
-                    ws.cell(row=current_row, column=1, value="Rozpis spotreby pre telefónne číslo:").font = Font(bold=True, color="438EAC")
-                    ws.cell(row=current_row, column=2, value=data['formatted_phone'])  # Use formatted phone number
-                    current_row += 1
-
-                    # Basic plan section
-                    _logger.info(f"Adding basic plan: {data['formatted_plan']}")
-                    ws.cell(row=current_row, column=1, value=data['formatted_plan'])  # Use formatted plan name
-                    current_row += 2
-                    
-                    # Rozpis účtovaných poplatkov
-                    # Get all excessive usage lines for this phone number
-                    excessive_lines = [line for line in invoice_lines if 
-                                    line.phone_number == phone_number and 
-                                    line.is_excess_usage and 
-                                    line.total > 0]
-                    
-                    if excessive_lines:
-                        ws.cell(row=current_row, column=1, value="Rozpis účtovaných poplatkov:").font = Font(bold=True)
-                        ws.cell(row=current_row, column=2, value="DPH").font = Font(bold=True)
-                        ws.cell(row=current_row, column=3, value="Suma v EUR bez DPH").font = Font(bold=True)
-                        for cell in [ws.cell(row=current_row, column=i) for i in range(1, 4)]:
-                            cell.border = thin_border
-                        current_row += 1
-
-                        # List each excessive usage line separately
-                        for line in excessive_lines:
-                            ws.cell(row=current_row, column=1, value=line.service_name)
-                            ws.cell(row=current_row, column=2, value=line.vat if line.vat else "0%")
-                            x = f"{float(line.total):.4f}".replace('.', ',')
-                            cell = ws.cell(row=current_row, column=3, value=x)
-                            cell.number_format = '0.0000'
-                            for cell in [ws.cell(row=current_row, column=i) for i in range(1, 4)]:
-                                cell.border = thin_border
-                            current_row += 1
-                        current_row += 1
-
-                    # Rozpis SMS / MMS
-                    # Get SMS/MMS, voice, and data usage lines for this phone number
-                    sms_lines = [line for line in invoice_lines if 
-                              line.phone_number == phone_number and 
-                              line.service_type in ['sms', 'mms']]
-                    voice_lines = [line for line in invoice_lines if 
-                                line.phone_number == phone_number and 
-                                line.service_type == 'voice']
-                    data_lines = [line for line in invoice_lines if 
-                               line.phone_number == phone_number and 
-                               line.service_type == 'data']
-
-                    # Rozpis SMS / MMS
-                    if sms_lines:
-                        ws.cell(row=current_row, column=1, value="Rozpis SMS / MMS:").font = Font(bold=True)
-                        ws.cell(row=current_row, column=2, value="Počet kusov").font = Font(bold=True)
-                        for cell in [ws.cell(row=current_row, column=i) for i in range(1, 3)]:
-                            cell.border = thin_border
-                        current_row += 1
-                        
-                        for line in sms_lines:
-                            ws.cell(row=current_row, column=1, value=line.service_name)
-                            ws.cell(row=current_row, column=2, value=f"{int(line.quantity)} ks")
-                            for cell in [ws.cell(row=current_row, column=i) for i in range(1, 3)]:
-                                cell.border = thin_border
-                            current_row += 1
-                        current_row += 1
-
-                    # Rozpis volaní
-                    if voice_lines:
-                        ws.cell(row=current_row, column=1, value="Rozpis volaní:").font = Font(bold=True)
-                        ws.cell(row=current_row, column=2, value="Trvanie hovorov").font = Font(bold=True)
-                        for cell in [ws.cell(row=current_row, column=i) for i in range(1, 3)]:
-                            cell.border = thin_border
-                        current_row += 1
-                        
-                        for line in voice_lines:
-                            ws.cell(row=current_row, column=1, value=line.service_name)
-                            duration = format_duration(line.quantity)
-                            ws.cell(row=current_row, column=2, value=duration)
-                            for cell in [ws.cell(row=current_row, column=i) for i in range(1, 3)]:
-                                cell.border = thin_border
-                            current_row += 1
-                        current_row += 1
-
-                    # Rozpis dát
-                    if data_lines:
-                        ws.cell(row=current_row, column=1, value="Rozpis dát:").font = Font(bold=True)
-                        ws.cell(row=current_row, column=2, value="Spotreba dát").font = Font(bold=True)
-                        for cell in [ws.cell(row=current_row, column=i) for i in range(1, 3)]:
-                            cell.border = thin_border
-                        current_row += 1
-                        
-                        for line in data_lines:
-                            ws.cell(row=current_row, column=1, value=line.service_name)
-                            formatted_usage = format_data_usage(line.quantity)
-                            ws.cell(row=current_row, column=2, value=formatted_usage)
-                            for cell in [ws.cell(row=current_row, column=i) for i in range(1, 3)]:
-                                cell.border = thin_border
-                            current_row += 1
-                        current_row += 1
-
-                    # Total section - only excess charges, not basic plan
-                    excess_total = sum(line.total for line in invoice_lines if 
-                                    line.phone_number == phone_number and 
-                                    line.is_excess_usage and 
-                                    line.service_type != 'basic')
-                    
-                    ws.cell(row=current_row, column=1, value=f"Faktúrovaná suma nad paušál bez DPH:").font = Font(bold=True)
-                    x = f"{float(excess_total):.4f}".replace('.', ',')
-                    cell = ws.cell(row=current_row, column=2, value=x)
-                    cell.number_format = '0.0000'
-                    for cell in [ws.cell(row=current_row, column=i) for i in range(1, 3)]:
-                        cell.border = thin_border
-                    current_row += 3  # Extra space between phone numbers
-
-                # Adjust column widths
-                for col in ws.columns:
-                    max_length = 0
-                    column = get_column_letter(col[0].column)
-                    for cell in col:
-                        try:
-                            if cell.value:
-                                max_length = max(max_length, len(str(cell.value)))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 100)
-                    ws.column_dimensions[column].width = adjusted_width
-
-                # Save workbook to memory
-                output = io.BytesIO()
-                wb.save(output)
-                output.seek(0)
-                report_content = base64.b64encode(output.getvalue())
-                return report_content # Return the first report since we're generating for a specific partner
+    def _generate_excel_report(self, phone_groups, lines_by_phone=None):
+        """Generate an Excel report file for each partner, containing all their phone numbers.
+        Uses the same formatting and sections as nadspotreba.py.
 
+        :param lines_by_phone: invoice lines of the partner by phone number,
+            grouped from the report invoices when not given
+        """
+        if lines_by_phone is None:
+            lines_by_phone = self._group_invoice_lines(self.partner_id)[self.partner_id]
+        try:
+            report_data = self._prepare_excel_report_data(phone_groups, lines_by_phone)
+            if not report_data:
+                return False
+            return base64.b64encode(render_usage_report(report_data))
         except Exception as e:
             _logger.error(f"Error generating Excel report: {str(e)}")
             return False
+
     def _normalize_plan_name(self, plan_name):
         """Normalize plan name from e-Net to NOVEM format"""
         if not plan_name:
@@ -1572,6 +1712,99 @@ class ContractMobileUsageReport(models.Model):
         # If we're here, user is already on a suitable plan
         return None, None
 
+    def _get_plan_usage_limits(self, plan_name):
+        """Monthly SMS/MMS count and call minutes of a plan, None when unlimited
+        or not checked. Returns tuple (sms_limit, voice_limit)"""
+        plan_lower = (plan_name or '').lower()
+
+        # SMS/MMS limits
+        if "nekonečno" in plan_lower:
+            sms_limit = None
+        elif "fér" in plan_lower:
+            sms_limit = 40
+        elif "250" in plan_lower or "150" in plan_lower:
+            sms_limit = 100
+        else:
+            sms_limit = None  # default finite-plan limit
+
+        # Voice limits (in minutes/month)
+        voice_limit = None
+        if "fér" in plan_lower:
+            voice_limit = 50
+        elif "250" in plan_lower:
+            voice_limit = 250
+        elif "150" in plan_lower:
+            voice_limit = 150
+        # else: None -> no voice check
+
+        return sms_limit, voice_limit
+
+    def _get_usage_pattern_stats(self, usage):
+        """Usage statistics of each phone number, evaluated on all the months
+        of all the numbers at once.
+
+        :param usage: DataFrame of the monthly usage with the columns
+            partner_id, phone, date, basic_plan, data_usage (MB or bytes),
+            sms_mms_usage (count) and voice_usage (seconds), sorted by date
+            for each number
+        :return: DataFrame with one row per partner_id and phone, in the
+            order of ``usage``. The limits are the ones of the plan of the
+            last month (current_plan).
+        """
+        keys = ['partner_id', 'phone']
+        usage = usage.copy()
+        usage['current_plan'] = usage.groupby(keys, sort=False)['basic_plan'].transform('last')
+        plans = usage['current_plan'].unique()
+        plan_sizes = {plan: self._get_plan_data_size(plan) for plan in plans}
+        plan_limits = {plan: self._get_plan_usage_limits(plan) for plan in plans}
+        plan_size = usage['current_plan'].map(plan_sizes).astype(float)
+        # No limit (None) compares as NaN, never exceeded
+        sms_limit = usage['current_plan'].map(
+            {plan: limits[0] for plan, limits in plan_limits.items()}
+        ).astype(float)
+        voice_limit = usage['current_plan'].map(
+            {plan: limits[1] for plan, limits in plan_limits.items()}
+        ).astype(float)
+
+        # Above ~100MB as bytes, the data usage is in bytes, otherwise in MB
+        data_usage = usage['data_usage']
+        usage['usage_gb'] = np.where(data_usage > 100000000, data_usage / (1024**3), data_usage / 1024)
+        usage['high_usage'] = np.where(
+            plan_size > 0.5,
+            usage['usage_gb'] > plan_size * 0.9,
+            usage['usage_gb'] > 2,
+        )
+        usage['high_sms'] = usage['sms_mms_usage'] > sms_limit
+        usage['high_voice'] = usage['voice_usage'] / 60.0 > voice_limit
+
+        stats = usage.groupby(keys, sort=False).agg(
+            current_plan=('current_plan', 'last'),
+            months_analyzed=('date', 'size'),
+            total_usage_gb=('usage_gb', 'sum'),
+            high_usage_months=('high_usage', 'sum'),
+            total_sms_count=('sms_mms_usage', 'sum'),
+            high_sms_months=('high_sms', 'sum'),
+            total_voice_seconds=('voice_usage', 'sum'),
+            high_voice_months=('high_voice', 'sum'),
+            # First month of the highest usage
+            max_usage_index=('data_usage', 'idxmax'),
+            max_sms_index=('sms_mms_usage', 'idxmax'),
+            max_voice_index=('voice_usage', 'idxmax'),
+        ).reset_index()
+
+        months_n = stats['months_analyzed']
+        stats['avg_monthly_usage_gb'] = stats['total_usage_gb'] / months_n
+        max_data_usage = usage.loc[stats['max_usage_index'], 'data_usage'].to_numpy()
+        stats['max_usage_gb'] = np.where(max_data_usage > 100000000, max_data_usage / (1024**3), max_data_usage / 1024)
+        stats['max_usage_date'] = usage.loc[stats['max_usage_index'], 'date'].to_numpy()
+        stats['avg_monthly_sms'] = stats['total_sms_count'] / months_n
+        stats['max_sms_count'] = usage.loc[stats['max_sms_index'], 'sms_mms_usage'].to_numpy()
+        stats['max_sms_date'] = usage.loc[stats['max_sms_index'], 'date'].to_numpy()
+        stats['avg_monthly_voice_mins'] = (stats['total_voice_seconds'] / 60.0) / months_n
+        stats['max_voice_mins'] = usage.loc[stats['max_voice_index'], 'voice_usage'].to_numpy() / 60.0
+        stats['max_voice_date'] = usage.loc[stats['max_voice_index'], 'date'].to_numpy()
+        return stats
+
     
     @api.model
     def check_service_usage_patterns(self):
@@ -1597,188 +1830,164 @@ class ContractMobileUsageReport(models.Model):
             start_date = start_date - timedelta(days=start_date.day)  # Last day of month before
             start_date = start_date.replace(day=1)  # First day of the third month back
             
-            recent_reports = self.env['contract.mobile.usage.report'].search([
-                ('date', '>=', start_date),
-                ('date', '<=', end_date),
-                ('state', '=', 'done')
-            ])
+            # Monthly usage of the phones of the partners with at least 2 months of data
+            Fact = self.env['contract.mobile.usage.fact']
+            fact_domain = [('month', '>=', start_date), ('month', '<=', end_date)]
+            partners = [
+                partner for partner, in Fact._read_group(
+                    fact_domain,
+                    ['partner_id'],
+                    having=[('month:count_distinct', '>=', 2)],
+                )
+            ]
+            partner_by_id = {partner.id: partner for partner in partners}
+            usage = pd.DataFrame(
+                [
+                    (fact.partner_id.id, fact.phone_number, fact.month, fact.plan or '',
+                     fact.data_mb, fact.sms_count, fact.voice_s)
+                    for fact in Fact.search_fetch(
+                        fact_domain + [('partner_id', 'in', list(partner_by_id))],
+                        ['partner_id', 'phone_number', 'month', 'plan', 'data_mb', 'voice_s', 'sms_count'],
+                        order='partner_id, phone_number, month',
+                    )
+                ],
+                columns=['partner_id', 'phone', 'date', 'basic_plan', 'data_usage', 'sms_mms_usage', 'voice_usage'],
+            )
 
-            # Group reports by partner
-            partner_reports = {}
-            for report in recent_reports:
-                if report.partner_id not in partner_reports:
-                    partner_reports[report.partner_id] = []
-                partner_reports[report.partner_id].append(report)
+            # Only the numbers still active in contract.mobile.service, with at
+            # least 2 months of data
+            active_phones = {
+                (service.partner_id.id, service.phone_number)
+                for service in self.env['contract.mobile.service'].search_fetch([
+                    ('partner_id', 'in', list(partner_by_id)),
+                    ('is_active', '=', True),
+                    ('ignore_alert', '=', False),
+                ], ['partner_id', 'phone_number'])
+            }
+            months = usage.groupby(['partner_id', 'phone'], sort=False)['date'].transform('size')
+            active = pd.Series(
+                [key in active_phones for key in zip(usage['partner_id'], usage['phone'])],
+                index=usage.index,
+                dtype=bool,
+            )
+            skipped = usage.loc[(months >= 2) & ~active, ['partner_id', 'phone']].drop_duplicates()
+            if not skipped.empty:
+                _logger.info(f"Skipping {len(skipped)} phones no longer active: {', '.join(skipped['phone'])}")
 
-            # Analyze patterns for each partner
+            # Check patterns for each phone number
             issues_found = []
-            for partner, reports in partner_reports.items():
-                if len(reports) < 2:  # Need at least 2 months of data
-                    continue
+            stats = self._get_usage_pattern_stats(usage[(months >= 2) & active])
+            for row in stats.itertuples(index=False):
+                partner = partner_by_id[row.partner_id]
+                phone = row.phone
+                current_plan = row.current_plan
+                current_plan_size = self._get_plan_data_size(current_plan)
+                sms_limit, voice_limit = self._get_plan_usage_limits(current_plan)
+                _logger.info(f"Phone {phone}: Current plan: {current_plan}, Plan size: {current_plan_size} GB")
+
+                months_n = int(row.months_analyzed)
+                high_usage_months = int(row.high_usage_months)
+                high_sms_months = int(row.high_sms_months)
+                high_voice_months = int(row.high_voice_months)
+
+                avg_monthly_usage_gb = float(row.avg_monthly_usage_gb)
+                max_usage_gb = float(row.max_usage_gb)
+                max_usage_month = row.max_usage_date.strftime('%m/%Y')
+                _logger.info(f"Phone {phone}: Avg usage: {avg_monthly_usage_gb:.2f} GB, Max usage: {max_usage_gb:.2f} GB")
+
+                avg_monthly_sms = float(row.avg_monthly_sms)
+                max_sms_count = float(row.max_sms_count)
+                max_sms_month = row.max_sms_date.strftime('%m/%Y')
+
+                avg_monthly_voice_mins = float(row.avg_monthly_voice_mins)
+                max_voice_mins = float(row.max_voice_mins)
+                max_voice_month = row.max_voice_date.strftime('%m/%Y')
+
+                # Decision: upgrades/downgrades
+                if (high_usage_months >= 2) or (sms_limit and high_sms_months >= 2) or (voice_limit and high_voice_months >= 2):
+                    # Recommend a higher data plan (data-based)
+                    recommended_plan, recommended_size = self._get_next_recommended_plan(
+                        current_plan,
+                        avg_monthly_usage_gb
+                    )
 
-                phone_patterns = {}
-                for report in reports:
-                    for line in report.report_line_ids:
-                        if line.phone_number not in phone_patterns:
-                            phone_patterns[line.phone_number] = []
-                        phone_patterns[line.phone_number].append({
-                            'date': report.date,
-                            'data_usage': line.total_data_usage,  # MB
-                            'basic_plan': line.basic_plan,
-                            'mobile_service': line.mobile_service_id,
-                            'total_cost': line.total_cost,
-                            'sms_mms_usage': line.total_sms_mms_usage,   # count
-                            'voice_usage': line.total_call_usage,        # seconds
+                    # If SMS overuse, force into NOVEM 250 family (keep data size)
+                    sms_needs_upgrade = sms_limit and high_sms_months >= 2
+                    if sms_needs_upgrade and "250" not in current_plan:
+                        size_for_suffix = recommended_size or current_plan_size
+                        size_suffix = f"{size_for_suffix}GB" if size_for_suffix else "bez dát"
+                        recommended_plan = f"NOVEM 250 {size_suffix}"
+                        recommended_size = size_for_suffix
+
+                    # If Voice overuse, also force into appropriate family; preference: keep NOVEM 250 if already chosen
+                    voice_needs_upgrade = voice_limit and high_voice_months >= 2
+                    if voice_needs_upgrade and "250" not in (recommended_plan or current_plan):
+                        # Align to NOVEM 250 (voice limit 250) while keeping/bumping data size as already recommended
+                        size_for_suffix = recommended_size or current_plan_size
+                        size_suffix = f"{size_for_suffix}GB" if size_for_suffix else "bez dát"
+                        recommended_plan = f"NOVEM 250 {size_suffix}"
+                        recommended_size = size_for_suffix
+
+                    if recommended_plan:
+                        issues_found.append({
+                            'partner_name': partner.name,
+                            'phone_number': phone,
+                            'current_plan': handle_o2_service_name(current_plan),
+                            'current_plan_size': current_plan_size,
+                            'avg_monthly_usage_gb': avg_monthly_usage_gb,
+                            'max_usage_gb': max_usage_gb,
+                            'max_usage_month': max_usage_month,
+                            'recommended_plan': recommended_plan,
+                            'recommended_plan_size': recommended_size,
+                            'months_analyzed': months_n,
+                            'high_usage_months': high_usage_months,
+                            # SMS fields
+                            'avg_monthly_sms': avg_monthly_sms,
+                            'max_sms_count': max_sms_count,
+                            'max_sms_month': max_sms_month,
+                            'high_sms_months': high_sms_months,
+                            'sms_limit': sms_limit,
+                            # Voice fields
+                            'avg_monthly_voice_mins': avg_monthly_voice_mins,
+                            'max_voice_mins': max_voice_mins,
+                            'max_voice_month': max_voice_month,
+                            'high_voice_months': high_voice_months,
+                            'voice_limit': voice_limit,
+                            'type': 'upgrade',
                         })
 
-                # Check patterns for each phone number
-                for phone, usages in phone_patterns.items():
-                    if len(usages) < 2:  # Need at least 2 months of data for this number
-                        continue
-                        
-                    # Check if the number is still active in contract.mobile.service
-                    active_service = self.env['contract.mobile.service'].search([
-                        ('phone_number', '=', phone),
-                        ('partner_id', '=', partner.id),
-                        ('is_active', '=', True),
-                        ('ignore_alert', '=', False),
-                    ], limit=1)
-                    
-                    if not active_service:
-                        _logger.info(f"Skipping phone {phone} - no longer active for partner {partner.name}")
-                        continue
-
-                    # Sort by date
-                    usages.sort(key=lambda x: x['date'])
+                elif current_plan_size > 0.5:
+                    # Possible downgrade only if current plan has more than 0.5 GB (data-based only, unchanged)
+                    usage_percentage = (avg_monthly_usage_gb / current_plan_size) * 100
+                    max_usage_percentage = (max_usage_gb / current_plan_size) * 100
                     
-                    # Analyze usage
-                    high_usage_months = 0
-                    total_usage_gb = 0.0
-
-                    high_sms_months = 0
-                    total_sms_count = 0
-
-                    high_voice_months = 0
-                    total_voice_seconds = 0
-
-                    current_plan = usages[-1]['basic_plan']
-                    current_plan_size = self._get_plan_data_size(current_plan)
-                    _logger.info(f"Phone {phone}: Current plan: {current_plan}, Plan size: {current_plan_size} GB")
-
-                    # Thresholds based on plan name
-                    plan_lower = current_plan.lower()
-
-                    # SMS/MMS limits
-                    if "nekonečno" in plan_lower:
-                        sms_limit = None
-                    elif "fér" in plan_lower:
-                        sms_limit = 40
-                    elif "250" in plan_lower or "150" in plan_lower:
-                        sms_limit = 100
-                    else:
-                        sms_limit = None  # default finite-plan limit
-
-                    # Voice limits (in minutes/month)
-                    voice_limit = None
-                    if "fér" in plan_lower:
-                        voice_limit = 50
-                    elif "250" in plan_lower:
-                        voice_limit = 250
-                    elif "150" in plan_lower:
-                        voice_limit = 150
-                    # else: None -> no voice check
-
-                    for usage in usages:
-                        # Data
-                        # Convert bytes to GB (1 GB = 1024^3 bytes)
-                        data_usage_bytes = usage['data_usage']
+                    if usage_percentage < 30 and max_usage_percentage < 50:
+                        # Define available plans in descending order
+                        plans = [
+                            (50, '50GB'), (30, '30GB'), (20, '20GB'),
+                            (10, '10GB'), (6, '6GB'), (0.5, '0,5GB')
+                        ]
                         
-                        # Unit detection and conversion
-                        unit = "unknown"
-                        if data_usage_bytes > 100000000:  # If it's in bytes (> ~100MB in bytes)
-                            gb_usage = data_usage_bytes / (1024**3)
-                            unit = "bytes"
-                        else:  # If it's already in MB
-                            gb_usage = data_usage_bytes / 1024
-                            unit = "MB"
-                            
-                        _logger.info(f"Phone {phone}, date {usage['date']}: Data usage detected as {unit}: {data_usage_bytes} -> {gb_usage:.2f} GB")
-                        total_usage_gb += gb_usage
-
-                        # High data month?
-                        if current_plan_size > 0.5 and gb_usage > (current_plan_size * 0.9):
-                            high_usage_months += 1
-                        elif current_plan_size <= 0.5 and gb_usage > 2:
-                            high_usage_months += 1
-
-                        # SMS/MMS
-                        sms_count = usage.get('sms_mms_usage', 0)
-                        total_sms_count += sms_count
-                        if sms_limit and sms_count > sms_limit:
-                            high_sms_months += 1
-
-                        # Voice (seconds -> minutes)
-                        voice_seconds = usage.get('voice_usage', 0) or 0
-                        total_voice_seconds += voice_seconds
-                        if voice_limit:
-                            voice_mins_this_month = voice_seconds / 60.0
-                            if voice_mins_this_month > voice_limit:
-                                high_voice_months += 1
-
-                    # Aggregates
-                    months_n = len(usages)
-
-                    avg_monthly_usage_gb = total_usage_gb / months_n
-                    max_usage = max(usages, key=lambda x: x['data_usage'])
-                    max_data_usage = max_usage['data_usage']
-                    
-                    # Apply the same logic for max usage
-                    if max_data_usage > 100000000:  # If it's in bytes (> ~100MB in bytes)
-                        max_usage_gb = max_data_usage / (1024**3)
-                    else:  # If it's already in MB
-                        max_usage_gb = max_data_usage / 1024
+                        # Find the next plan down that would still comfortably handle max usage
+                        next_lower_plan = None
+                        next_lower_size = 0
                         
-                    max_usage_month = max_usage['date'].strftime('%m/%Y')
-                    
-                    _logger.info(f"Phone {phone}: Raw data usage values: {[u['data_usage'] for u in usages]}")
-                    _logger.info(f"Phone {phone}: Avg usage: {avg_monthly_usage_gb:.2f} GB, Max usage: {max_usage_gb:.2f} GB")
-
-                    avg_monthly_sms = total_sms_count / months_n
-                    max_sms = max(usages, key=lambda x: x.get('sms_mms_usage', 0))
-                    max_sms_count = max_sms.get('sms_mms_usage', 0)
-                    max_sms_month = max_sms['date'].strftime('%m/%Y')
-
-                    avg_monthly_voice_mins = (total_voice_seconds / 60.0) / months_n if months_n else 0.0
-                    max_voice = max(usages, key=lambda x: x.get('voice_usage', 0) or 0)
-                    max_voice_mins = (max_voice.get('voice_usage', 0) or 0) / 60.0
-                    max_voice_month = max_voice['date'].strftime('%m/%Y')
-
-                    # Decision: upgrades/downgrades
-                    if (high_usage_months >= 2) or (sms_limit and high_sms_months >= 2) or (voice_limit and high_voice_months >= 2):
-                        # Recommend a higher data plan (data-based)
-                        recommended_plan, recommended_size = self._get_next_recommended_plan(
-                            current_plan,
-                            avg_monthly_usage_gb
-                        )
-
-                        # If SMS overuse, force into NOVEM 250 family (keep data size)
-                        sms_needs_upgrade = sms_limit and high_sms_months >= 2
-                        if sms_needs_upgrade and "250" not in current_plan:
-                            size_for_suffix = recommended_size or current_plan_size
-                            size_suffix = f"{size_for_suffix}GB" if size_for_suffix else "bez dát"
-                            recommended_plan = f"NOVEM 250 {size_suffix}"
-                            recommended_size = size_for_suffix
-
-                        # If Voice overuse, also force into appropriate family; preference: keep NOVEM 250 if already chosen
-                        voice_needs_upgrade = voice_limit and high_voice_months >= 2
-                        if voice_needs_upgrade and "250" not in (recommended_plan or current_plan):
-                            # Align to NOVEM 250 (voice limit 250) while keeping/bumping data size as already recommended
-                            size_for_suffix = recommended_size or current_plan_size
-                            size_suffix = f"{size_for_suffix}GB" if size_for_suffix else "bez dát"
-                            recommended_plan = f"NOVEM 250 {size_suffix}"
-                            recommended_size = size_for_suffix
-
-                        if recommended_plan:
+                        for size, suffix in plans:
+                            if size < current_plan_size and size >= max_usage_gb * 1.5:  # 50% buffer
+                                prefix = ""
+                                if "Fér" in current_plan:
+                                    prefix = "NOVEM Fér "
+                                elif "250" in current_plan:
+                                    prefix = "NOVEM 250 "
+                                elif "150" in current_plan:
+                                    prefix = "NOVEM 150 "
+                                else:
+                                    prefix = "NOVEM "
+                                next_lower_plan = f"{prefix}{suffix}"
+                                next_lower_size = size
+                                break
+                        
+                        if next_lower_plan:
                             issues_found.append({
                                 'partner_name': partner.name,
                                 'phone_number': phone,
@@ -1787,8 +1996,8 @@ class ContractMobileUsageReport(models.Model):
                                 'avg_monthly_usage_gb': avg_monthly_usage_gb,
                                 'max_usage_gb': max_usage_gb,
                                 'max_usage_month': max_usage_month,
-                                'recommended_plan': recommended_plan,
-                                'recommended_plan_size': recommended_size,
+                                'recommended_plan': next_lower_plan,
+                                'recommended_plan_size': next_lower_size,
                                 'months_analyzed': months_n,
                                 'high_usage_months': high_usage_months,
                                 # SMS fields
@@ -1803,69 +2012,10 @@ class ContractMobileUsageReport(models.Model):
                                 'max_voice_month': max_voice_month,
                                 'high_voice_months': high_voice_months,
                                 'voice_limit': voice_limit,
-                                'type': 'upgrade',
+                                'type': 'downgrade',
+                                'recommended_size': next_lower_size
                             })
-
-                    elif current_plan_size > 0.5:
-                        # Possible downgrade only if current plan has more than 0.5 GB (data-based only, unchanged)
-                        usage_percentage = (avg_monthly_usage_gb / current_plan_size) * 100
-                        max_usage_percentage = (max_usage_gb / current_plan_size) * 100
-                        
-                        if usage_percentage < 30 and max_usage_percentage < 50:
-                            # Define available plans in descending order
-                            plans = [
-                                (50, '50GB'), (30, '30GB'), (20, '20GB'),
-                                (10, '10GB'), (6, '6GB'), (0.5, '0,5GB')
-                            ]
-                            
-                            # Find the next plan down that would still comfortably handle max usage
-                            next_lower_plan = None
-                            next_lower_size = 0
-                            
-                            for size, suffix in plans:
-                                if size < current_plan_size and size >= max_usage_gb * 1.5:  # 50% buffer
-                                    prefix = ""
-                                    if "Fér" in current_plan:
-                                        prefix = "NOVEM Fér "
-                                    elif "250" in current_plan:
-                                        prefix = "NOVEM 250 "
-                                    elif "150" in current_plan:
-                                        prefix = "NOVEM 150 "
-                                    else:
-                                        prefix = "NOVEM "
-                                    next_lower_plan = f"{prefix}{suffix}"
-                                    next_lower_size = size
-                                    break
-                            
-                            if next_lower_plan:
-                                issues_found.append({
-                                    'partner_name': partner.name,
-                                    'phone_number': phone,
-                                    'current_plan': handle_o2_service_name(current_plan),
-                                    'current_plan_size': current_plan_size,
-                                    'avg_monthly_usage_gb': avg_monthly_usage_gb,
-                                    'max_usage_gb': max_usage_gb,
-                                    'max_usage_month': max_usage_month,
-                                    'recommended_plan': next_lower_plan,
-                                    'recommended_plan_size': next_lower_size,
-                                    'months_analyzed': months_n,
-                                    'high_usage_months': high_usage_months,
-                                    # SMS fields
-                                    'avg_monthly_sms': avg_monthly_sms,
-                                    'max_sms_count': max_sms_count,
-                                    'max_sms_month': max_sms_month,
-                                    'high_sms_months': high_sms_months,
-                                    'sms_limit': sms_limit,
-                                    # Voice fields
-                                    'avg_monthly_voice_mins': avg_monthly_voice_mins,
-                                    'max_voice_mins': max_voice_mins,
-                                    'max_voice_month': max_voice_month,
-                                    'high_voice_months': high_voice_months,
-                                    'voice_limit': voice_limit,
-                                    'type': 'downgrade',
-                                    'recommended_size': next_lower_size
-                                })
-            
+        
             # If issues found, send email report
             if issues_found:
                 # Split issues into upgrades and downgrades
@@ -2169,6 +2319,25 @@ def handle_o2_service_name(name):
 
     return name
 
+def classify_service_type(service_names):
+    """Service type of paid extra services, from a column of their names"""
+    lowered = service_names.str.lower()
+    return pd.Series(
+        np.select(
+            [
+                lowered.str.contains('data', regex=False),
+                lowered.str.contains('voice', regex=False) | lowered.str.contains('call', regex=False),
+                lowered.str.contains('sms', regex=False),
+                lowered.str.contains('mms', regex=False),
+                lowered.str.contains('roaming', regex=False),
+            ],
+            ['data', 'voice', 'sms', 'mms', 'roaming'],
+            default='other',
+        ),
+        index=service_names.index,
+        dtype=object,
+    )
+
 def format_plan_name(text):
     """Convert T-Biznis plan names to NOVEM equivalents"""
     if not text:
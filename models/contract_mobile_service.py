@@ -1,10 +1,20 @@
 # Copyright 2025
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+import re
+
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
 
 
+def normalize_phone_number(phone_number):
+    """Digits of a phone number without the leading zeros, the form used to
+    match the numbers of the operator invoices"""
+    if not phone_number:
+        return ''
+    return re.sub(r'\D', '', str(phone_number)).lstrip('0')
+
+
 class ContractMobileService(models.Model):
     _name = "contract.mobile.service"
     _description = "Mobilná služba"
@@ -12,6 +22,12 @@ class ContractMobileService(models.Model):
 
     name = fields.Char(string="Názov", required=True, tracking=True)
     phone_number = fields.Char(string="Telefónne číslo", required=True, tracking=True)
+    phone_number_normalized = fields.Char(
+        string="Normalizované telefónne číslo",
+        compute="_compute_phone_number_normalized",
+        store=True,
+        index=True,
+    )
     operator = fields.Selection(
         selection=[
             ('telekom', 'Telekom'),
@@ -62,6 +78,24 @@ class ContractMobileService(models.Model):
     )
     notes = fields.Text(string="Poznámky")
 
+    @api.depends('phone_number')
+    def _compute_phone_number_normalized(self):
+        for record in self:
+            record.phone_number_normalized = normalize_phone_number(record.phone_number)
+
+    @api.model
+    def _get_active_services_by_number(self, phone_numbers):
+        """Map the given normalized phone numbers to their active service.
+
+        The service with the smallest id wins when a number is used by
+        several active services.
+        """
+        services = self.search([
+            ('phone_number_normalized', 'in', list(set(phone_numbers) - {''})),
+            ('is_active', '=', True),
+        ], order='id desc')
+        return {service.phone_number_normalized: service for service in services}
+
     def _validate_phone_number(self, phone_number):
         """Validate and format phone number"""
         if not phone_number:
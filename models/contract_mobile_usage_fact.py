@@ -0,0 +1,97 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from collections import defaultdict
+
+from odoo import api, fields, models
+from odoo.osv import expression
+
+
+class ContractMobileUsageFact(models.Model):
+    """Monthly usage of a phone number, one row per partner, phone number and
+    month. Filled from the usage reports when they are generated, it is the
+    history analysed by ``check_service_usage_patterns``."""
+
+    _name = "contract.mobile.usage.fact"
+    _description = "Mobile Usage Monthly Fact"
+    _order = "month desc, partner_id, phone_number"
+    _rec_name = "phone_number"
+
+    month = fields.Date(
+        required=True,
+        index=True,
+        help="First day of the month of the usage report",
+    )
+    partner_id = fields.Many2one(
+        comodel_name="res.partner",
+        string="Partner",
+        required=True,
+        ondelete="cascade",
+        index=True,
+    )
+    phone_number = fields.Char(string="Phone Number", required=True, index=True)
+    mobile_service_id = fields.Many2one(
+        comodel_name="contract.mobile.service",
+        string="Mobile Service",
+        ondelete="set null",
+        index=True,
+    )
+    report_id = fields.Many2one(
+        comodel_name="contract.mobile.usage.report",
+        string="Report",
+        ondelete="set null",
+    )
+    plan = fields.Char(string="Basic Plan")
+    data_mb = fields.Float(string="Data Usage (MB)", digits=(16, 6))
+    voice_s = fields.Float(string="Call Usage (s)", digits=(16, 6))
+    sms_count = fields.Float(string="SMS/MMS Count", digits=(16, 0))
+    cost = fields.Float(string="Total Cost", digits=(16, 2))
+
+    _sql_constraints = [
+        (
+            "partner_phone_month_uniq",
+            "unique(partner_id, phone_number, month)",
+            "The usage of a phone number is recorded once per month.",
+        )
+    ]
+
+    @api.model
+    def _update_from_reports(self, reports):
+        """Replace the facts of the partners and months of ``reports`` by the
+        lines of their latest report, so generating the reports of a month
+        again doesn't count it twice"""
+        latest_reports = {}
+        for report in reports.sorted("id"):
+            month = report.date.replace(day=1)
+            latest_reports[(report.partner_id.id, month)] = report
+        if not latest_reports:
+            return self.browse()
+
+        partner_ids_by_month = defaultdict(list)
+        for partner_id, month in latest_reports:
+            partner_ids_by_month[month].append(partner_id)
+        facts = self.sudo()
+        facts.search(
+            expression.OR(
+                [
+                    [("month", "=", month), ("partner_id", "in", partner_ids)]
+                    for month, partner_ids in partner_ids_by_month.items()
+                ]
+            )
+        ).unlink()
+
+        vals_by_phone = {}
+        for (partner_id, month), report in latest_reports.items():
+            for line in report.report_line_ids:
+                vals_by_phone[(partner_id, line.phone_number, month)] = {
+                    "month": month,
+                    "partner_id": partner_id,
+                    "phone_number": line.phone_number,
+                    "mobile_service_id": line.mobile_service_id.id,
+                    "report_id": report.id,
+                    "plan": line.basic_plan or "",
+                    "data_mb": line.total_data_usage,
+                    "voice_s": line.total_call_usage,
+                    "sms_count": line.total_sms_mms_usage,
+                    "cost": line.total_cost,
+                }
+        return facts.create(list(vals_by_phone.values()))
@@ -0,0 +1,304 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""Pure recurrence computations shared by the recurrency mixins.
+
+Every function only depends on its (hashable) arguments, so results are
+memoized: most contract lines share the same recurrence rule, interval,
+invoicing type, offset and dates, and mass recomputations end up hitting
+the cache instead of building new ``relativedelta`` objects for each line.
+
+The ``get_relative_delta``, ``get_next_period_date_end`` and
+``get_next_invoice_date`` methods of ``contract.recurrency.mixin`` stay the
+extension points: when a module overrides one of them, the mixin passes its
+methods to the ``compute_*`` functions and the batch functions (``calc``)
+instead of using the memoized functions.
+"""
+
+import sys
+
+from collections import namedtuple
+from functools import lru_cache
+
+from dateutil.relativedelta import relativedelta
+
+Period = namedtuple("Period", ["date_start", "date_end", "next_invoice_date"])
+
+ONE_DAY = relativedelta(days=1)
+
+
+@lru_cache(maxsize=128)
+def get_relative_delta(recurring_rule_type, interval):
+    """Return a relativedelta for one period.
+
+    When added to the first day of the period,
+    it gives the first day of the next period.
+    """
+    if recurring_rule_type == "daily":
+        return relativedelta(days=interval)
+    elif recurring_rule_type == "weekly":
+        return relativedelta(weeks=interval)
+    elif recurring_rule_type == "monthly":
+        return relativedelta(months=interval)
+    elif recurring_rule_type == "monthlylastday":
+        return relativedelta(months=interval, day=1)
+    elif recurring_rule_type == "quarterly":
+        return relativedelta(months=3 * interval)
+    elif recurring_rule_type == "semesterly":
+        return relativedelta(months=6 * interval)
+    else:
+        return relativedelta(years=interval)
+
+
+def compute_next_period_date_end(
+    next_period_date_start,
+    recurring_rule_type,
+    recurring_interval,
+    max_date_end,
+    next_invoice_date=False,
+    recurring_invoicing_type=False,
+    recurring_invoicing_offset=False,
+    relative_delta=None,
+):
+    """Compute the end date for the next period.
+
+    See ``contract.recurrency.mixin.get_next_period_date_end``.
+
+    :param relative_delta: function computing the delta of one period,
+        :func:`get_relative_delta` by default
+    """
+    relative_delta = relative_delta or get_relative_delta
+    if not next_period_date_start:
+        return False
+    if max_date_end and next_period_date_start > max_date_end:
+        # start is past max date end: there is no next period
+        return False
+    if not next_invoice_date:
+        # regular algorithm
+        next_period_date_end = (
+            next_period_date_start
+            + relative_delta(recurring_rule_type, recurring_interval)
+            - ONE_DAY
+        )
+    else:
+        # special algorithm when the next invoice date is forced
+        if recurring_invoicing_type == "pre-paid":
+            next_period_date_end = (
+                next_invoice_date
+                - relativedelta(days=recurring_invoicing_offset)
+                + relative_delta(recurring_rule_type, recurring_interval)
+                - ONE_DAY
+            )
+        else:  # post-paid
+            next_period_date_end = next_invoice_date - relativedelta(
+                days=recurring_invoicing_offset
+            )
+    if max_date_end and next_period_date_end > max_date_end:
+        # end date is past max_dateEnd: trim it
+        next_period_date_end = max_date_end
+    return next_period_date_end
+
+
+@lru_cache(maxsize=8192)
+def get_next_period_date_end(
+    next_period_date_start,
+    recurring_rule_type,
+    recurring_interval,
+    max_date_end,
+    next_invoice_date=False,
+    recurring_invoicing_type=False,
+    recurring_invoicing_offset=False,
+):
+    """Memoized :func:`compute_next_period_date_end`"""
+    return compute_next_period_date_end(
+        next_period_date_start,
+        recurring_rule_type,
+        recurring_interval,
+        max_date_end,
+        next_invoice_date,
+        recurring_invoicing_type,
+        recurring_invoicing_offset,
+    )
+
+
+def compute_next_invoice_date(
+    next_period_date_start,
+    recurring_invoicing_type,
+    recurring_invoicing_offset,
+    recurring_rule_type,
+    recurring_interval,
+    max_date_end,
+    next_period_date_end_function=None,
+):
+    """Compute the invoice date of the period starting on
+    ``next_period_date_start``.
+
+    :param next_period_date_end_function: function computing the end of the
+        period, :func:`get_next_period_date_end` by default
+    """
+    next_period_date_end_function = (
+        next_period_date_end_function or get_next_period_date_end
+    )
+    next_period_date_end = next_period_date_end_function(
+        next_period_date_start,
+        recurring_rule_type,
+        recurring_interval,
+        max_date_end=max_date_end,
+    )
+    if not next_period_date_end:
+        return False
+    if recurring_invoicing_type == "pre-paid":
+        return next_period_date_start + relativedelta(days=recurring_invoicing_offset)
+    # post-paid
+    return next_period_date_end + relativedelta(days=recurring_invoicing_offset)
+
+
+@lru_cache(maxsize=8192)
+def get_next_invoice_date(
+    next_period_date_start,
+    recurring_invoicing_type,
+    recurring_invoicing_offset,
+    recurring_rule_type,
+    recurring_interval,
+    max_date_end,
+):
+    """Memoized :func:`compute_next_invoice_date`"""
+    return compute_next_invoice_date(
+        next_period_date_start,
+        recurring_invoicing_type,
+        recurring_invoicing_offset,
+        recurring_rule_type,
+        recurring_interval,
+        max_date_end,
+    )
+
+
+def get_next_period_date_start(last_date_invoiced, date_start, date_end):
+    if last_date_invoiced:
+        next_period_date_start = last_date_invoiced + ONE_DAY
+    else:
+        next_period_date_start = date_start
+    if date_end and next_period_date_start and next_period_date_start > date_end:
+        return False
+    return next_period_date_start
+
+
+def get_next_periods(rows, calc=None):
+    """Batch version of the period computation.
+
+    :param rows: iterable of tuples ``(last_date_invoiced, date_start,
+        date_end, recurring_next_date, recurring_rule_type,
+        recurring_interval, recurring_invoicing_type,
+        recurring_invoicing_offset)``
+    :return: list of :class:`Period`, in the same order as ``rows``, where
+        ``date_end`` takes the forced next invoice date into account and
+        ``next_invoice_date`` is the regular invoice date of the period
+    :param calc: object providing ``get_next_period_date_end`` and
+        ``get_next_invoice_date`` (this module by default)
+    """
+    if calc is None:
+        calc = sys.modules[__name__]
+    periods = []
+    for (
+        last_date_invoiced,
+        date_start,
+        date_end,
+        recurring_next_date,
+        rule_type,
+        interval,
+        invoicing_type,
+        invoicing_offset,
+    ) in rows:
+        period_start = get_next_period_date_start(
+            last_date_invoiced, date_start, date_end
+        )
+        periods.append(
+            Period(
+                period_start,
+                calc.get_next_period_date_end(
+                    period_start,
+                    rule_type,
+                    interval,
+                    date_end,
+                    recurring_next_date,
+                    invoicing_type,
+                    invoicing_offset,
+                ),
+                calc.get_next_invoice_date(
+                    period_start,
+                    invoicing_type,
+                    invoicing_offset,
+                    rule_type,
+                    interval,
+                    date_end,
+                ),
+            )
+        )
+    return periods
+
+
+def get_invoice_schedule(rows, date_to, calc=None):
+    """Project the future invoices of a batch of recurring records.
+
+    The invoicing of each record is replayed period after period, the same
+    way ``_update_recurring_next_date`` moves the dates after each invoice,
+    until the invoice date passes ``date_to`` or the record ends. Records
+    without a positive interval, or whose dates stop moving forward, have
+    no (further) invoices.
+
+    :param rows: iterable of tuples as for :func:`get_next_periods`
+    :param date_to: last invoice date to project
+    :param calc: as for :func:`get_next_periods`
+    :return: list, in the same order as ``rows``, of lists of
+        :class:`Period` whose ``next_invoice_date`` is the invoice date of
+        the period
+    """
+    if calc is None:
+        calc = sys.modules[__name__]
+    schedules = []
+    for (
+        last_date_invoiced,
+        date_start,
+        date_end,
+        recurring_next_date,
+        rule_type,
+        interval,
+        invoicing_type,
+        invoicing_offset,
+    ) in rows:
+        schedule = []
+        schedules.append(schedule)
+        if not interval or interval <= 0:
+            continue
+        period_start = get_next_period_date_start(
+            last_date_invoiced, date_start, date_end
+        )
+        invoice_date = recurring_next_date
+        while period_start and invoice_date and invoice_date <= date_to:
+            period_end = calc.get_next_period_date_end(
+                period_start,
+                rule_type,
+                interval,
+                date_end,
+                invoice_date,
+                invoicing_type,
+                invoicing_offset,
+            )
+            if not period_end:
+                break
+            schedule.append(Period(period_start, period_end, invoice_date))
+            next_period_start = get_next_period_date_start(
+                period_end, date_start, date_end
+            )
+            next_invoice_date = calc.get_next_invoice_date(
+                next_period_start,
+                invoicing_type,
+                invoicing_offset,
+                rule_type,
+                interval,
+                date_end,
+            )
+            if (next_period_start and next_period_start <= period_start) or (
+                next_invoice_date and next_invoice_date <= invoice_date
+            ):
+                break
+            period_start, invoice_date = next_period_start, next_invoice_date
+    return schedules
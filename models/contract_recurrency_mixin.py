@@ -2,10 +2,10 @@
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from dateutil.relativedelta import relativedelta
-
 from odoo import api, fields, models
 
+from . import contract_recurrency_engine as engine
+
 
 class ContractRecurrencyBasicMixin(models.AbstractModel):
     _name = "contract.recurrency.basic.mixin"
@@ -99,24 +99,61 @@ class ContractRecurrencyMixin(models.AbstractModel):
     )
     last_date_invoiced = fields.Date(readonly=True, copy=False)
 
+    _RECURRENCY_METHODS = (
+        "get_relative_delta",
+        "get_next_period_date_end",
+        "get_next_invoice_date",
+    )
+
+    @api.model
+    def _is_recurrency_overridden(self, *method_names):
+        """Whether a module overrides one of ``method_names`` (all the period
+        computation methods by default)"""
+        return any(
+            getattr(type(self), name) is not getattr(ContractRecurrencyMixin, name)
+            for name in method_names or self._RECURRENCY_METHODS
+        )
+
+    @api.model
+    def _get_recurrency_calc(self):
+        """Provider of the period computations of the batch functions of
+        ``contract_recurrency_engine``: the memoized functions, or the
+        methods of the model when a module overrides them."""
+        return self if self._is_recurrency_overridden() else engine
+
+    def _get_next_periods(self):
+        """Compute the next period of all the records in one call.
+
+        :return: dict mapping each record id to a
+            :class:`~.contract_recurrency_engine.Period`
+        """
+        periods = engine.get_next_periods(
+            (
+                (
+                    rec.last_date_invoiced,
+                    rec.date_start,
+                    rec.date_end,
+                    rec.recurring_next_date,
+                    rec.recurring_rule_type,
+                    rec.recurring_interval,
+                    rec.recurring_invoicing_type,
+                    rec.recurring_invoicing_offset,
+                )
+                for rec in self
+            ),
+            self._get_recurrency_calc(),
+        )
+        return dict(zip(self.ids, periods))
+
     @api.depends("last_date_invoiced", "date_start", "date_end")
     def _compute_next_period_date_start(self):
         for rec in self:
             # If we're creating a new line, don't recompute existing ones
             if self.env.context.get("creating_contract_line") and rec.id:
                 continue
-
-            if rec.last_date_invoiced:
-                next_period_date_start = rec.last_date_invoiced + relativedelta(days=1)
-            else:
-                next_period_date_start = rec.date_start
-            if (
-                rec.date_end
-                and next_period_date_start
-                and next_period_date_start > rec.date_end
-            ):
-                next_period_date_start = False
-            rec.next_period_date_start = next_period_date_start
+            rec.next_period_date_start = engine.get_next_period_date_start(
+                rec.last_date_invoiced, rec.date_start, rec.date_end
+            )
 
     @api.depends(
         "next_period_date_start",
@@ -128,15 +165,16 @@ class ContractRecurrencyMixin(models.AbstractModel):
         "recurring_next_date",
     )
     def _compute_next_period_date_end(self):
+        calc = self._get_recurrency_calc()
         for rec in self:
-            rec.next_period_date_end = self.get_next_period_date_end(
+            rec.next_period_date_end = calc.get_next_period_date_end(
                 rec.next_period_date_start,
                 rec.recurring_rule_type,
                 rec.recurring_interval,
-                max_date_end=rec.date_end,
-                next_invoice_date=rec.recurring_next_date,
-                recurring_invoicing_type=rec.recurring_invoicing_type,
-                recurring_invoicing_offset=rec.recurring_invoicing_offset,
+                rec.date_end,
+                rec.recurring_next_date,
+                rec.recurring_invoicing_type,
+                rec.recurring_invoicing_offset,
             )
 
     @api.model
@@ -146,20 +184,7 @@ class ContractRecurrencyMixin(models.AbstractModel):
         When added to the first day of the period,
         it gives the first day of the next period.
         """
-        if recurring_rule_type == "daily":
-            return relativedelta(days=interval)
-        elif recurring_rule_type == "weekly":
-            return relativedelta(weeks=interval)
-        elif recurring_rule_type == "monthly":
-            return relativedelta(months=interval)
-        elif recurring_rule_type == "monthlylastday":
-            return relativedelta(months=interval, day=1)
-        elif recurring_rule_type == "quarterly":
-            return relativedelta(months=3 * interval)
-        elif recurring_rule_type == "semesterly":
-            return relativedelta(months=6 * interval)
-        else:
-            return relativedelta(years=interval)
+        return engine.get_relative_delta(recurring_rule_type, interval)
 
     @api.model
     def get_next_period_date_end(
@@ -180,35 +205,26 @@ class ContractRecurrencyMixin(models.AbstractModel):
         too. In that scenario it required the invoicing type and offset
         arguments.
         """
-        if not next_period_date_start:
-            return False
-        if max_date_end and next_period_date_start > max_date_end:
-            # start is past max date end: there is no next period
-            return False
-        if not next_invoice_date:
-            # regular algorithm
-            next_period_date_end = (
-                next_period_date_start
-                + self.get_relative_delta(recurring_rule_type, recurring_interval)
-                - relativedelta(days=1)
+        if self._is_recurrency_overridden("get_relative_delta"):
+            return engine.compute_next_period_date_end(
+                next_period_date_start,
+                recurring_rule_type,
+                recurring_interval,
+                max_date_end,
+                next_invoice_date,
+                recurring_invoicing_type,
+                recurring_invoicing_offset,
+                relative_delta=self.get_relative_delta,
             )
-        else:
-            # special algorithm when the next invoice date is forced
-            if recurring_invoicing_type == "pre-paid":
-                next_period_date_end = (
-                    next_invoice_date
-                    - relativedelta(days=recurring_invoicing_offset)
-                    + self.get_relative_delta(recurring_rule_type, recurring_interval)
-                    - relativedelta(days=1)
-                )
-            else:  # post-paid
-                next_period_date_end = next_invoice_date - relativedelta(
-                    days=recurring_invoicing_offset
-                )
-        if max_date_end and next_period_date_end > max_date_end:
-            # end date is past max_dateEnd: trim it
-            next_period_date_end = max_date_end
-        return next_period_date_end
+        return engine.get_next_period_date_end(
+            next_period_date_start,
+            recurring_rule_type,
+            recurring_interval,
+            max_date_end,
+            next_invoice_date,
+            recurring_invoicing_type,
+            recurring_invoicing_offset,
+        )
 
     @api.model
     def get_next_invoice_date(
@@ -220,20 +236,23 @@ class ContractRecurrencyMixin(models.AbstractModel):
         recurring_interval,
         max_date_end,
     ):
-        next_period_date_end = self.get_next_period_date_end(
+        if self._is_recurrency_overridden(
+            "get_relative_delta", "get_next_period_date_end"
+        ):
+            return engine.compute_next_invoice_date(
+                next_period_date_start,
+                recurring_invoicing_type,
+                recurring_invoicing_offset,
+                recurring_rule_type,
+                recurring_interval,
+                max_date_end,
+                next_period_date_end_function=self.get_next_period_date_end,
+            )
+        return engine.get_next_invoice_date(
             next_period_date_start,
+            recurring_invoicing_type,
+            recurring_invoicing_offset,
             recurring_rule_type,
             recurring_interval,
-            max_date_end=max_date_end,
+            max_date_end,
         )
-        if not next_period_date_end:
-            return False
-        if recurring_invoicing_type == "pre-paid":
-            recurring_next_date = next_period_date_start + relativedelta(
-                days=recurring_invoicing_offset
-            )
-        else:  # post-paid
-            recurring_next_date = next_period_date_end + relativedelta(
-                days=recurring_invoicing_offset
-            )
-        return recurring_next_date
@@ -120,12 +120,12 @@ class ContractContract(models.Model):
         if not invoices_values:
             return self.env["account.move"]
         moves = self.env["account.move"].create(invoices_values)
-        self._add_contract_origin(moves)
-        self._invoice_followers(moves)
+        moves_by_contract = self._get_moves_by_contract(moves)
+        self._add_contract_origin(moves, moves_by_contract)
+        self._invoice_followers(moves, moves_by_contract)
 
         for contract in self:
-            contract_moves = moves & contract._get_related_invoices()
-            for move in contract_moves:
+            for move in moves_by_contract.get(contract.id, []):
                 contract._copy_mobile_usage_reports_to_invoice(move)
 
         self._compute_recurring_next_date()
@@ -133,9 +133,8 @@ class ContractContract(models.Model):
             installment_line = installment_by_contract.get(contract.id)
             if not installment_line:
                 continue
-            invoice = (
-                moves
-                & contract._get_related_invoices()
+            invoice = moves_by_contract.get(
+                contract.id, self.env["account.move"]
             ).filtered(
                 lambda move: (
                     move.invoice_date == installment_line.delivery_date
@@ -10,3 +10,39 @@ class IrAttachment(models.Model):
             'url': '/web/content/%s?download=true' % self.id,
             'target': 'self',
         }
+
+    def _copy_shared(self, default=None):
+        """Copy the attachment without copying its content.
+
+        The new attachment points to the same filestore file (content
+        addressed by its checksum), so only the metadata row is created.
+        Attachments stored in the database are copied the regular way.
+
+        ``create`` drops the file fields from the values, they are set on
+        the new row afterwards. The filestore garbage collector keeps a file
+        as long as an attachment refers to it.
+        """
+        self.ensure_one()
+        if self.type != 'binary' or not self.store_fname:
+            return self.copy(default)
+        vals = {
+            'name': self.name,
+            'type': 'binary',
+            'mimetype': self.mimetype,
+            'index_content': self.index_content,
+        }
+        vals.update(default or {})
+        attachment = self.create(vals)
+        attachment.flush_recordset()
+        self.env.cr.execute(
+            """
+            UPDATE ir_attachment
+               SET store_fname = %s, checksum = %s, file_size = %s
+             WHERE id = %s
+            """,
+            (self.store_fname, self.checksum, self.file_size, attachment.id),
+        )
+        attachment.invalidate_recordset(
+            ['store_fname', 'checksum', 'file_size', 'db_datas', 'raw', 'datas']
+        )
+        return attachment
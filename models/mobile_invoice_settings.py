@@ -98,12 +98,7 @@ class MobileInvoiceSettings(models.TransientModel):
         _logger.info("Starting monthly removal of excess usage contract lines")
         
         # Find the products for excess usage
-        product_0 = self.env['product.product'].search([
-            ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 0%')
-        ], limit=1)
-        product_23 = self.env['product.product'].search([
-            ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 23%')
-        ], limit=1)
+        product_23, product_0 = self._get_hlas_invoice_products()
 
         if not product_0 and not product_23:
             _logger.error("Could not find Vyúčtovanie products")
@@ -130,13 +125,7 @@ class MobileInvoiceSettings(models.TransientModel):
             raise
 
     def _get_hlas_invoice_products(self):
-        product_23 = self.env['product.product'].search([
-            ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 23%')
-        ], limit=1)
-        product_0 = self.env['product.product'].search([
-            ('display_name', '=', 'Vyúčtovanie paušálnych služieb a spotreby HLAS 0%')
-        ], limit=1)
-        return product_23, product_0
+        return self.env['contract.mobile.invoice']._get_hlas_products()
 
     def action_create_hlas_only_invoices(self):
         self.ensure_one()
@@ -0,0 +1,185 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+"""Write-only XLSX workbooks of the reports.
+
+The rows are streamed to the file instead of keeping a styled cell object for
+each value. The column widths are set from the values (or given up front), as
+the write-only mode needs them before the first row. The logo and the style
+definitions are loaded once per process.
+"""
+
+import io
+import logging
+import os
+from functools import lru_cache
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+_logger = logging.getLogger(__name__)
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "novem.png")
+
+_THIN = Side(style="thin")
+
+# Style components, combined with "+" in the style names ("bold+border")
+STYLE_COMPONENTS = {
+    "bold": {"font": {"bold": True}},
+    "title": {"font": {"bold": True, "color": "438EAC"}},
+    "heading": {"font": {"bold": True, "size": 14}},
+    "negative": {"font": {"bold": True, "color": "B42318"}},
+    "border": {"border": Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)},
+    "header": {"fill": PatternFill("solid", fgColor="D9EAF7")},
+    "alternate": {"fill": PatternFill("solid", fgColor="F5F5F5")},
+    "right": {"alignment": Alignment(horizontal="right")},
+    "date": {"number_format": "DD.MM.YYYY"},
+    "decimal4": {"number_format": "0.0000"},
+    # Formatted with the currency symbol of the writer
+    "amount": {"number_format": '#,##0.00 "%s"'},
+}
+
+
+@lru_cache(maxsize=None)
+def _get_style_attributes(name, currency_symbol=""):
+    """Attributes of the ``NamedStyle`` called ``name``, on top of the
+    default Calibri 11 font"""
+    font = {}
+    attributes = {}
+    for component in name.split("+"):
+        definition = STYLE_COMPONENTS[component]
+        font.update(definition.get("font", {}))
+        attributes.update(
+            (key, value) for key, value in definition.items() if key != "font"
+        )
+    # Cells keep the default font of the workbook unless changed
+    attributes["font"] = Font(name="Calibri", sz=11, **font)
+    if "%s" in attributes.get("number_format", ""):
+        attributes["number_format"] %= currency_symbol
+    return attributes
+
+
+@lru_cache(maxsize=None)
+def _read_logo(path):
+    try:
+        with open(path, "rb") as logo_file:
+            return logo_file.read()
+    except OSError:
+        return None
+
+
+class XlsxReportSheet:
+    """Sheet of a ``XlsxReportWriter``.
+
+    With fixed ``widths``, the rows are written as they are appended. Otherwise
+    they are kept as plain values until the workbook is saved, each column
+    being as wide as its longest value (up to ``max_width``).
+    """
+
+    def __init__(self, writer, title=None, widths=None, max_width=100, freeze_panes=None):
+        self.writer = writer
+        self.worksheet = writer.workbook.create_sheet(title)
+        self.max_width = max_width
+        self._lengths = {}
+        self._rows = None if widths else []
+        if widths:
+            self._set_widths(widths)
+        if freeze_panes:
+            self.worksheet.freeze_panes = freeze_panes
+
+    def _set_widths(self, widths):
+        for column, width in widths.items():
+            if isinstance(column, int):
+                column = get_column_letter(column)
+            self.worksheet.column_dimensions[column].width = width
+
+    def add_logo(self, path=LOGO_PATH, anchor="A1", width=200, height=100):
+        """Add the logo, before the rows of its anchor are written"""
+        data = _read_logo(path)
+        if not data:
+            return
+        try:
+            image = Image(io.BytesIO(data))
+        except Exception as e:
+            _logger.error(f"Error inserting image: {e}")
+            return
+        image.width, image.height = width, height
+        image.anchor = anchor
+        # Row height in points
+        row = int("".join(filter(str.isdigit, anchor)))
+        self.worksheet.row_dimensions[row].height = height * 0.75
+        self.worksheet.add_image(image)
+
+    def append(self, values=(), styles=None):
+        """Append a row.
+
+        :param styles: style name of all the cells, or a sequence with the
+            style name of each cell (None for no style)
+        """
+        if styles is None or isinstance(styles, str):
+            styles = [styles] * len(values)
+        if self._rows is None:
+            self._write(values, styles)
+            return
+        self._rows.append((values, styles))
+        lengths = self._lengths
+        for column, value in enumerate(values, 1):
+            if value:
+                length = len(str(value))
+                if length > lengths.get(column, 0):
+                    lengths[column] = length
+
+    def _write(self, values, styles):
+        row = []
+        for value, style in zip(values, styles):
+            if style:
+                cell = WriteOnlyCell(self.worksheet, value)
+                cell.style = self.writer._get_style(style)
+                row.append(cell)
+            else:
+                row.append(value)
+        self.worksheet.append(row)
+
+    def _flush(self):
+        if self._rows is None:
+            return
+        self._set_widths({
+            column: min(length + 2, self.max_width)
+            for column, length in self._lengths.items()
+        })
+        rows, self._rows = self._rows, None
+        for values, styles in rows:
+            self._write(values, styles)
+
+
+class XlsxReportWriter:
+    """Write-only workbook of a report, see ``XlsxReportSheet``"""
+
+    def __init__(self, currency_symbol=""):
+        self.workbook = Workbook(write_only=True)
+        self.currency_symbol = currency_symbol
+        self._sheets = []
+        self._styles = set()
+
+    def add_sheet(self, title=None, **kwargs):
+        sheet = XlsxReportSheet(self, title, **kwargs)
+        self._sheets.append(sheet)
+        return sheet
+
+    def _get_style(self, name):
+        if name not in self._styles:
+            self.workbook.add_named_style(
+                NamedStyle(name=name, **_get_style_attributes(name, self.currency_symbol))
+            )
+            self._styles.add(name)
+        return name
+
+    def save(self):
+        """Return the XLSX file content (bytes)"""
+        for sheet in self._sheets:
+            sheet._flush()
+        output = io.BytesIO()
+        self.workbook.save(output)
+        return output.getvalue()
@@ -13,3 +13,4 @@ from . import test_bank_statement_sync_alert
 from . import test_customer_document_sender
 from . import test_customer_overpayment_report
 from . import test_account_customer_settlement
+from . import test_contract_mobile_invoice
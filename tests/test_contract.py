@@ -15,6 +15,11 @@ from odoo import fields
 from odoo.exceptions import UserError, ValidationError
 from odoo.tests import Form, common
 
+from odoo.addons.contract.models.contract_line_constraints import (
+    get_allowed,
+    get_allowed_batch,
+)
+
 
 def to_date(date):
     return fields.Date.to_date(date)
@@ -300,6 +305,48 @@ class TestContract(TestContractBase):
         self.assertTrue(invoice_daily)
         self.assertTrue(self.contract.partner_id in invoice_daily.message_partner_ids)
 
+    def test_get_moves_by_contract(self):
+        self.contract.pricelist_id = False
+        contracts = self.contract | self.contract2
+        moves = contracts._recurring_create_invoice()
+        moves_by_contract = contracts._get_moves_by_contract(moves)
+        self.assertEqual(len(moves), 2)
+        for contract in contracts:
+            self.assertEqual(
+                moves_by_contract[contract.id],
+                moves & contract._get_related_invoices(),
+            )
+            self.assertTrue(
+                any(
+                    contract.display_name in body
+                    for body in moves_by_contract[contract.id].message_ids.mapped(
+                        "body"
+                    )
+                )
+            )
+
+    def test_attachment_copy_shared(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "ir_attachment.location", "file"
+        )
+        report = self.env["ir.attachment"].create(
+            {
+                "name": "usage.xlsx",
+                "raw": b"usage report",
+                "res_model": "contract.contract",
+                "res_id": self.contract.id,
+            }
+        )
+        copy = report._copy_shared(
+            {"res_model": "res.partner", "res_id": self.partner.id}
+        )
+        self.assertNotEqual(copy, report)
+        self.assertEqual(copy.res_id, self.partner.id)
+        self.assertEqual(copy.raw, b"usage report")
+        self.assertTrue(report.store_fname)
+        self.assertEqual(copy.store_fname, report.store_fname)
+        self.assertEqual(copy.checksum, report.checksum)
+
     def test_contract_invoice_salesperson(self):
         self.acct_line.recurring_next_date = "2018-02-23"
         self.acct_line.recurring_rule_type = "daily"
@@ -1736,6 +1783,282 @@ class TestContract(TestContractBase):
             len(invoice_lines),
         )
 
+    def test_cron_recurring_create_invoice_chunked(self):
+        self.acct_line.date_start = "2018-01-01"
+        self.acct_line.recurring_invoicing_type = "post-paid"
+        self.acct_line.date_end = "2018-03-15"
+        contracts = self.contract2
+        for _i in range(10):
+            contracts |= self.contract.copy()
+        self.env["contract.contract"].cron_recurring_create_invoice(batch_size=3)
+        invoice_lines = self.env["account.move.line"].search(
+            [("contract_line_id", "in", contracts.mapped("contract_line_ids").ids)]
+        )
+        self.assertEqual(
+            len(contracts.mapped("contract_line_ids")),
+            len(invoice_lines),
+        )
+        self.assertFalse(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("contract.recurring_create_checkpoint")
+        )
+
+    def test_cron_recurring_create_invoice_chunked_resume(self):
+        self.acct_line.date_start = "2018-01-01"
+        self.acct_line.recurring_invoicing_type = "post-paid"
+        self.acct_line.date_end = "2018-03-15"
+        contracts = self.env["contract.contract"]
+        for _i in range(4):
+            contracts |= self.contract.copy()
+        contracts = contracts.sorted("id")
+        done, todo = contracts[:2], contracts[2:]
+        self.env["contract.contract"]._set_recurring_create_checkpoint(
+            self.today, "invoice", done[-1].id
+        )
+        self.env["contract.contract"]._cron_recurring_create(batch_size=1)
+        invoiced = (
+            self.env["account.move.line"]
+            .search(
+                [("contract_line_id", "in", contracts.mapped("contract_line_ids").ids)]
+            )
+            .mapped("contract_line_id.contract_id")
+        )
+        self.assertFalse(invoiced & done)
+        self.assertEqual(invoiced & todo, todo)
+
+    def test_cron_recurring_create_invoice_partitioned(self):
+        self.acct_line.date_start = "2018-01-01"
+        self.acct_line.recurring_invoicing_type = "post-paid"
+        self.acct_line.date_end = "2018-03-15"
+        contracts = self.contract2
+        for _i in range(5):
+            contracts |= self.contract.copy()
+        processed = self.env[
+            "contract.contract"
+        ].cron_recurring_create_invoice_partitioned(partition_size=2)
+        partitions = self.env["contract.invoicing.partition"].search(
+            [("date_ref", "=", self.today)]
+        )
+        self.assertEqual(processed, len(partitions))
+        self.assertEqual(set(partitions.mapped("state")), {"done"})
+        self.assertTrue(all(p.contract_count <= 2 for p in partitions))
+        invoice_lines = self.env["account.move.line"].search(
+            [("contract_line_id", "in", contracts.mapped("contract_line_ids").ids)]
+        )
+        self.assertEqual(
+            len(contracts.mapped("contract_line_ids")),
+            len(invoice_lines),
+        )
+        # A second worker finds nothing left to claim
+        self.assertEqual(
+            self.env["contract.contract"].cron_recurring_create_invoice_partitioned(),
+            0,
+        )
+
+    def test_invoicing_partition_retry_failed(self):
+        Partition = self.env["contract.invoicing.partition"]
+        old_date = self.today - relativedelta(days=31)
+        partitions = Partition.create(
+            [
+                {
+                    "date_ref": date_ref,
+                    "company_id": self.contract.company_id.id,
+                    "contract_id_from": self.contract.id,
+                    "contract_id_to": self.contract.id,
+                    "state": "failed",
+                    "attempt_count": attempt_count,
+                }
+                for date_ref, attempt_count in ((self.today, 1), (old_date, 3))
+            ]
+        )
+        partition = Partition._claim(self.today, "invoice")
+        self.assertEqual(partition, partitions[0])
+        self.assertEqual(partition.state, "processing")
+        self.assertEqual(partition.attempt_count, 2)
+        # No attempt left
+        self.assertFalse(Partition._claim(old_date, "invoice"))
+        Partition._gc_done_partitions()
+        self.assertFalse(partitions[1].exists())
+        self.assertTrue(partitions[0].exists())
+
+    def test_invoicing_partition_stale_processing_attempts(self):
+        Partition = self.env["contract.invoicing.partition"]
+        stale_claim = fields.Datetime.subtract(fields.Datetime.now(), hours=2)
+        partitions = Partition.create(
+            [
+                {
+                    "date_ref": self.today,
+                    "company_id": self.contract.company_id.id,
+                    "contract_id_from": contract_id_from,
+                    "contract_id_to": self.contract.id,
+                    "state": "processing",
+                    "claimed_at": stale_claim,
+                    "attempt_count": attempt_count,
+                }
+                for contract_id_from, attempt_count in ((1, 3), (2, 2))
+            ]
+        )
+        # A worker died on both partitions: the one without attempt left
+        # fails, the other one is claimed again
+        partition = Partition._claim(self.today, "invoice")
+        self.assertEqual(partition, partitions[1])
+        self.assertEqual(partition.attempt_count, 3)
+        self.assertEqual(partitions[0].state, "failed")
+        self.assertTrue(partitions[0].failure_reason)
+        self.assertEqual(partitions[0].attempt_count, 3)
+        self.assertFalse(Partition._claim(self.today, "invoice"))
+
+    def _count_prepare_invoice_queries(self, contracts):
+        self.env.invalidate_all()
+        start = self.env.cr.sql_log_count
+        invoices_values = contracts._prepare_recurring_invoices_values(self.today)
+        return self.env.cr.sql_log_count - start, invoices_values
+
+    def test_prepare_recurring_invoices_values_lines_override(self):
+        ContractContract = type(self.env["contract.contract"])
+        self.assertFalse(self.contract._is_get_lines_to_invoice_overridden())
+
+        def _get_lines_to_invoice(contract, date_ref):
+            return self.env["contract.line"]
+
+        # An override of _get_lines_to_invoice is not bypassed by the batch
+        with patch.object(
+            ContractContract, "_get_lines_to_invoice", _get_lines_to_invoice
+        ):
+            self.assertTrue(self.contract._is_get_lines_to_invoice_overridden())
+            self.assertEqual(
+                self.contract._prepare_recurring_invoices_values(self.today), []
+            )
+        self.assertTrue(self.contract._prepare_recurring_invoices_values(self.today))
+
+    def test_zlava_100_discount_lines(self):
+        self.contract.zlava_100 = True
+        invoices_values = self.contract._prepare_recurring_invoices_values(self.today)
+        discount_lines = [
+            command[2]
+            for command in invoices_values[0]["invoice_line_ids"]
+            if command[2].get("name") == "Zľava 100%"
+        ]
+        taxes = self.product_1.taxes_id.filtered(
+            lambda tax: tax.company_id == self.contract.company_id
+        )
+        self.assertEqual(len(discount_lines), 1)
+        self.assertEqual(discount_lines[0]["tax_ids"], [(6, 0, sorted(taxes.ids))])
+        self.assertLess(discount_lines[0]["price_unit"], 0)
+
+    def test_zlava_100_query_count_per_contract(self):
+        def make_contracts(count, zlava_100):
+            contracts = self.env["contract.contract"]
+            for _i in range(count):
+                contract = self.contract.copy({"zlava_100": zlava_100})
+                contract.contract_line_ids.copy(
+                    {"contract_id": contract.id, "product_id": self.product_2.id}
+                )
+                contracts |= contract
+            return contracts
+
+        # The discount grouping costs a constant number of queries for the
+        # whole batch, and nothing more per invoiced contract
+        one_plain, _values = self._count_prepare_invoice_queries(
+            make_contracts(1, False)
+        )
+        one_zlava, _values = self._count_prepare_invoice_queries(
+            make_contracts(1, True)
+        )
+        three_plain, _values = self._count_prepare_invoice_queries(
+            make_contracts(3, False)
+        )
+        three_zlava, invoices_values = self._count_prepare_invoice_queries(
+            make_contracts(3, True)
+        )
+        self.assertEqual(three_zlava - three_plain, one_zlava - one_plain)
+        self.assertEqual(len(invoices_values), 3)
+
+    def test_get_lines_to_invoice_sections_and_notes(self):
+        ContractLine = self.env["contract.line"]
+        common_vals = {"contract_id": self.contract.id, "name": "x"}
+        section = ContractLine.create(
+            dict(common_vals, display_type="line_section", sequence=1)
+        )
+        self.acct_line.sequence = 2
+        note_previous = ContractLine.create(
+            dict(
+                common_vals,
+                display_type="line_note",
+                note_invoicing_mode="with_previous_line",
+                sequence=3,
+            )
+        )
+        future_line = self.acct_line.copy(
+            {"sequence": 4, "date_start": self.today + relativedelta(years=1)}
+        )
+        note_next = ContractLine.create(
+            dict(
+                common_vals,
+                display_type="line_note",
+                note_invoicing_mode="with_next_line",
+                sequence=5,
+            )
+        )
+        note_after_future = ContractLine.create(
+            dict(
+                common_vals,
+                display_type="line_note",
+                note_invoicing_mode="with_previous_line",
+                sequence=6,
+            )
+        )
+        canceled_line = self.acct_line.copy({"sequence": 7})
+        canceled_line.is_canceled = True
+        lines = self.contract._get_lines_to_invoice(self.today)
+        self.assertEqual(lines, section | self.acct_line | note_previous)
+        self.assertNotIn(future_line, lines)
+        self.assertNotIn(note_next, lines)
+        self.assertNotIn(note_after_future, lines)
+        batch = (self.contract | self.contract2)._get_lines_to_invoice_batch(
+            self.today
+        )
+        self.assertEqual(batch[self.contract.id], lines)
+        self.assertEqual(
+            batch[self.contract2.id], self.contract2._get_lines_to_invoice(self.today)
+        )
+
+    def test_simulate_recurring_create_invoice(self):
+        recurring_next_date = self.acct_line.recurring_next_date
+        moves_before = self.env["account.move"].search_count([])
+        results = self.env["contract.contract"].simulate_recurring_create_invoice(
+            contracts=self.contract
+        )
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual(result["contract_id"], self.contract.id)
+        self.assertEqual(result["invoice_count"], 1)
+        self.assertEqual(result["invoice_line_count"], 1)
+        self.assertGreater(result["amount_untaxed"], 0)
+        self.assertGreaterEqual(result["duration"], 0)
+        self.assertGreater(result["query_count"], 0)
+        self.assertEqual(self.acct_line.recurring_next_date, recurring_next_date)
+        self.assertEqual(self.env["account.move"].search_count([]), moves_before)
+
+    def test_get_next_periods_batch(self):
+        self.acct_line.write(
+            {
+                "date_start": "2018-01-05",
+                "recurring_rule_type": "monthlylastday",
+                "recurring_invoicing_type": "post-paid",
+                "date_end": "2018-03-15",
+            }
+        )
+        lines = self.contract.contract_line_ids | self.contract2.contract_line_ids
+        periods = lines._get_next_periods()
+        for line in lines:
+            self.assertEqual(
+                periods[line.id].date_start, line.next_period_date_start
+            )
+            self.assertEqual(periods[line.id].date_end, line.next_period_date_end)
+        self.assertEqual(periods[self.acct_line.id].date_end, to_date("2018-01-31"))
+
     def test_get_period_to_invoice_monthlylastday_postpaid(self):
         self.acct_line.date_start = "2018-01-05"
         self.acct_line.recurring_invoicing_type = "post-paid"
@@ -2049,8 +2372,6 @@ class TestContract(TestContractBase):
         self.assertEqual(set(lines.mapped("state")), set(states))
         lines = self.env["contract.line"].search([("state", "in", [])])
         self.assertFalse(lines.mapped("state"))
-        with self.assertRaises(TypeError):
-            self.env["contract.line"].search([("state", "in", "upcoming")])
         lines = self.env["contract.line"].search([("state", "not in", [])])
         self.assertEqual(set(lines.mapped("state")), set(states))
         lines = self.env["contract.line"].search([("state", "not in", states)])
@@ -2059,6 +2380,281 @@ class TestContract(TestContractBase):
         lines = self.env["contract.line"].search([("state", "not in", state2)])
         self.assertEqual(set(lines.mapped("state")), set(states) - set(state2))
 
+    def test_contract_line_inventory_sync(self):
+        self.contract.inventory_id = self.env["contract.inventory"].create(
+            {"name": "Test inventory"}
+        )
+        lines = self.acct_line | self.acct_line.copy()
+        lines.write({"in_inventory": True})
+        inventory_lines = lines.inventory_line_ids
+        self.assertEqual(len(inventory_lines), 2)
+        self.assertEqual(set(inventory_lines.mapped("state")), {"assigned"})
+        lines.write({"quantity": 3})
+        self.assertEqual(lines.inventory_line_ids, inventory_lines)
+        self.assertEqual(set(inventory_lines.mapped("quantity")), {3})
+        lines.write({"in_inventory": False})
+        self.assertEqual(set(inventory_lines.mapped("state")), {"returned"})
+
+    def _count_contract_list_queries(self, contracts):
+        self.env.invalidate_all()
+        start = self.env.cr.sql_log_count
+        contracts.read(["show_nadspotreba", "partner_id"])
+        contracts._compute_has_inventory_products()
+        contracts._compute_total_subtotal()
+        return self.env.cr.sql_log_count - start
+
+    def test_contract_list_flags_query_count(self):
+        def make_contracts(count):
+            contracts = self.env["contract.contract"]
+            for _i in range(count):
+                partner = self.partner.copy()
+                contracts |= self.contract.copy(
+                    {"partner_id": partner.id, "x_contract_type": "Mobilky"}
+                )
+            return contracts
+
+        contracts = make_contracts(2)
+        two = self._count_contract_list_queries(contracts)
+        six = self._count_contract_list_queries(contracts | make_contracts(4))
+        self.assertEqual(two, six)
+        self.assertTrue(all(contracts.mapped("show_nadspotreba")))
+        self.assertEqual(
+            contracts[0].total_subtotal,
+            sum(contracts[0].contract_line_ids.mapped("price_subtotal")),
+        )
+        # The stored total follows the lines
+        contracts[0].contract_line_ids[:1].price_unit += 10
+        self.assertEqual(
+            contracts[0].total_subtotal,
+            sum(contracts[0].contract_line_ids.mapped("price_subtotal")),
+        )
+
+    def test_recurrency_methods_overridable(self):
+        ContractLine = type(self.env["contract.line"])
+        line_model = self.env["contract.line"]
+        self.assertFalse(line_model._is_recurrency_overridden())
+        self.assertEqual(
+            line_model.get_next_invoice_date(
+                to_date("2018-01-01"), "post-paid", 0, "monthly", 1, False
+            ),
+            to_date("2018-01-31"),
+        )
+
+        def get_relative_delta(self, recurring_rule_type, interval):
+            return relativedelta(weeks=interval)
+
+        # The period maths follow an override of get_relative_delta
+        with patch.object(ContractLine, "get_relative_delta", get_relative_delta):
+            self.assertTrue(line_model._is_recurrency_overridden())
+            self.assertEqual(line_model._get_recurrency_calc(), line_model)
+            self.assertEqual(
+                line_model.get_next_period_date_end(
+                    to_date("2018-01-01"), "monthly", 1, False
+                ),
+                to_date("2018-01-07"),
+            )
+            self.assertEqual(
+                line_model.get_next_invoice_date(
+                    to_date("2018-01-01"), "post-paid", 0, "monthly", 1, False
+                ),
+                to_date("2018-01-07"),
+            )
+
+    def test_get_allowed_batch(self):
+        today = fields.Date.today()
+        no_successor = namedtuple("Predecessor", "successor_contract_line_id")(False)
+        with_successor = namedtuple("Predecessor", "successor_contract_line_id")(
+            self.acct_line
+        )
+        lines_values = [
+            (
+                date_start,
+                date_end,
+                has_last_date_invoiced,
+                is_auto_renew,
+                has_successor,
+                predecessor_has_successor,
+                is_canceled,
+            )
+            for date_start in (today - timedelta(days=10), today, today + timedelta(days=1))
+            for date_end in (False, today - timedelta(days=1), today, today + timedelta(days=10))
+            for has_last_date_invoiced in (False, True)
+            for is_auto_renew in (False, True)
+            for has_successor in (False, True)
+            for predecessor_has_successor in (False, True)
+            for is_canceled in (False, True)
+            if not date_end or date_end >= date_start
+        ]
+        # Duplicate keys get the same result
+        lines_values += lines_values[::3]
+        expected = [
+            get_allowed(
+                date_start,
+                date_end,
+                has_last_date_invoiced,
+                is_auto_renew,
+                self.acct_line if has_successor else False,
+                with_successor if predecessor_has_successor else no_successor,
+                is_canceled,
+            )
+            for (
+                date_start,
+                date_end,
+                has_last_date_invoiced,
+                is_auto_renew,
+                has_successor,
+                predecessor_has_successor,
+                is_canceled,
+            ) in lines_values
+        ]
+        self.assertEqual(get_allowed_batch(lines_values), expected)
+        self.assertEqual(get_allowed_batch(lines_values, today=today), expected)
+        self.assertTrue(any(expected))
+
+    def test_revenue_forecast(self):
+        self.acct_line.write(
+            {"x_datum_viazanosti_produktu": "2018-02-01", "x_zlavnena_cena": 80}
+        )
+        forecast = self.env["contract.line"].get_revenue_forecast(
+            months=3,
+            date_from=to_date("2018-01-01"),
+            domain=[("id", "=", self.acct_line.id)],
+        )
+        self.assertEqual(
+            [values["month"] for values in forecast],
+            [to_date("2018-01-01"), to_date("2018-02-01"), to_date("2018-03-01")],
+        )
+        # Discounted price until the commitment date
+        self.assertEqual([values["amount"] for values in forecast], [40, 50, 50])
+        self.assertEqual(forecast[0]["partner_id"], self.contract.partner_id.id)
+        self.assertEqual(forecast[0]["company_id"], self.contract.company_id.id)
+        self.assertEqual(forecast[0]["invoice_count"], 1)
+        schedule = self.acct_line._get_forecast_schedule(to_date("2018-03-31"))
+        self.assertEqual(
+            [invoice[:3] for invoice in schedule[self.acct_line.id]],
+            [
+                (to_date("2018-01-15"), to_date("2018-01-01"), to_date("2018-02-14")),
+                (to_date("2018-02-15"), to_date("2018-02-15"), to_date("2018-03-14")),
+                (to_date("2018-03-15"), to_date("2018-03-15"), to_date("2018-04-14")),
+            ],
+        )
+
+    def test_revenue_forecast_invoice_price(self):
+        # Same price as the invoices: the discounted price applies until the
+        # commitment date, even above the regular price
+        self.acct_line.write(
+            {"x_datum_viazanosti_produktu": "2018-02-01", "x_zlavnena_cena": 120}
+        )
+        stalled_line = self.acct_line.copy({"recurring_interval": 0})
+        forecast = self.env["contract.line"].get_revenue_forecast(
+            months=2,
+            date_from="2018-01-01",
+            domain=[("id", "in", (self.acct_line | stalled_line).ids)],
+        )
+        self.assertEqual([values["amount"] for values in forecast], [60, 50])
+        self.assertEqual(
+            stalled_line._get_forecast_schedule(to_date("2018-03-31")),
+            {stalled_line.id: []},
+        )
+        self.assertEqual(
+            self.acct_line._get_invoice_price_unit(100, to_date("2018-01-15")), 120
+        )
+        self.assertEqual(
+            self.acct_line._get_invoice_price_unit(100.004, to_date("2018-02-15")), 100
+        )
+
+    def test_cron_update_contract_line_state(self):
+        ending_line = self.acct_line.copy(
+            {
+                "date_start": self.today - relativedelta(months=2),
+                "recurring_next_date": self.today - relativedelta(months=2),
+                "date_end": self.today,
+                "is_auto_renew": False,
+                "termination_notice_interval": 0,
+            }
+        )
+        starting_line = self.acct_line.copy(
+            {
+                "date_start": self.today + relativedelta(days=1),
+                "recurring_next_date": self.today + relativedelta(days=1),
+            }
+        )
+        self.assertEqual(ending_line.state, "in-progress")
+        self.assertEqual(starting_line.state, "upcoming")
+        self.env["ir.config_parameter"].sudo().set_param(
+            "contract.line_state_last_run", fields.Date.to_string(self.today)
+        )
+        ContractLine = type(self.env["contract.line"])
+        with freeze_time(self.today + relativedelta(days=2)), patch.object(
+            ContractLine, "write", autospec=True, side_effect=ContractLine.write
+        ) as write:
+            self.env["contract.line"].cron_update_state()
+            # Only the stored state is updated
+            write.assert_not_called()
+            self.assertEqual(ending_line.state, "closed")
+            self.assertEqual(starting_line.state, "in-progress")
+            self.assertEqual(
+                self.env["contract.line"].search(
+                    [("state", "=", "closed"), ("id", "=", ending_line.id)]
+                ),
+                ending_line,
+            )
+        self.assertEqual(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("contract.line_state_last_run"),
+            fields.Date.to_string(self.today + relativedelta(days=2)),
+        )
+
+    def test_process_expired_commitments_watermark(self):
+        ContractLine = self.env["contract.line"]
+        old_line = self.acct_line.copy(
+            {"x_datum_viazanosti_produktu": self.today - relativedelta(years=2)}
+        )
+        recent_line = self.acct_line.copy(
+            {"x_datum_viazanosti_produktu": self.today - relativedelta(days=3)}
+        )
+        self.env["ir.config_parameter"].sudo().set_param(
+            "contract.commitment_expiry_last_run",
+            fields.Date.to_string(self.today - relativedelta(days=7)),
+        )
+        processed = ContractLine._process_expired_commitments(self.today)
+        self.assertIn(recent_line, processed)
+        self.assertNotIn(old_line, processed)
+        # Nothing new expired since the last run
+        self.assertFalse(ContractLine._process_expired_commitments(self.today))
+
+    def test_process_expired_commitments_future_date(self):
+        ContractLine = self.env["contract.line"]
+        running_line = self.acct_line.copy(
+            {
+                "x_datum_viazanosti_produktu": self.today + relativedelta(days=3),
+                "commitment": "1_year",
+                "x_zlavnena_cena": 0,
+            }
+        )
+        self.env["ir.config_parameter"].sudo().set_param(
+            "contract.commitment_expiry_last_run",
+            fields.Date.to_string(self.today - relativedelta(days=7)),
+        )
+        # The commitment still runs today: a later reference date doesn't
+        # move the watermark past it
+        processed = ContractLine._process_expired_commitments(
+            self.today + relativedelta(days=10)
+        )
+        self.assertNotIn(running_line, processed)
+        self.assertEqual(running_line.commitment_discount, 2.0)
+        self.assertEqual(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("contract.commitment_expiry_last_run"),
+            fields.Date.to_string(self.today),
+        )
+        with freeze_time(self.today + relativedelta(days=10)):
+            processed = ContractLine._process_expired_commitments()
+        self.assertIn(running_line, processed)
+        self.assertEqual(running_line.commitment_discount, 0.0)
+
     def test_check_auto_renew_contract_line_with_successor(self):
         """
         A contract line with a successor can't be set to auto-renew
@@ -2492,3 +3088,24 @@ class TestContract(TestContractBase):
         self.contract3.contract_line_ids.recurring_next_date = fields.Date.today()
         invoice_id = self.contract3.recurring_create_invoice()
         self.assertEqual(invoice_id.invoice_line_ids[0].name, "Header for May Services")
+
+    def test_marker_lang_data_cached(self):
+        line_model = self.env["contract.line"]
+        date_format, month_names = line_model._get_marker_lang_data("en_US")
+        lang = self.env["res.lang"]._lang_get("en_US")
+        self.assertEqual(date_format, lang.date_format)
+        self.assertEqual(len(month_names), 12)
+        self.assertEqual(month_names["05"], "May")
+        # Only cached within an invoicing run
+        self.assertIsNot(line_model._get_marker_lang_data("en_US")[1], month_names)
+        run_model = line_model.with_context(contract_marker_cache={})
+        month_names = run_model._get_marker_lang_data("en_US")[1]
+        self.assertIs(run_model._get_marker_lang_data("en_US")[1], month_names)
+        self.assertEqual(
+            run_model._get_marker_months_str(
+                to_date("2018-01-01"), to_date("2018-02-28")
+            ),
+            line_model._get_marker_months_str(
+                to_date("2018-01-01"), to_date("2018-02-28")
+            ),
+        )
@@ -0,0 +1,679 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import base64
+import io
+import logging
+import math
+import time
+from datetime import date
+from unittest.mock import patch
+
+from dateutil.relativedelta import relativedelta
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from odoo import fields
+from odoo.modules.module import get_module_resource
+from odoo.tests import common
+
+from odoo.addons.contract.models.contract_mobile_invoice import (
+    HLAS_PRODUCT_0_NAME,
+    HLAS_PRODUCT_23_NAME,
+    format_plan_name,
+    handle_o2_service_name,
+    render_usage_report,
+)
+
+_logger = logging.getLogger(__name__)
+
+TELEKOM_PREFIX = "Charges__BudgetCentre__ProductFamily__Charge__@"
+O2_PREFIX = "Subscribers__Subscriber__"
+O2_USAGE_PREFIX = O2_PREFIX + "InvoiceLines__UsageLines__Usage__"
+
+
+def _classify_service_type(service_name):
+    service_name = service_name.lower()
+    if "data" in service_name:
+        return "data"
+    if "voice" in service_name or "call" in service_name:
+        return "voice"
+    if "sms" in service_name:
+        return "sms"
+    if "mms" in service_name:
+        return "mms"
+    if "roaming" in service_name:
+        return "roaming"
+    return "other"
+
+
+def process_telekom_csv_rowwise(invoice_model, csv_content):
+    """Row by row Telekom parser, reference for the columnar one."""
+    result = []
+    df_raw = pd.read_csv(io.BytesIO(csv_content), encoding="utf-8", low_memory=False)
+    for phone_number, data in df_raw.groupby(TELEKOM_PREFIX + "Label"):
+        phone_number = invoice_model._clean_phone_number(phone_number)
+        if not phone_number.startswith("421"):
+            continue
+        desc = data[TELEKOM_PREFIX + "Desc"]
+        unit_type = data[TELEKOM_PREFIX + "UnitType"]
+        is_tbiznis = desc.str.contains("T-Biznis", na=False)
+        for _i, row in data[is_tbiznis].iterrows():
+            price = invoice_model._safe_convert_to_float(row[TELEKOM_PREFIX + "Price"])
+            result.append(
+                {
+                    "phone_number": phone_number,
+                    "service_name": format_plan_name(row[TELEKOM_PREFIX + "Desc"]),
+                    "service_type": "basic",
+                    "amount": price,
+                    "total": price,
+                    "is_excess_usage": False,
+                    "vat": str(row[TELEKOM_PREFIX + "VatRate"]) + "%",
+                }
+            )
+        paid = data[(data[TELEKOM_PREFIX + "Price"] > 0) & ~is_tbiznis]
+        for _i, row in paid.iterrows():
+            service_name = row[TELEKOM_PREFIX + "Desc"]
+            if pd.isna(service_name):
+                continue
+            price = invoice_model._safe_convert_to_float(row[TELEKOM_PREFIX + "Price"])
+            result.append(
+                {
+                    "phone_number": phone_number,
+                    "service_name": service_name,
+                    "service_type": _classify_service_type(service_name),
+                    "amount": price,
+                    "total": price,
+                    "is_excess_usage": True,
+                    "vat": str(row[TELEKOM_PREFIX + "VatRate"]) + "%",
+                }
+            )
+        usages = [
+            (
+                (unit_type == "Ks") & desc.str.contains("SMS", na=False),
+                "sms",
+                "SMS",
+                lambda units: int(float(units)),
+            ),
+            (
+                (unit_type == "Ks") & desc.str.contains("MMS", na=False),
+                "mms",
+                "MMS",
+                lambda units: int(float(units)),
+            ),
+            (unit_type == "sekundy", "voice", "Second", float),
+            (unit_type == "MB", "data", "MB", float),
+        ]
+        for mask, service_type, unit, convert in usages:
+            for _i, row in data[mask].iterrows():
+                service_name = row[TELEKOM_PREFIX + "Desc"]
+                if pd.isna(service_name):
+                    continue
+                result.append(
+                    {
+                        "phone_number": phone_number,
+                        "service_name": service_name,
+                        "service_type": service_type,
+                        "amount": 0.0,
+                        "quantity": convert(row[TELEKOM_PREFIX + "Units"]),
+                        "unit": unit,
+                        "total": 0.0,
+                        "is_excess_usage": False,
+                    }
+                )
+    return result
+
+
+def process_o2_csv_rowwise(invoice_model, csv_content):
+    """Row by row O2 parser, reference for the columnar one."""
+    result = []
+    df_raw = pd.read_csv(io.BytesIO(csv_content), encoding="utf-8", low_memory=False)
+    msisdn_col = O2_PREFIX + "MSISDN"
+    df_raw[msisdn_col] = df_raw[msisdn_col].ffill()
+    for phone_number, data in df_raw.groupby(msisdn_col):
+        phone_number = invoice_model._clean_phone_number(phone_number)
+        if not phone_number.startswith("421"):
+            continue
+        basic_plan_amount = invoice_model._safe_convert_to_float(
+            data[O2_PREFIX + "SubscriberTotalNETAmount"].iloc[0]
+        )
+        fee_name = data[O2_PREFIX + "InvoiceLines__FeeLines__Fee__FeeName"]
+        recurring_fees = data[
+            (data[O2_PREFIX + "InvoiceLines__FeeLines__Fee__FeeType"] == "recurring_arrears")
+            & ~fee_name.str.contains("VPN", na=False)
+        ]
+        for _i, row in recurring_fees.iterrows():
+            service_name = handle_o2_service_name(
+                row[O2_PREFIX + "InvoiceLines__FeeLines__Fee__FeeName"]
+            )
+            if pd.isna(service_name):
+                continue
+            result.append(
+                {
+                    "phone_number": phone_number,
+                    "service_name": service_name,
+                    "service_type": "basic",
+                    "amount": basic_plan_amount,
+                    "total": basic_plan_amount,
+                    "is_excess_usage": False,
+                }
+            )
+        uom = data[O2_USAGE_PREFIX + "UsageUOM"]
+        item_name = data[O2_USAGE_PREFIX + "UsageItemName"]
+        charged_fees = data[
+            (data[O2_USAGE_PREFIX + "UsageItemNetAmount"] > 0) | (uom == "Money")
+        ]
+        for _i, row in charged_fees.iterrows():
+            service_name = row[O2_USAGE_PREFIX + "UsageItemName"]
+            if pd.isna(service_name):
+                continue
+            amount = invoice_model._safe_convert_to_float(
+                row[O2_USAGE_PREFIX + "UsageItemNetAmount"]
+            )
+            result.append(
+                {
+                    "phone_number": phone_number,
+                    "service_name": service_name,
+                    "service_type": _classify_service_type(service_name),
+                    "amount": amount,
+                    "total": amount,
+                    "vat": row[O2_USAGE_PREFIX + "VAT"],
+                    "is_excess_usage": True,
+                }
+            )
+        usages = [
+            (
+                (uom == "occurrence") & item_name.str.contains("SMS", na=False),
+                "sms",
+                "SMS",
+                lambda row: int(float(row[O2_USAGE_PREFIX + "Amount"])),
+            ),
+            (
+                (uom == "occurrence") & item_name.str.contains("MMS", na=False),
+                "mms",
+                "MMS",
+                lambda row: int(float(row[O2_USAGE_PREFIX + "Amount"])),
+            ),
+            (
+                uom == "Second",
+                "voice",
+                "Second",
+                lambda row: float(row[O2_USAGE_PREFIX + "Volume"]),
+            ),
+            (
+                uom == "Byte",
+                "data",
+                "MB",
+                lambda row: float(row[O2_USAGE_PREFIX + "Volume"]) / (1024 * 1024),
+            ),
+        ]
+        for mask, service_type, unit, quantity in usages:
+            for _i, row in data[mask].iterrows():
+                service_name = row[O2_USAGE_PREFIX + "UsageItemName"]
+                if pd.isna(service_name):
+                    continue
+                result.append(
+                    {
+                        "phone_number": phone_number,
+                        "service_name": service_name,
+                        "service_type": service_type,
+                        "amount": 0.0,
+                        "quantity": quantity(row),
+                        "unit": unit,
+                        "total": 0.0,
+                        "is_excess_usage": False,
+                    }
+                )
+    return result
+
+
+class TestContractMobileInvoice(common.TransactionCase):
+    @classmethod
+    def _read_csv(cls, filename):
+        with open(get_module_resource("contract", filename), "rb") as csv_file:
+            return csv_file.read()
+
+    def assertSameLines(self, lines, expected_lines):
+        def typed(lines):
+            # NaN != NaN, compare them by type only
+            return [
+                {
+                    key: (type(value), None if isinstance(value, float) and math.isnan(value) else value)
+                    for key, value in line.items()
+                }
+                for line in lines
+            ]
+
+        self.assertEqual(len(lines), len(expected_lines))
+        self.assertEqual(typed(lines), typed(expected_lines))
+
+    def test_process_telekom_csv(self):
+        # telekom.csv is an O2 export, telekom_stara.csv is in Telekom format
+        csv_content = self._read_csv("telekom_stara.csv")
+        invoice_model = self.env["contract.mobile.invoice"]
+        lines = invoice_model._process_telekom_csv(csv_content)
+        self.assertTrue(lines)
+        self.assertSameLines(
+            lines, process_telekom_csv_rowwise(invoice_model, csv_content)
+        )
+
+    def test_process_o2_csv(self):
+        csv_content = self._read_csv("O2_invoice.csv")
+        invoice_model = self.env["contract.mobile.invoice"]
+        start = time.perf_counter()
+        lines = invoice_model._process_o2_csv(csv_content)
+        columnar_time = time.perf_counter() - start
+        start = time.perf_counter()
+        expected_lines = process_o2_csv_rowwise(invoice_model, csv_content)
+        rowwise_time = time.perf_counter() - start
+        _logger.info(
+            "O2 CSV parsing of %s lines: columnar %.3fs, row by row %.3fs",
+            len(lines),
+            columnar_time,
+            rowwise_time,
+        )
+        self.assertTrue(lines)
+        self.assertSameLines(lines, expected_lines)
+
+    def test_process_invoice_streaming(self):
+        csv_content = self._read_csv("O2_invoice.csv")
+        invoice = self.env["contract.mobile.invoice"].create(
+            {
+                "name": "O2 streaming",
+                "date": "2025-01-31",
+                "operator": "o2",
+                "csv_file": base64.b64encode(csv_content),
+                "csv_filename": "O2_invoice.csv",
+            }
+        )
+        expected_lines = invoice._process_o2_csv(csv_content)
+        self.env["ir.config_parameter"].sudo().set_param(
+            invoice._STREAMING_IMPORT_THRESHOLD_PARAM, 1
+        )
+        # Small chunks, so phones span several of them
+        with patch.object(type(invoice), "_STREAMING_IMPORT_CHUNK_SIZE", 50):
+            invoice.action_process_invoice()
+        self.assertEqual(invoice.state, "processed")
+        self.assertEqual(invoice.line_count, len(expected_lines))
+        lines = invoice.invoice_line_ids
+        for field in ("phone_number", "service_type"):
+            self.assertEqual(
+                sorted(lines.mapped(field)),
+                sorted(line[field] for line in expected_lines),
+            )
+        self.assertAlmostEqual(
+            sum(lines.mapped("amount")),
+            sum(line["amount"] for line in expected_lines),
+        )
+
+    def test_invoice_line_mobile_service(self):
+        inventory = self.env["contract.inventory"].create({"name": "Mobile inventory"})
+        service_vals = {
+            "name": "NOVEM 20GB",
+            "phone_number": "0905 123 456",
+            "operator": "o2",
+            "inventory_id": inventory.id,
+        }
+        service = self.env["contract.mobile.service"].create(service_vals)
+        self.env["contract.mobile.service"].create(
+            dict(service_vals, phone_number="0905123457", is_active=False)
+        )
+        self.assertEqual(service.phone_number_normalized, "421905123456")
+        invoice = self.env["contract.mobile.invoice"].create(
+            {
+                "name": "O2",
+                "date": "2025-01-31",
+                "operator": "o2",
+                "invoice_line_ids": [
+                    (0, 0, {"phone_number": number})
+                    for number in (
+                        "421905123456",
+                        "00421 905 123 456",
+                        "42190512345",
+                        "421905123457",
+                    )
+                ],
+            }
+        )
+        # Exact matches on the active services only
+        self.assertEqual(
+            [line.mobile_service_id for line in invoice.invoice_line_ids],
+            [service, service, service.browse(), service.browse()],
+        )
+
+    def _create_mobile_services(self, product, count=2):
+        """Mobile services of ``count`` partners, each one with a Mobilky
+        contract having a line of ``product``"""
+        inventory = self.env["contract.inventory"].create({"name": "Mobile inventory"})
+        services = self.env["contract.mobile.service"]
+        for index in range(count):
+            partner = self.env["res.partner"].create({"name": "Mobile %s" % index})
+            contract = self.env["contract.contract"].create(
+                {
+                    "name": "Mobilky %s" % index,
+                    "partner_id": partner.id,
+                    "x_contract_type": "Mobilky",
+                    "line_recurrence": True,
+                    "contract_line_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "product_id": product.id,
+                                "name": product.name,
+                                "quantity": 1,
+                                "uom_id": product.uom_id.id,
+                                "price_unit": 5,
+                                "recurring_rule_type": "monthly",
+                                "recurring_interval": 1,
+                                "date_start": "2025-02-01",
+                                "recurring_next_date": "2025-02-01",
+                                "is_auto_renew": False,
+                            },
+                        ),
+                    ],
+                }
+            )
+            services |= self.env["contract.mobile.service"].create(
+                {
+                    "name": "NOVEM 20GB",
+                    "phone_number": "42190512345%s" % index,
+                    "operator": "o2",
+                    "inventory_id": inventory.id,
+                    "contract_line_id": contract.contract_line_ids.id,
+                }
+            )
+        return services
+
+    def test_action_done_hlas_lines(self):
+        Product = self.env["product.product"]
+        product_23 = Product.create({"name": HLAS_PRODUCT_23_NAME, "type": "service"})
+        product_0 = Product.create({"name": HLAS_PRODUCT_0_NAME, "type": "service"})
+        invoice_model = self.env["contract.mobile.invoice"]
+        IrConfig = self.env["ir.config_parameter"].sudo()
+        IrConfig.set_param(invoice_model._HLAS_PRODUCT_PARAM % "23", product_23.id)
+        IrConfig.set_param(invoice_model._HLAS_PRODUCT_PARAM % "0", product_0.id)
+        self.assertEqual(invoice_model._get_hlas_products(), (product_23, product_0))
+
+        services = self._create_mobile_services(product_0)
+        invoice = invoice_model.create(
+            {
+                "name": "O2",
+                "date": "2025-01-31",
+                "operator": "o2",
+                "invoice_line_ids": [
+                    (0, 0, {
+                        "phone_number": service.phone_number,
+                        "service_type": "data",
+                        "is_excess_usage": True,
+                        "total": total,
+                        "vat": vat,
+                    })
+                    for service in services
+                    for total, vat in ((10.0, "23%"), (2.5, "23%"), (3.0, "0%"))
+                ],
+            }
+        )
+        invoice.action_done()
+        self.assertEqual(invoice.state, "done")
+        for contract in services.contract_id:
+            self.assertEqual(
+                sorted(
+                    (line.product_id.id, line.price_unit, line.x_zlavnena_cena)
+                    for line in contract.contract_line_ids
+                ),
+                sorted([(product_0.id, 8.0, 8.0), (product_23.id, 12.5, 12.5)]),
+            )
+
+    def test_action_generate_report(self):
+        product = self.env["product.product"].create({"name": "NOVEM 20GB", "type": "service"})
+        services = self._create_mobile_services(product, count=3)
+        invoice_lines = [
+            (0, 0, {"phone_number": "421905000000", "service_type": "basic", "total": 9.0}),
+        ]
+        for service in services:
+            invoice_lines += [
+                (0, 0, {
+                    "phone_number": service.phone_number,
+                    "service_name": "NOVEM 20GB",
+                    "service_type": "basic",
+                    "total": 20.0,
+                }),
+                (0, 0, {
+                    "phone_number": service.phone_number,
+                    "service_name": "Data",
+                    "service_type": "data",
+                    "quantity": 1024.0,
+                    "unit": "MB",
+                }),
+                (0, 0, {
+                    "phone_number": service.phone_number,
+                    "service_name": "Roaming",
+                    "service_type": "roaming",
+                    "is_excess_usage": True,
+                    "total": 4.5,
+                    "vat": "23%",
+                }),
+            ]
+        invoice = self.env["contract.mobile.invoice"].create(
+            {
+                "name": "O2",
+                "date": "2025-01-31",
+                "operator": "o2",
+                "invoice_line_ids": invoice_lines,
+            }
+        )
+        report = self.env["contract.mobile.usage.report"].create(
+            {
+                "name": "Usage",
+                "date": "2025-01-31",
+                "partner_id": services[0].partner_id.id,
+                "invoice_ids": [(6, 0, invoice.ids)],
+            }
+        )
+        self.assertTrue(report.action_generate_report())
+
+        reports = self.env["contract.mobile.usage.report"].search(
+            [("partner_id", "in", services.partner_id.ids), ("id", "!=", report.id)]
+        )
+        self.assertEqual(len(reports), 3)
+        for service in services:
+            partner_report = reports.filtered(lambda r: r.partner_id == service.partner_id)
+            self.assertEqual(partner_report.state, "done")
+            self.assertTrue(partner_report.report_file)
+            self.assertRecordValues(
+                partner_report.report_line_ids,
+                [{
+                    "phone_number": service.phone_number,
+                    "mobile_service_id": service.id,
+                    "basic_plan": "NOVEM 20GB",
+                    "basic_plan_cost": 20.0,
+                    "excess_usage_cost": 4.5,
+                    "total_cost": 24.5,
+                    "total_data_usage": 1024.0,
+                }],
+            )
+            self.assertEqual(
+                self.env["ir.attachment"].search_count([
+                    ("res_model", "=", "contract.contract"),
+                    ("res_id", "=", service.contract_id.id),
+                ]),
+                1,
+            )
+            self.assertEqual(
+                partner_report.report_filename,
+                "Výpis_spotreby_%s_01_2025.xlsx" % service.partner_id.name,
+            )
+            self.assertTrue(load_workbook(io.BytesIO(base64.b64decode(partner_report.report_file))))
+
+        # The monthly facts are replaced when the reports are generated again
+        facts = self.env["contract.mobile.usage.fact"].search(
+            [("partner_id", "in", services.partner_id.ids)]
+        )
+        self.assertEqual(len(facts), 3)
+        self.assertEqual(set(facts.mapped("month")), {date(2025, 1, 1)})
+        self.assertEqual(set(facts.mapped("data_mb")), {1024.0})
+        self.assertEqual(set(facts.mapped("cost")), {24.5})
+        report.action_generate_report()
+        facts = self.env["contract.mobile.usage.fact"].search(
+            [("partner_id", "in", services.partner_id.ids)]
+        )
+        self.assertEqual(len(facts), 3)
+
+    def test_render_excel_reports_pool(self):
+        report_model = self.env["contract.mobile.usage.report"]
+        reports_data = [
+            {
+                "logo_path": False,
+                "billing_period": "01.01.2025 - 31.01.2025",
+                "phones": [
+                    {
+                        "formatted_phone": "42190512345%s" % index,
+                        "formatted_plan": "NOVEM 20GB",
+                        "excess_lines": [{"service_name": "Roaming", "vat": "23%", "total": 4.5}],
+                        "sms_lines": [{"service_name": "SMS", "quantity": 3.0}],
+                        "voice_lines": [{"service_name": "Volania", "quantity": 125.0}],
+                        "data_lines": [{"service_name": "Data", "quantity": 2048.0}],
+                        "excess_total": 4.5,
+                    }
+                ],
+            }
+            for index in range(3)
+        ]
+        # The last report is broken, its error doesn't fail the others
+        reports_data.append({"logo_path": False})
+
+        def cell_values(content):
+            sheet = load_workbook(io.BytesIO(content)).active
+            return [[cell.value for cell in row] for row in sheet.iter_rows()]
+
+        IrConfig = self.env["ir.config_parameter"].sudo()
+        IrConfig.set_param(report_model._EXCEL_REPORT_WORKERS_PARAM, 1)
+        serial = report_model._render_excel_reports(reports_data)
+        IrConfig.set_param(report_model._EXCEL_REPORT_WORKERS_PARAM, 2)
+        # The workers really render the reports: the pool doesn't fall back
+        # to the serial rendering
+        with self.assertNoLogs(
+            "odoo.addons.contract.models.contract_mobile_invoice", "WARNING"
+        ):
+            pool = report_model._render_excel_reports(reports_data)
+        self.assertEqual(len(pool), 4)
+        for (serial_content, serial_error), (content, error) in zip(serial[:3], pool[:3]):
+            self.assertFalse(serial_error or error)
+            self.assertEqual(cell_values(content), cell_values(serial_content))
+        self.assertIn("42190512342", str(cell_values(pool[2][0])))
+        self.assertEqual(pool[3][0], None)
+        self.assertTrue(pool[3][1])
+
+    def test_render_usage_report_write_only(self):
+        content = render_usage_report(
+            {
+                "logo_path": False,
+                "billing_period": "01.01.2025 - 31.01.2025",
+                "phones": [
+                    {
+                        "formatted_phone": "421905123456",
+                        "formatted_plan": "NOVEM 20GB",
+                        "excess_lines": [{"service_name": "Roaming", "vat": False, "total": 4.5}],
+                        "sms_lines": [],
+                        "voice_lines": [],
+                        "data_lines": [],
+                        "excess_total": 4.5,
+                    }
+                ],
+            }
+        )
+        sheet = load_workbook(io.BytesIO(content)).active
+        self.assertEqual(sheet["A5"].value, "Fakturačné obdobie:")
+        self.assertEqual(sheet["B7"].value, "421905123456")
+        self.assertEqual(
+            [cell.value for cell in sheet[11]], ["Roaming", "0%", "4,5000"]
+        )
+        self.assertEqual(sheet["C11"].number_format, "0.0000")
+        self.assertEqual(sheet["A10"].style, "bold+border")
+        self.assertTrue(sheet["A10"].font.b)
+        # Styled cells keep the default font
+        self.assertEqual(
+            (sheet["C11"].font.name, sheet["C11"].font.sz), ("Calibri", 11)
+        )
+        # Widths computed from the longest value of each column
+        self.assertEqual(
+            sheet.column_dimensions["A"].width,
+            len("Rozpis spotreby pre telefónne číslo:") + 2,
+        )
+        self.assertEqual(
+            sheet.column_dimensions["C"].width, len("Suma v EUR bez DPH") + 2
+        )
+
+    def test_check_service_usage_patterns(self):
+        product = self.env["product.product"].create({"name": "NOVEM 20GB", "type": "service"})
+        service, ignored_service = self._create_mobile_services(product, count=2)
+        ignored_service.ignore_alert = True
+        this_month = fields.Date.today().replace(day=1)
+        self.env["contract.mobile.usage.fact"].create(
+            [
+                {
+                    "month": this_month - relativedelta(months=months),
+                    "partner_id": service.partner_id.id,
+                    "phone_number": phone_number,
+                    "plan": "NOVEM 20GB",
+                    "data_mb": 19.5 * 1024,
+                }
+                for months in (1, 2, 3)
+                # The second number has no active service
+                for phone_number in (service.phone_number, "421905999999")
+            ]
+            + [
+                {
+                    "month": this_month - relativedelta(months=months),
+                    "partner_id": ignored_service.partner_id.id,
+                    "phone_number": ignored_service.phone_number,
+                    "plan": "NOVEM 20GB",
+                    "data_mb": 19.5 * 1024,
+                }
+                for months in (1, 2)
+            ]
+        )
+        MailMail = type(self.env["mail.mail"])
+        with patch.object(MailMail, "send", autospec=True):
+            self.env["contract.mobile.usage.report"].check_service_usage_patterns()
+        mail = self.env["mail.mail"].search(
+            [("subject", "=", "Sledovanie nadspotreby mobilných služieb")]
+        )
+        self.assertEqual(len(mail), 1)
+        self.assertIn(service.phone_number, mail.body_html)
+        self.assertIn("NOVEM 30GB", mail.body_html)
+        self.assertNotIn("421905999999", mail.body_html)
+        self.assertNotIn(ignored_service.phone_number, mail.body_html)
+
+    def test_usage_pattern_stats(self):
+        usage = pd.DataFrame(
+            [
+                (1, "421905000001", date(2025, 1, 1), "NOVEM Fér 6GB", 6000.0, 50.0, 3600.0),
+                (1, "421905000001", date(2025, 2, 1), "NOVEM Fér 6GB", 6000.0, 30.0, 2400.0),
+                # Data usage in bytes
+                (1, "421905000001", date(2025, 3, 1), "NOVEM 250 10GB", 3 * 1024**3, 120.0, 0.0),
+                (2, "421905000002", date(2025, 2, 1), "NOVEM nekonečno 0,5GB", 2500.0, 500.0, 0.0),
+                (2, "421905000002", date(2025, 3, 1), "NOVEM nekonečno 0,5GB", 3000.0, 500.0, 0.0),
+            ],
+            columns=["partner_id", "phone", "date", "basic_plan", "data_usage", "sms_mms_usage", "voice_usage"],
+        )
+        stats = self.env["contract.mobile.usage.report"]._get_usage_pattern_stats(usage)
+        self.assertEqual(list(stats["phone"]), ["421905000001", "421905000002"])
+        first, second = stats.to_dict("records")
+        # Limits of the current plan: 10GB of data, 100 SMS and 250 minutes
+        self.assertEqual(first["current_plan"], "NOVEM 250 10GB")
+        self.assertEqual(first["months_analyzed"], 3)
+        self.assertEqual(first["high_usage_months"], 0)
+        self.assertEqual(first["high_sms_months"], 1)
+        self.assertEqual(first["high_voice_months"], 0)
+        self.assertAlmostEqual(first["avg_monthly_usage_gb"], (6000 / 1024 * 2 + 3) / 3)
+        self.assertAlmostEqual(first["max_usage_gb"], 3.0)
+        self.assertEqual(first["max_usage_date"], date(2025, 3, 1))
+        self.assertEqual(first["max_sms_date"], date(2025, 3, 1))
+        self.assertAlmostEqual(first["max_voice_mins"], 60.0)
+        self.assertEqual(first["max_voice_date"], date(2025, 1, 1))
+        # Plans up to 0,5GB are over 2GB, without SMS limit
+        self.assertEqual(second["high_usage_months"], 2)
+        self.assertEqual(second["high_sms_months"], 0)
+        self.assertAlmostEqual(second["avg_monthly_sms"], 500.0)
@@ -26,7 +26,9 @@ class ContractDateUpdateWizard(models.TransientModel):
             
             if contract.x_contract_type == 'Mobilky':
                 _logger.info(f"Processing Mobilky contract: {contract.name}")
-                # For Mobilky contracts, use the same domain as the _get_state_domain method for "in-progress" state
+                # For Mobilky contracts, take the lines "in-progress" today. The
+                # dates are checked instead of the stored state, which is only
+                # refreshed by cron_update_state (see _get_state_transition_domain)
                 contract_lines = self.env['contract.line'].search([
                     ('contract_id', '=', contract.id),
                     ('date_start', '<=', today),